@@ -1,64 +1,62 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, Request, WebSocket, WebSocketException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.ext.asyncio import AsyncSession
-from jose import JWTError
-from app.db.session import get_db
-from app.core import security
-from app.schemas import TokenPayload
-from app.crud import user_crud
-from app.models import User
+from app.core import tracing
+from app.core.auth_cache import CurrentUser, auth_cache
+from app.core.config import settings
 from typing import Optional
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="/api/auth/token", auto_error=False)
 
 
 async def get_current_user(
-        db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)
-) -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    payload = security.decode_token(token)
-    if payload is None:
-        raise credentials_exception
-
-    email: str = payload.get("sub")
-    if email is None:
-        raise credentials_exception
-
-    user = await user_crud.get_user_by_email(db, email=email)
+        request: Request, token: str = Depends(oauth2_scheme)
+) -> CurrentUser:
+    """
+    Пользователь по Bearer-токену. Снимок берётся из кэша аутентификации
+    (см. app/core/auth_cache.py), в БД идём только при промахе — по id из токена.
+    """
+    with tracing.span("auth.get_current_user"):
+        user = await auth_cache.get_user(token, request.app.state.redis)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 
+async def get_current_admin(current_user: CurrentUser = Depends(get_current_user)) -> CurrentUser:
+    """Пользователь из ADMIN_EMAILS — для служебных эндпоинтов вроде профайлера."""
+    if current_user.email not in settings.ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    return current_user
+
+
 async def get_current_user_no_exception(
-        db: AsyncSession = Depends(get_db),
-        token: Optional[str] = Depends(oauth2_scheme)
-) -> Optional[User]:
+        request: Request,
+        token: Optional[str] = Depends(oauth2_scheme_optional)
+) -> Optional[CurrentUser]:
     """
     Пытается получить текущего пользователя по токену в заголовке Authorization.
     В случае отсутствия или недействительности токена возвращает None, а не HTTPException.
     """
-    try:
-        if token is None:
-            return None
-
-        payload = security.decode_token(token)
-
-        email: str = payload.get("sub")
-        if email is None:
-            return None
-
-        user = await user_crud.get_user_by_email(db, email=email)
+    if token is None:
+        return None
+    return await auth_cache.get_user(token, request.app.state.redis)
 
-        return user
 
-    except JWTError:
-        # Недействительный JWT токен (истек, неверная подпись и т.д.)
-        return None
-    except Exception:
-        # Любая другая непредвиденная ошибка
-        return None
\ No newline at end of file
+async def get_current_user_ws(
+        websocket: WebSocket,
+        token: Optional[str] = Query(None),
+) -> CurrentUser:
+    """
+    Аутентификация WebSocket: браузер не умеет слать Bearer-заголовок,
+    поэтому токен передаётся в query-параметре ?token=...
+    """
+    with tracing.span("auth.get_current_user"):
+        user = await auth_cache.get_user(token, websocket.app.state.redis) if token else None
+    if user is None:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+    return user
@@ -1,5 +1,6 @@
 # backend/app/api/routers/auth.py
 
+import uuid
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from fastapi.security import OAuth2PasswordRequestForm
@@ -16,6 +17,12 @@ from app.crud import user_crud
 
 router = APIRouter(tags=["auth"])  # Без prefix, как в предыдущем фиксе
 
+password_hasher_busy = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Сервер перегружен, попробуйте войти чуть позже",
+    headers={"Retry-After": "5"},
+)
+
 # Функция для поиска пользователя по email
 async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
     stmt = select(User).where(User.email == email)
@@ -32,8 +39,11 @@ async def register_user(user_in: UserCreate, db: AsyncSession = Depends(get_db))
             detail="Пользователь с таким email уже существует",
         )
 
-    # Хеширование пароля
-    hashed_password = security.get_password_hash(user_in.password)
+    # Хеширование пароля (в пуле потоков, event loop не блокируется)
+    try:
+        hashed_password = await security.get_password_hash_async(user_in.password)
+    except security.PasswordHasherBusy:
+        raise password_hasher_busy
 
     # Создание пользователя
     db_user = User(email=user_in.email, hashed_password=hashed_password)
@@ -53,16 +63,26 @@ async def login_for_access_token(
         form_data: OAuth2PasswordRequestForm = Depends()  # Использует username (email) и password
 ):
     user = await get_user_by_email(db, form_data.username)
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    try:
+        valid, new_hash = (await security.verify_and_update_password(form_data.password, user.hashed_password)
+                           if user else (False, None))
+    except security.PasswordHasherBusy:
+        raise password_hasher_busy
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный email или пароль",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # Хеш посчитан с прежним BCRYPT_ROUNDS — пересохраняем, пока знаем пароль
+        user.hashed_password = new_hash
+        await db.commit()
 
-    # Создание токенов
-    access_token = security.create_access_token(data={"sub": user.email})
-    refresh_token = security.create_refresh_token(data={"sub": user.email})
+    # Создание токенов: в sub лежит id, чтобы пользователь искался по первичному ключу
+    claims = {"sub": str(user.id), "email": user.email}
+    access_token = security.create_access_token(data=claims)
+    refresh_token = security.create_refresh_token(data=claims)
 
     # Установка Refresh Token в HTTP-Only Cookie
     response.set_cookie(
@@ -91,18 +111,22 @@ async def refresh_access_token(request: Request, response: Response, db: AsyncSe
     if not payload:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired refresh token")
 
-    user_email = payload.sub
-    user = await user_crud.get_user_by_email(db, user_email)
+    try:
+        user_id = uuid.UUID(payload.sub)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired refresh token")
+    user = await user_crud.get_user_by_id(db, user_id)
 
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
     # Генерируем новый Access Token
-    new_access_token = security.create_access_token(data={"sub": user.email})
+    claims = {"sub": str(user.id), "email": user.email}
+    new_access_token = security.create_access_token(data=claims)
 
     # Опционально: генерируем новый Refresh Token и устанавливаем его в cookie
     # Для повышения безопасности можно один раз использовать refresh токен (rotation)
-    new_refresh_token = security.create_refresh_token(data={"sub": user.email})
+    new_refresh_token = security.create_refresh_token(data=claims)
 
     response.set_cookie(
         key="refresh_token",
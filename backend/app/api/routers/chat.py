@@ -1,53 +1,238 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from app.api.dependencies import get_current_user
-from app.models import User
-import httpx
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, WebSocketException, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.websockets import WebSocketState
+from app.api.dependencies import get_current_user, get_current_user_ws
+from app.core.auth_cache import CurrentUser
+from app.models import Character
+import asyncio
+import logging
+import uuid
+from typing import Optional
 from app.core.config import settings
+from app.core import tracing
+from app.core.ws_manager import Connection, ConnectionManager, get_ws_manager
+import redis.asyncio as redis
+from app.crud import chat_crud
+from app.crud.pagination import MAX_PAGE_SIZE, decode_cursor, page
+from app.db.session import AsyncSessionLocal, get_db, get_read_db, get_redis
+from app.schemas import ChatSessionPublic, MessagePublic, Page
+from app.services import chat_generation, chat_history, chat_memory, chat_protocol, chat_summary, llm_client
+from app.services.message_writer import MessageWriter, get_message_writer
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
-# Заглушка, имитирующая потоковый ответ от polza.ai
-async def get_polza_stream(message: str):
-    # TODO: Заменить на реальный API-вызов к polza.ai
-    # (вероятно, используя httpx.AsyncClient().stream())
+@router.get("/sessions", response_model=Page[ChatSessionPublic])
+async def list_sessions(
+        cursor: Optional[str] = None,
+        limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+        db: AsyncSession = Depends(get_read_db),
+        current_user: CurrentUser = Depends(get_current_user),
+):
+    """Чат-сессии пользователя, новые первыми."""
+    sessions = await chat_crud.list_user_sessions(db, current_user.id, cursor, limit)
+    return page(sessions, limit)
+
+
+@router.get("/sessions/{session_id}/messages", response_model=Page[MessagePublic])
+async def list_session_messages(
+        session_id: uuid.UUID,
+        cursor: Optional[str] = None,
+        limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+        db: AsyncSession = Depends(get_db),  # Не реплика: список читают сразу после хода чата
+        writer: MessageWriter = Depends(get_message_writer),
+        r: redis.Redis = Depends(get_redis),
+        current_user: CurrentUser = Depends(get_current_user),
+):
+    """
+    История сессии от новых сообщений к старым; ?cursor=<next_cursor> — листать назад.
+    Сообщения, ещё не записанные в БД, тоже попадают в выдачу: из буфера записи
+    этого процесса и из кольцевого буфера истории в Redis — туда пишут все процессы,
+    в том числе генератор, сохраняющий ответ модели своим MessageWriter.
+    """
+    if await chat_crud.get_user_session(db, current_user.id, session_id) is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    rows = [row._asdict() for row in await chat_crud.list_messages(db, session_id, cursor, limit)]
+    pending = writer.pending_for(session_id) + await chat_history.tail(r, session_id)
+    if cursor is not None:
+        boundary = decode_cursor(cursor)
+        pending = [row for row in pending if (row["created_at"], row["id"]) < boundary]
+    if pending:
+        seen = {row["id"] for row in rows}
+        for row in pending:
+            if row["id"] not in seen:
+                seen.add(row["id"])
+                rows.append(row)
+        rows.sort(key=lambda row: (row["created_at"], row["id"]), reverse=True)
+    return page(rows, limit, key=lambda row: (row["created_at"], row["id"]))
+
+
+class SendStalledError(Exception):
+    """Клиент не вычитывает кадры дольше CHAT_SEND_TIMEOUT."""
+
+
+async def _send(ws: WebSocket, frame: str) -> None:
+    # Генерацию медленный клиент не тормозит (кадры копятся в стриме ответа,
+    # см. chat_generation), но совсем зависшего клиента отключаем, чтобы не
+    # держать соединение и чтение стрима бесконечно.
+    if ws.application_state != WebSocketState.CONNECTED:
+        raise WebSocketDisconnect(code=status.WS_1001_GOING_AWAY)  # Закрыто менеджером соединений
+    try:
+        await asyncio.wait_for(ws.send_text(frame), settings.CHAT_SEND_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise SendStalledError()
+
+
+async def _open_session(user: CurrentUser, session_id: Optional[uuid.UUID], character_id: Optional[uuid.UUID]):
+    """Находит (или создаёт) чат-сессию и загружает её персонажа."""
+    async with AsyncSessionLocal() as db:
+        if session_id is not None:
+            chat_session = await chat_crud.get_user_session(db, user.id, session_id)
+            character = await db.get(Character, chat_session.character_id) if chat_session else None
+        elif character_id is not None:
+            character = await chat_crud.get_user_character(db, user.id, character_id)
+            chat_session = await chat_crud.create_session(db, user.id, character.id) if character else None
+        else:
+            chat_session = character = None
+    if chat_session is None or character is None:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Chat session not found")
+    return chat_session, character
 
-    response_chunks = [
-        "Это ", "потоковый ", "ответ, ", "имитирующий ", "работу ",
-        f"polza.ai ", f"в ответ ", f"на '{message}'."
-    ]
-    for chunk in response_chunks:
-        import asyncio
-        await asyncio.sleep(0.1)  # Имитация задержки сети
-        yield chunk
+
+async def _read_frames(manager: ConnectionManager, conn: Connection, inbox: asyncio.Queue) -> None:
+    """Читает кадры клиента в очередь; None в очереди означает отключение."""
+    try:
+        while True:
+            await inbox.put(await manager.receive_text(conn))
+    except WebSocketDisconnect:
+        await inbox.put(None)
+
+
+async def _relay_reply(ws: WebSocket, r: redis.Redis, session_id: uuid.UUID, message_id: str,
+                       inbox: asyncio.Queue, after: int = 0) -> bool:
+    """
+    Пересылает клиенту кадры ответа, параллельно обрабатывая его кадры.
+    Возвращает False, если клиент отключился: генерация при этом продолжается,
+    и ответ можно дочитать после переподключения.
+    """
+    relay_task = asyncio.create_task(chat_generation.relay(r, message_id, lambda frame: _send(ws, frame), after))
+    try:
+        while not relay_task.done():
+            next_frame = asyncio.ensure_future(inbox.get())
+            await asyncio.wait({relay_task, next_frame}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_frame.done():
+                next_frame.cancel()
+                break
+            raw = next_frame.result()
+            if raw is None:
+                return False
+            frame = chat_protocol.parse_client_frame(raw)
+            if frame is not None and frame["type"] == "cancel":
+                # Генератор может работать в другом процессе: он увидит флаг и закроет ответ
+                await chat_generation.cancel(r, message_id)
+            else:
+                await _send(ws, chat_protocol.error("busy", "Дождитесь окончания ответа или отправьте cancel"))
+    finally:
+        if not relay_task.done():
+            relay_task.cancel()
+            await asyncio.gather(relay_task, return_exceptions=True)
+    if isinstance(relay_task.exception(), chat_generation.GenerationLostError):
+        logger.warning("Chat reply %s produced no frames in time", message_id)
+        # Генератор умер или так и не взял задачу: не держим сессию занятой до истечения ключа
+        await chat_generation.release(r, session_id, message_id)
+        await _send(ws, chat_protocol.error("generation_lost", "Ответ модели не получен, повторите запрос"))
+    elif relay_task.exception() is not None:
+        raise relay_task.exception()
+    return True
 
 
 @router.websocket("/stream")
 async def chat_stream(
         ws: WebSocket,
-        # TODO: Здесь нужна аутентификация по токену в query-параметре,
-        # т.к. WebSocket не отправляет Bearer заголовки.
-        # Для простоты пока опустим, но это НЕБЕЗОПАСНО.
-        # current_user: User = Depends(get_current_user_ws)
+        session_id: Optional[uuid.UUID] = Query(None),  # Продолжить существующую сессию
+        character_id: Optional[uuid.UUID] = Query(None),  # ...или начать новую с персонажем
+        resume_seq: Optional[int] = Query(None),  # seq последней полученной дельты незаконченного ответа
+        current_user: CurrentUser = Depends(get_current_user_ws),
+        writer: MessageWriter = Depends(get_message_writer),
+        r: redis.Redis = Depends(get_redis),
+        manager: ConnectionManager = Depends(get_ws_manager),
 ):
-    await ws.accept()
-    try:
-        await ws.send_text("🤖 Connected. Type a message.")
-        while True:
-            text = await ws.receive_text()
+    chat_session, character = await _open_session(current_user, session_id, character_id)
 
-            # TODO: Сохранить text в БД (Message с role='user')
+    async with manager.connect(ws, current_user.id) as conn:
+        await _chat_loop(ws, conn, manager, r, writer, chat_session, character, resume_seq)
+    logger.info("Chat client disconnected")
+
+
+async def _chat_loop(ws: WebSocket, conn: Connection, manager: ConnectionManager, r: redis.Redis,
+                     writer: MessageWriter, chat_session, character: Character, resume_seq: Optional[int]) -> None:
+    inbox: asyncio.Queue = asyncio.Queue()
+    reader = asyncio.create_task(_read_frames(manager, conn, inbox))
+    try:
+        active = await chat_generation.active_reply(r, chat_session.id)
+        await _send(ws, chat_protocol.connected(str(chat_session.id), active))
+        # Переподключение посреди ответа: досылаем его с места обрыва
+        connected = active is None or await _relay_reply(ws, r, chat_session.id, active, inbox,
+                                                          chat_generation.offset_after(resume_seq))
+        while connected:
+            raw = await inbox.get()
+            if raw is None:
+                break
+            frame = chat_protocol.parse_client_frame(raw)
+            if frame is None or frame["type"] != "user_message":
+                await _send(ws, chat_protocol.error("bad_frame", "Ожидался кадр user_message"))
+                continue
+            text = frame["text"]
 
-            await ws.send_text(f"User: {text}")  # Эхо для пользователя
+            # Контекст: сводка давней части разговора, ещё не сведённые сообщения из окна
+            # последних (Redis), обрезанные под бюджет токенов, и давние сообщения,
+            # близкие по смыслу к новому (долгая память)
+            with tracing.span("chat.history"):
+                window = await chat_history.recent(r, chat_session.id, writer)
+                summary, history = None, window
+                if settings.CHAT_SUMMARY_ENABLED:
+                    summary = await chat_summary.get(r, chat_session.id)
+                    history = chat_summary.unsummarized(window, summary)
+                    # Сама сводка пишется в фоне, на этот ход она не влияет
+                    await chat_summary.schedule_if_needed(r, chat_session.id, window, history)
+            memories = []
+            if settings.CHAT_MEMORY_ENABLED:
+                with tracing.span("chat.memory"):
+                    memories = await chat_memory.recall(r, chat_session.id, text,
+                                                        {uuid.UUID(m["id"]) for m in history})
+            context = chat_history.build_context(character.system_prompt, history, text, memories, summary)
+            messages = llm_client.build_messages(character.system_prompt, context, text, memories,
+                                                 summary["content"] if summary else None)
 
-            # Потоковая передача ответа AI
-            ai_response = ""
-            async for chunk in get_polza_stream(text):
-                ai_response += chunk
-                await ws.send_text(f"AI: {ai_response}")  # Отправляем обновленный полный ответ
+            message_id = uuid.uuid4().hex  # Тот же id получит строка Message в БД
+            try:
+                await chat_generation.claim(r, chat_session.id, message_id)
+            except chat_generation.ReplyInProgressError:
+                # Предыдущий ответ ещё пишется (например, начат до переподключения с другой вкладки)
+                await _send(ws, chat_protocol.error("busy", "Дождитесь окончания ответа или отправьте cancel"))
+                continue
 
-            # TODO: Сохранить ai_response в БД (Message с role='ai')
+            # Запись в БД отложенная и пакетная, см. MessageWriter
+            user_row = writer.add(chat_session.id, "user", text)
+            try:
+                await chat_history.append(r, chat_session.id, user_row)
+                # Генерирует любой воркер, а этот только пересылает кадры клиенту
+                await chat_generation.submit(r, chat_session.id, message_id, messages)
+            except BaseException:
+                await chat_generation.release(r, chat_session.id, message_id)
+                raise
+            await _send(ws, chat_protocol.user_message(user_row["id"].hex, text))  # Эхо для пользователя
+            if not await _relay_reply(ws, r, chat_session.id, message_id, inbox):
+                break
 
+    except SendStalledError:
+        logger.info("Chat client stalled, closing socket")
+        if ws.application_state == WebSocketState.CONNECTED:
+            await ws.close(code=status.WS_1008_POLICY_VIOLATION)
     except WebSocketDisconnect:
-        print("Client disconnected")
-        return
\ No newline at end of file
+        pass
+    finally:
+        reader.cancel()
+        await writer.flush()  # Не оставляем сообщения отключившегося клиента в буфере
@@ -1,36 +1,231 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
-from fastapi.responses import JSONResponse
-import httpx
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+import anyio
+import json
+import logging
+import re
+import redis.asyncio as redis
 from app.core.config import settings
+from app.core.http_clients import UpstreamClients, get_http_clients
+from app.db.session import get_redis
 from app.api.dependencies import get_current_user
-from app.models import User
-from app.schemas import Txt2ImgRequest
+from app.core.auth_cache import CurrentUser
+from app.schemas import Txt2ImgRequest, ImageJobPublic
+from app.services import image_cache, image_queue, response_cache, sd_api
+from app.services.image_store import DIGEST_RE, MEDIA_TYPES, VARIANTS, ImageStore, get_image_store
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+FILE_CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _image_urls(request: Request, image: dict) -> dict:
+    urls = {}
+    for variant in image["variants"]:
+        url = request.url_for("get_image_file", digest=image["id"]).path
+        urls[variant] = url if variant == "original" else f"{url}?variant={variant}"
+    return {"id": image["id"], "url": urls["original"], "variants": urls}
+
+
+async def _get_own_job(r: redis.Redis, job_id: str, user: CurrentUser) -> dict:
+    job = await image_queue.get_job(r, job_id)
+    if job is None or job["user_id"] != str(user.id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Задача не найдена")
+    return job
 
-@router.post("/generate")
+
+@router.post("/generate", response_model=ImageJobPublic, status_code=status.HTTP_202_ACCEPTED)
 async def sdxl_generate(
         payload: Txt2ImgRequest,
-        current_user: User = Depends(get_current_user)  # Защищаем эндпоинт
+        current_user: CurrentUser = Depends(get_current_user),  # Защищаем эндпоинт
+        r: redis.Redis = Depends(get_redis),
+        clients: UpstreamClients = Depends(get_http_clients),
+        store: ImageStore = Depends(get_image_store),
 ):
     """
-    Отправляет prompt в Automatic1111 (txt2img API).
+    Ставит prompt в очередь генерации Automatic1111 (txt2img API) и сразу возвращает задачу.
+    Статус: GET /jobs/{id} или поток событий GET /jobs/{id}/events (с прогрессом и
+    номером кадра превью GET /jobs/{id}/preview), картинки: GET /jobs/{id}/result,
+    отмена: POST /jobs/{id}/cancel.
+    Повтор запроса с тем же seed (или с use_cache) отдаётся из кэша без обращения к GPU.
     """
+    request = payload.model_dump()
+    cache_key = None
+    if settings.IMAGE_CACHE_ENABLED and image_cache.is_cacheable(request):
+        # Фиксируем чекпоинт в задаче, чтобы ключ кэша соответствовал тому, чем реально рисовали.
+        # Берётся из проб здоровья пула: ждать слот GPU ради имени модели нельзя
+        request["checkpoint"] = request["checkpoint"] or sd_api.current_checkpoint(clients.sd)
+        if request["checkpoint"] is None:
+            logger.warning("SD checkpoint is not known yet, skipping image cache")
+        else:
+            cache_key = image_cache.cache_key(request, request["checkpoint"])
+            cached = await image_cache.get(r, cache_key)
+            # Файлы могли удалить сборщиком хранилища — тогда генерируем заново
+            if cached is not None and await store.touch([image["id"] for image in cached["images"]]):
+                return await image_queue.complete_from_cache(r, current_user.id, request, cached)
+
     try:
-        # Используем URL из настроек
-        api_url = f"{settings.COMFYUI_URL}/sdapi/v1/txt2img"
-
-        async with httpx.AsyncClient(timeout=300) as client:
-            r = await client.post(api_url, json=payload.model_dump())
-            r.raise_for_status()
-            data = r.json()
-
-        # A1111 возвращает base64-изображения в списке 'images'
-        return JSONResponse(content={"images": data.get("images", [])})
-
-    except httpx.RequestError as e:
-        return JSONResponse(status_code=502, content={"error": f"Error connecting to SD API: {e}"})
-    except httpx.HTTPStatusError as e:
-        return JSONResponse(status_code=e.response.status_code,
-                            content={"error": f"Error from SD API: {e.response.text}"})
\ No newline at end of file
+        return await image_queue.submit_job(r, current_user.id, request, cache_key=cache_key)
+    except image_queue.QueueFullError:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Очередь генерации переполнена, попробуйте позже",
+            headers={"Retry-After": "30"},
+        )
+
+
+@router.get("/jobs/{job_id}", response_model=ImageJobPublic)
+async def get_job_status(
+        job_id: str,
+        current_user: CurrentUser = Depends(get_current_user),
+        r: redis.Redis = Depends(get_redis),
+):
+    return await _get_own_job(r, job_id, current_user)
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(
+        job_id: str,
+        request: Request,
+        current_user: CurrentUser = Depends(get_current_user),
+        r: redis.Redis = Depends(get_redis),
+):
+    job = await _get_own_job(r, job_id, current_user)
+    if job["status"] == image_queue.STATUS_ERROR:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error from SD API: {job.get('error')}")
+    if job["status"] == image_queue.STATUS_CANCELLED:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Задача отменена")
+    if job["status"] != image_queue.STATUS_DONE:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Задача ещё не завершена")
+    result = json.loads(job["result"])
+    return {"images": [_image_urls(request, image) for image in result["images"]]}
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=ImageJobPublic)
+async def cancel_job(
+        job_id: str,
+        current_user: CurrentUser = Depends(get_current_user),
+        r: redis.Redis = Depends(get_redis),
+):
+    """
+    Отменяет задачу: ожидающая снимается с очереди сразу, выполняющаяся — в течение
+    IMAGE_PROGRESS_INTERVAL (cancel_requested=true до этого). Завершённая не меняется.
+    """
+    job = await _get_own_job(r, job_id, current_user)
+    return await image_queue.cancel_job(r, job)
+
+
+@router.get("/jobs/{job_id}/preview")
+async def get_job_preview(
+        job_id: str,
+        current_user: CurrentUser = Depends(get_current_user),
+        r: redis.Redis = Depends(get_redis),
+):
+    """Последний промежуточный кадр генерации (WebP, не больше IMAGE_PREVIEW_SIZE)."""
+    await _get_own_job(r, job_id, current_user)
+    preview = await image_queue.get_preview(r, job_id)
+    if preview is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Превью пока нет")
+    return Response(preview, media_type="image/webp", headers={"Cache-Control": "no-store"})
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(
+        job_id: str,
+        current_user: CurrentUser = Depends(get_current_user),
+        r: redis.Redis = Depends(get_redis),
+):
+    """
+    Server-Sent Events со сменой статуса и прогрессом задачи (progress, eta_seconds,
+    preview_seq). Поток закрывается после done/error/cancelled.
+    """
+    await _get_own_job(r, job_id, current_user)
+
+    async def event_stream():
+        pubsub = r.pubsub()
+        # Подписываемся до чтения статуса, чтобы не пропустить переход между ними
+        await pubsub.subscribe(f"{image_queue.EVENTS_CHANNEL_PREFIX}{job_id}")
+        try:
+            job = await image_queue.get_job(r, job_id)
+            if job is None:
+                return
+            job.pop("payload", None)
+            job.pop("result", None)
+            yield f"data: {json.dumps(job)}\n\n"
+            if job["status"] in image_queue.FINAL_STATUSES:
+                return
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                yield f"data: {message['data']}\n\n"
+                if json.loads(message["data"]).get("status") in image_queue.FINAL_STATUSES:
+                    return
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+async def _read_file(path, start: int, length: int):
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(FILE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@router.get("/files/{digest}")
+async def get_image_file(
+        digest: str,
+        request: Request,
+        variant: str = "original",
+        store: ImageStore = Depends(get_image_store),
+):
+    """
+    Отдаёт файл из хранилища потоком, с поддержкой ETag и Range.
+    Без авторизации: имя файла — sha256 содержимого, угадать его нельзя,
+    а <img src> не умеет передавать Bearer-токен.
+    """
+    if not DIGEST_RE.match(digest) or variant not in VARIANTS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Изображение не найдено")
+    path = store.path(digest, variant)
+    try:
+        size = (await anyio.Path(path).stat()).st_size
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Изображение не найдено")
+
+    # Содержимое по этому URL никогда не меняется
+    headers = {
+        "ETag": f'"{digest}-{variant}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    if response_cache.not_modified(request, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    start, end = 0, size - 1
+    status_code = status.HTTP_200_OK
+    range_match = RANGE_RE.match(request.headers.get("range", ""))
+    if range_match and any(range_match.groups()) and request.headers.get("if-range", headers["ETag"]) == headers["ETag"]:
+        first, last = range_match.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        elif last:
+            start = max(size - int(last), 0)
+        if start > end or start >= size:
+            return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                            headers={"Content-Range": f"bytes */{size}"})
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(_read_file(path, start, end - start + 1), status_code=status_code,
+                             media_type=MEDIA_TYPES[variant], headers=headers)
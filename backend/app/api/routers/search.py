@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.dependencies import get_current_user
+from app.core.auth_cache import CurrentUser
+from app.crud import search_crud
+from app.crud.pagination import MAX_PAGE_SIZE
+from app.db.session import get_read_db
+from app.schemas import Page, SearchHit
+from typing import Optional
+
+router = APIRouter(tags=["search"])
+
+
+@router.get("", response_model=Page[SearchHit])
+async def search(
+        q: str = Query(..., min_length=2, max_length=200),
+        cursor: Optional[str] = None,
+        limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+        db: AsyncSession = Depends(get_read_db),
+        current_user: CurrentUser = Depends(get_current_user),
+):
+    """Поиск по своим сообщениям и персонажам, самые релевантные первыми."""
+    return await search_crud.search(db, current_user.id, q, cursor, limit)
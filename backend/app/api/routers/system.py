@@ -0,0 +1,121 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+import redis.asyncio as redis
+from typing import Optional
+from app.api.dependencies import get_current_admin
+from app.core.auth_cache import CurrentUser
+from app.core import profiler, sd_pool, security
+from app.core.config import settings
+from app.core.http_clients import UpstreamClients, get_http_clients
+from app.core.ws_manager import ConnectionManager, get_ws_manager
+from app.db.session import db_pool_stats, get_redis
+from app.services import chat_memory, chat_summary, image_batcher, image_cache, response_cache
+
+router = APIRouter(tags=["system"])
+
+
+@router.get("/http-pools")
+async def http_pool_stats(
+        clients: UpstreamClients = Depends(get_http_clients),
+        current_user: CurrentUser = Depends(get_current_admin),
+):
+    """Занятые/свободные соединения в пулах к апстримам — для подбора лимитов под нагрузкой."""
+    return clients.pool_stats()
+
+
+@router.get("/sd-backends")
+async def sd_backends(
+        clients: UpstreamClients = Depends(get_http_clients),
+        r: redis.Redis = Depends(get_redis),
+        current_user: CurrentUser = Depends(get_current_admin),
+):
+    """
+    SD-бэкенды: здоровье, breaker, запросы в работе, доля ошибок и задержка —
+    в этом процессе и в последних снимках всех процессов (включая воркеры генерации).
+    """
+    return {"local": clients.sd.stats(), "processes": await sd_pool.cluster_stats(r)}
+
+
+@router.get("/image-cache")
+async def image_cache_stats(
+        r: redis.Redis = Depends(get_redis),
+        current_user: CurrentUser = Depends(get_current_admin),
+):
+    """Попадания/промахи кэша txt2img."""
+    return await image_cache.stats(r)
+
+
+@router.get("/image-batches")
+async def image_batch_stats(
+        r: redis.Redis = Depends(get_redis),
+        current_user: CurrentUser = Depends(get_current_admin),
+):
+    """Размеры батчей txt2img и задержка, добавленная ожиданием батча."""
+    return await image_batcher.stats(r)
+
+
+@router.get("/memory")
+async def chat_memory_stats(
+        r: redis.Redis = Depends(get_redis),
+        current_user: CurrentUser = Depends(get_current_admin),
+):
+    """Очередь индексации долгой памяти чата и латентность поиска по ней."""
+    return await chat_memory.stats(r)
+
+
+@router.get("/summaries")
+async def chat_summary_stats(
+        r: redis.Redis = Depends(get_redis),
+        current_user: CurrentUser = Depends(get_current_admin),
+):
+    """Фоновые сводки разговоров: задачи, сбои и время ответа модели на пачку."""
+    return await chat_summary.stats(r)
+
+
+@router.get("/password-hasher")
+async def password_hasher_stats(current_user: CurrentUser = Depends(get_current_admin)):
+    """Загрузка пула bcrypt: сколько хешей считается, сколько ждёт и как долго."""
+    return security.password_hasher.stats()
+
+
+@router.get("/db-pools")
+async def db_pools(current_user: CurrentUser = Depends(get_current_admin)):
+    """Заполненность пулов Postgres (основной и реплики) и ожидание соединения."""
+    return db_pool_stats()
+
+
+@router.get("/response-cache")
+async def response_cache_stats(
+        r: redis.Redis = Depends(get_redis),
+        current_user: CurrentUser = Depends(get_current_admin),
+):
+    """Попадания кэша ответов по маршрутам (304 считаются попаданиями)."""
+    return await response_cache.stats(r)
+
+
+@router.get("/websockets")
+async def websocket_stats(
+        manager: ConnectionManager = Depends(get_ws_manager),
+        current_user: CurrentUser = Depends(get_current_admin),
+):
+    """Открытые WebSocket: в этом воркере (по маршрутам, пользователям, уборке) и во всём кластере."""
+    return {"worker": manager.stats(), "cluster": await manager.cluster_stats()}
+
+
+@router.post("/profile", response_class=PlainTextResponse)
+async def profile(
+        seconds: float = Query(10, gt=0),
+        interval_ms: float = Query(10, ge=1, le=1000),
+        thread: Optional[str] = Query(None, description="Например MainThread — только event loop"),
+        current_user: CurrentUser = Depends(get_current_admin),
+):
+    """
+    Сэмплирует стеки живого процесса `seconds` секунд. Ответ — folded stacks:
+    `flamegraph.pl profile.txt > profile.svg` или загрузить в speedscope.app.
+    """
+    seconds = min(seconds, settings.PROFILER_MAX_SECONDS)
+    try:
+        folded, samples = await profiler.profile(seconds, interval_ms / 1000, thread)
+    except profiler.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="Profiling is already running")
+    return PlainTextResponse(folded, headers={"X-Profile-Samples": str(samples)})
@@ -1,37 +1,81 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db.session import get_db
-from app.models import User
-from app.schemas import UserPublic, CharacterCreate, CharacterPublic
+import redis.asyncio as redis
+from app.db.session import AsyncSessionLocal, get_db, get_redis
+from app.schemas import UserPublic, CharacterCreate, CharacterPublic, Page
 from app.api.dependencies import get_current_user
-from sqlalchemy.future import select
+from app.core.auth_cache import CurrentUser
+from app.crud import chat_crud
+from app.crud.pagination import MAX_PAGE_SIZE, page
 from app.models import Character
+from app.services import response_cache
+from typing import Optional
 import uuid
 
 router = APIRouter()
 
+# GET-эндпоинты ниже отдаются через response_cache: ответ с ETag из Redis,
+# а сессия БД открывается только при промахе (внутри loader). Промах читает
+# основную БД, а не реплику: сразу после записи и invalidate_user отстающая
+# реплика закэшировала бы старые данные под новой версией на весь TTL.
+# Промахи редки, поэтому лишней нагрузки на основную БД почти нет.
+
 @router.get("/me", response_model=UserPublic)
-async def read_users_me(current_user: User = Depends(get_current_user)):
-    return current_user
+async def read_users_me(
+    request: Request,
+    r: redis.Redis = Depends(get_redis),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    async def load():
+        # Снимок из кэша аутентификации; при промахе он читается с реплики
+        return current_user
+
+    return await response_cache.cached_json(request, r, "users_me", current_user.id, "", UserPublic, load)
 
 @router.post("/me/characters", response_model=CharacterPublic, status_code=201)
 async def create_character(
     character_in: CharacterCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    r: redis.Redis = Depends(get_redis),
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     db_character = Character(**character_in.model_dump(), owner_id=current_user.id)
     db.add(db_character)
     await db.commit()
     await db.refresh(db_character)
+    await response_cache.invalidate_user(r, current_user.id)  # Списки персонажей устарели
     return db_character
 
-@router.get("/me/characters", response_model=list[CharacterPublic])
+@router.get("/me/characters", response_model=Page[CharacterPublic])
 async def get_my_characters(
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    r: redis.Redis = Depends(get_redis),
+    current_user: CurrentUser = Depends(get_current_user)
 ):
-    result = await db.execute(
-        select(Character).where(Character.owner_id == current_user.id)
-    )
-    return result.scalars().all()
\ No newline at end of file
+    """Персонажи пользователя, новые первыми; следующая страница — ?cursor=<next_cursor>."""
+    async def load():
+        async with AsyncSessionLocal() as db:
+            characters = await chat_crud.list_user_characters(db, current_user.id, cursor, limit)
+        return page(characters, limit)
+
+    return await response_cache.cached_json(request, r, "my_characters", current_user.id,
+                                            f"{cursor}:{limit}", Page[CharacterPublic], load)
+
+@router.get("/me/characters/{character_id}", response_model=CharacterPublic)
+async def get_my_character(
+    character_id: uuid.UUID,
+    request: Request,
+    r: redis.Redis = Depends(get_redis),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    async def load():
+        async with AsyncSessionLocal() as db:
+            character = await chat_crud.get_user_character(db, current_user.id, character_id)
+        if character is None:
+            raise HTTPException(status_code=404, detail="Character not found")
+        return character
+
+    return await response_cache.cached_json(request, r, "my_character", current_user.id,
+                                            str(character_id), CharacterPublic, load)
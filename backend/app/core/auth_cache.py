@@ -0,0 +1,158 @@
+# app/core/auth_cache.py
+"""
+Кэш аутентификации: проверенный токен -> снимок пользователя.
+
+Уровни:
+  1. In-process TTL/LRU по строке токена — не нужны ни декодирование JWT, ни запрос в БД.
+  2. Redis по id пользователя (AUTH_CACHE_REDIS) — общий для всех воркеров.
+  3. Postgres по первичному ключу (id лежит в `sub` токена).
+Одновременные промахи по одному токену схлопываются в один запрос (single-flight).
+
+Явной инвалидации нет: в API нет изменения и удаления пользователей, а снимок
+держит только неизменяемые поля (id, email, username, created_at). Записи живут
+AUTH_CACHE_TTL_SECONDS на каждом уровне, поэтому после правки пользователя
+напрямую в БД процессы видят старый снимок не дольше 2 × AUTH_CACHE_TTL_SECONDS
+(локальная запись может взять из Redis значение в конце его TTL). Токен удалённого
+пользователя принимается столько же. Появится изменение пользователей — нужна
+инвалидация обоих уровней во всех процессах.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Optional
+
+import redis.asyncio as redis
+
+from app.core import security
+from app.core.config import settings
+from app.crud import user_crud
+from app.db.session import AsyncSessionLocal, ReadSessionLocal
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "auth:user:"
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """Неизменяемый снимок пользователя; совместим с UserPublic (from_attributes)."""
+    id: uuid.UUID
+    email: str
+    username: Optional[str]
+    created_at: datetime
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data["id"] = str(self.id)
+        data["created_at"] = self.created_at.isoformat()
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "CurrentUser":
+        data = json.loads(raw)
+        return cls(id=uuid.UUID(data["id"]), email=data["email"], username=data["username"],
+                   created_at=datetime.fromisoformat(data["created_at"]))
+
+
+class AuthCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, CurrentUser]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def _get_local(self, token: str) -> Optional[CurrentUser]:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return user
+
+    def _put_local(self, token: str, user: CurrentUser, token_exp: Optional[int]) -> None:
+        ttl = self._ttl
+        if token_exp is not None:
+            ttl = min(ttl, token_exp - time.time())  # Не переживаем срок самого токена
+        if ttl <= 0:
+            return
+        self._entries[token] = (time.monotonic() + ttl, user)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    async def _load(self, token: str, r: Optional[redis.Redis]) -> Optional[CurrentUser]:
+        payload = security.decode_token(token)
+        if payload is None:
+            return None
+        try:
+            user_id = uuid.UUID(payload.sub)
+        except (TypeError, ValueError):
+            return None  # Старый токен с email в sub
+
+        user = None
+        use_redis = r is not None and settings.AUTH_CACHE_REDIS
+        if use_redis:
+            raw = await r.get(f"{REDIS_KEY_PREFIX}{user_id}")
+            user = CurrentUser.from_json(raw) if raw else None
+        if user is None:
+            async with ReadSessionLocal() as db:
+                db_user = await user_crud.get_user_by_id(db, user_id)
+            if db_user is None and ReadSessionLocal is not AsyncSessionLocal:
+                # Пользователь мог только что зарегистрироваться и ещё не доехать до реплики
+                async with AsyncSessionLocal() as db:
+                    db_user = await user_crud.get_user_by_id(db, user_id)
+            if db_user is None:
+                return None
+            user = CurrentUser(id=db_user.id, email=db_user.email, username=db_user.username,
+                               created_at=db_user.created_at)
+            if use_redis:
+                await r.set(f"{REDIS_KEY_PREFIX}{user_id}", user.to_json(), ex=int(self._ttl))
+
+        self._put_local(token, user, payload.exp)
+        return user
+
+    async def get_user(self, token: str, r: Optional[redis.Redis] = None) -> Optional[CurrentUser]:
+        """Пользователь по токену или None, если токен недействителен или пользователя нет."""
+        user = self._get_local(token)
+        if user is not None:
+            return user
+
+        inflight = self._inflight.get(token)
+        if inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if inflight.cancelled():
+                    # Отменили запрос, который грузил пользователя, а не нас — пробуем сами
+                    return await self.get_user(token, r)
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[token] = future
+        try:
+            user = await self._load(token, r)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # Помечаем как полученное, если ждущих не было
+            raise
+        else:
+            future.set_result(user)
+            return user
+        finally:
+            del self._inflight[token]
+
+
+auth_cache = AuthCache(settings.AUTH_CACHE_MAX_ENTRIES, settings.AUTH_CACHE_TTL_SECONDS)
+
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 import os
+from typing import Optional
 
 
 class Settings(BaseSettings):
@@ -8,15 +9,142 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
 
+    # Кэш аутентификации (см. app/core/auth_cache.py)
+    AUTH_CACHE_TTL_SECONDS: int = 60
+    AUTH_CACHE_MAX_ENTRIES: int = 10_000
+    AUTH_CACHE_REDIS: bool = True  # Общий уровень кэша для нескольких воркеров
+
+    # Кэш ответов /users/me* с ETag (см. app/services/response_cache.py)
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_TTL_SECONDS: int = 300
+
+    # Хеширование паролей (bcrypt в пуле потоков, см. app/core/security.py)
+    BCRYPT_ROUNDS: int = 12  # При смене хеши пересчитываются при следующем входе
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 64  # Сверх этого вход/регистрация отвечают 503
+
     DATABASE_URL: str
+    DATABASE_READ_URL: Optional[str] = None  # Реплика для чтения; без неё всё идёт в основную БД
     REDIS_URL: str
 
+    # Пул соединений к Postgres (см. app/db/session.py); на каждый URL свой пул
+    DB_ECHO: bool = False  # Логирует каждый SQL-запрос синхронно — только для отладки
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 10.0  # Сколько ждать свободное соединение, прежде чем упасть
+    DB_POOL_RECYCLE: int = 1800  # Пересоздавать соединения старше, сек
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100  # Кэш prepared statements asyncpg; 0 за pgbouncer (transaction mode)
+
     COMFYUI_URL: str  # Оставил имя переменной из твоего main.py
+    SD_BACKEND_URLS: list[str] = []  # Несколько серверов A1111 (JSON-список); пусто — только COMFYUI_URL
     POLZA_API_KEY: str
+    POLZA_API_URL: str = "https://api.polza.ai/api/v1"
+    POLZA_MODEL: str = "openai/gpt-4o-mini"
+
+    # Пулы соединений к апстримам (см. app/core/http_clients.py)
+    UPSTREAM_KEEPALIVE_EXPIRY: float = 60.0
+    SD_MAX_CONNECTIONS: int = 8
+    SD_CONNECT_TIMEOUT: float = 5.0
+    SD_READ_TIMEOUT: float = 300.0
+    SD_HTTP2: bool = False  # A1111 (uvicorn) не умеет HTTP/2
+    # Пул SD-бэкендов (см. app/services/sd_pool.py)
+    SD_HEALTH_INTERVAL: float = 5.0  # Период проб /sdapi/v1/options
+    SD_HEALTH_TIMEOUT: float = 3.0
+    SD_BREAKER_FAILURES: int = 3  # Подряд неудач, после которых бэкенд выводится из ротации...
+    SD_BREAKER_COOLDOWN: float = 30.0  # ...на столько секунд, затем пробный запрос
+    SD_RETRY_ATTEMPTS: int = 2  # Сколько раз повторить запрос на другом бэкенде
+    SD_BACKEND_WAIT_TIMEOUT: float = 60.0  # Сколько ждать свободный бэкенд, прежде чем вернуть ошибку
+    POLZA_MAX_CONNECTIONS: int = 50
+    POLZA_CONNECT_TIMEOUT: float = 5.0
+    POLZA_READ_TIMEOUT: float = 60.0
+    POLZA_HTTP2: bool = True
+
+    # Чат: фрагменты ответа, пришедшие в пределах окна, уходят клиенту одним кадром
+    CHAT_COALESCE_WINDOW_MS: int = 30
+    CHAT_SEND_TIMEOUT: float = 10.0  # Клиент, не вычитывающий кадры дольше, отключается
+    CHAT_HISTORY_MESSAGES: int = 50  # Размер окна последних сообщений сессии в Redis
+    CHAT_HISTORY_TTL_SECONDS: int = 24 * 60 * 60
+    CHAT_CONTEXT_TOKEN_BUDGET: int = 3000  # Бюджет промпта: system + история + новое сообщение
+    CHAT_MAX_TOKENS: int = 1024
+    CHAT_WRITE_BATCH_SIZE: int = 100  # Отложенная запись сообщений: размер пачки...
+    CHAT_WRITE_FLUSH_INTERVAL: float = 1.0  # ...или максимальная задержка, сек
+    CHAT_WRITE_MAX_BUFFER: int = 10_000  # Предел буфера, если БД недоступна
+    CHAT_GENERATION_CONCURRENCY: int = 32  # Сколько ответов модели генерирует один процесс
+    CHAT_GENERATION_IDLE_TIMEOUT: float = 90.0  # Нет новых кадров дольше — генерация считается потерянной
+    CHAT_ACTIVE_LEASE_SECONDS: int = 30  # Генератор продлевает занятость сессии, пока жив
+    CHAT_CANCEL_POLL_INTERVAL: float = 0.2  # Как часто генератор проверяет флаг отмены, сек
+    CHAT_REPLY_TTL_SECONDS: int = 10 * 60  # Сколько хранить кадры ответа для переподключения
+    # Сводка давней части разговора (см. app/services/chat_summary.py)
+    CHAT_SUMMARY_ENABLED: bool = True
+    CHAT_SUMMARY_TRIGGER_TOKENS: int = 2000  # Несведённая история длиннее — ставим задачу сводки
+    CHAT_SUMMARY_KEEP_TOKENS: int = 1000  # Столько свежей истории всегда остаётся дословно
+    CHAT_SUMMARY_CHUNK_TOKENS: int = 3000  # Сообщений на один вызов модели
+    CHAT_SUMMARY_MAX_TOKENS: int = 400  # Длина сводки; она идёт в каждый промпт сессии
+    CHAT_SUMMARY_CONCURRENCY: int = 4  # Задач сводки на процесс
+    # Долгая память чата (см. app/services/chat_memory.py и memory_worker.py)
+    CHAT_MEMORY_ENABLED: bool = True
+    CHAT_MEMORY_DIR: str = "/data/memory"  # Индексы сессий и кэш модели: общий том API и воркера памяти
+    CHAT_MEMORY_MODEL: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"  # При смене индексы строятся заново
+    CHAT_MEMORY_THREADS: Optional[int] = 1  # Потоки ONNX Runtime на процесс; None — все ядра
+    CHAT_MEMORY_TOP_K: int = 5
+    CHAT_MEMORY_MIN_SCORE: float = 0.5  # Косинусная близость, ниже которой сообщение не вспоминается
+    CHAT_MEMORY_TOKEN_BUDGET: int = 500  # Часть CHAT_CONTEXT_TOKEN_BUDGET, только если есть что вспомнить
+    CHAT_MEMORY_MIN_CHARS: int = 20  # Короткие реплики («ок», «привет») не индексируются
+    CHAT_MEMORY_BATCH_SIZE: int = 64  # Сообщений на пачку эмбеддингов воркера памяти
+
+    # WebSocket-соединения (см. app/core/ws_manager.py)
+    WS_MAX_CONNECTIONS: int = 10_000  # На все воркеры и узлы
+    WS_MAX_CONNECTIONS_PER_USER: int = 5
+    WS_MAX_MESSAGE_BYTES: int = 16 * 1024  # Кадр клиента больше этого закрывает соединение (1009)
+    WS_HEARTBEAT_INTERVAL: float = 20.0  # Как часто слать ping и продлевать аренды в Redis
+    WS_IDLE_TIMEOUT: float = 60.0  # Нет ни одного кадра (включая pong) дольше — соединение закрывается
+    WS_DRAIN_TIMEOUT: float = 10.0  # Сколько ждать обработчики при остановке
 
     FRONTEND_URL: str
     HTTPS_ENABLED: bool = False
 
+    # Очередь генерации изображений
+    IMAGE_QUEUE_MAX_DEPTH: int = 100  # Сверх этого POST /image/generate отвечает 429
+    IMAGE_WORKER_CONCURRENCY: int = 1  # Сколько задач каждый SD-бэкенд (GPU) реально выполняет параллельно
+    IMAGE_QUEUE_POLL_INTERVAL: float = 0.5  # Пауза воркера при пустой очереди, сек
+    IMAGE_JOB_TTL_SECONDS: int = 24 * 60 * 60  # Сколько хранить задачу и её результат
+    IMAGE_JOB_LEASE_SECONDS: int = 60  # Воркер не продлевал аренду дольше — задача возвращается в очередь
+    IMAGE_JOB_MAX_ATTEMPTS: int = 2  # После стольких потерянных воркеров задача завершается ошибкой
+    # Микробатчинг (см. app/services/image_batcher.py)
+    IMAGE_BATCHING_ENABLED: bool = True
+    IMAGE_BATCH_MAX_SIZE: int = 4  # Ограничено видеопамятью
+    IMAGE_BATCH_WINDOW_MS: int = 150  # Сколько первая задача группы ждёт попутчиков
+    # Прогресс генерации (опрос /sdapi/v1/progress на каждый идущий запрос, не на каждого зрителя)
+    IMAGE_PROGRESS_INTERVAL: float = 1.0  # Заодно период проверки отмены задачи
+    IMAGE_PREVIEWS_ENABLED: bool = True  # Промежуточные кадры (нужен live preview в настройках A1111)
+    IMAGE_PREVIEW_SIZE: int = 256
+    IMAGE_PREVIEW_TTL_SECONDS: int = 60 * 60
+
+    # Хранилище изображений (см. app/services/image_store.py)
+    IMAGE_STORE_DIR: str = "/data/images"
+    IMAGE_STORE_MAX_BYTES: int = 50 * 2 ** 30  # Сверх этого сборщик удаляет давно не использованные изображения
+    IMAGE_STORE_SWEEP_INTERVAL: float = 60 * 60
+    IMAGE_VARIANTS_ENABLED: bool = True  # WebP и превью для галереи
+    IMAGE_VARIANT_PROCESSES: int = 2
+    IMAGE_WEBP_QUALITY: int = 85
+    IMAGE_THUMB_SIZE: int = 256
+
+    # Кэш результатов txt2img (см. app/services/image_cache.py)
+    IMAGE_CACHE_ENABLED: bool = True
+    IMAGE_CACHE_MAX_ENTRIES: int = 10_000
+    IMAGE_CACHE_TTL_SECONDS: int = 7 * 24 * 60 * 60
+
+    # Трассировка запросов (см. app/core/tracing.py); выключена — почти нулевая цена
+    TRACING_ENABLED: bool = False
+    TRACE_SAMPLE_RATE: float = 1.0  # Доля запросов, для которых пишется трасса
+    TRACE_EXPORT_PATH: Optional[str] = "/tmp/traces.jsonl"  # JSON Lines, по спану на строку
+    TRACE_COLLECTOR_URL: Optional[str] = None  # Куда POST-ить пачки спанов (JSON), если задан
+
+    # Администраторы (доступ к /api/v1/system/profile)
+    ADMIN_EMAILS: list[str] = []
+    PROFILER_MAX_SECONDS: int = 60
+
     class Config:
         env_file = ".env"
 
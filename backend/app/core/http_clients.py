@@ -0,0 +1,112 @@
+# app/core/http_clients.py
+"""
+Общие httpx-клиенты для внешних моделей (Automatic1111 и polza.ai).
+
+Клиенты создаются один раз на процесс (lifespan в main.py / worker.py),
+держат keep-alive соединения и ограничены по числу соединений на апстрим.
+"""
+
+from typing import Optional
+
+import httpx
+import redis.asyncio as redis
+from starlette.requests import HTTPConnection
+
+from app.core.config import settings
+from app.core.metrics import InstrumentedTransport
+from app.core.sd_pool import Backend, SDPool
+
+
+def _make_client(
+        name: str,
+        base_url: str,
+        max_connections: int,
+        connect_timeout: float,
+        read_timeout: float,
+        http2: bool,
+        headers: dict | None = None,
+) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        # Свой транспорт пишет метрики апстрима (задержка, исходы) под меткой name
+        transport=InstrumentedTransport(
+            name,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+        ),
+        # Отдельные таймауты: подключение должно падать быстро, а чтение
+        # ответа A1111 может законно длиться минуты.
+        timeout=httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=connect_timeout,
+            pool=read_timeout,
+        ),
+    )
+
+
+def _pool_stats(client: httpx.AsyncClient) -> dict:
+    """Статистика пула соединений httpcore (публичного API для этого у httpx нет)."""
+    pool = getattr(client._transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for c in connections if c.is_idle())
+    closed = sum(1 for c in connections if c.is_closed())
+    waiting = sum(1 for req in getattr(pool, "_requests", []) if getattr(req, "connection", None) is None)
+    return {
+        "max_connections": getattr(pool, "_max_connections", None),
+        "connections": len(connections),
+        "in_use": len(connections) - idle - closed,
+        "idle": idle,
+        "waiting_requests": waiting,
+    }
+
+
+def _sd_backend(url: str) -> Backend:
+    return Backend(url=url, client=_make_client(
+        f"sd:{httpx.URL(url).netloc.decode()}",  # Метки апстрима — по бэкенду
+        url,
+        max_connections=settings.SD_MAX_CONNECTIONS,
+        connect_timeout=settings.SD_CONNECT_TIMEOUT,
+        read_timeout=settings.SD_READ_TIMEOUT,
+        http2=settings.SD_HTTP2,
+    ))
+
+
+class UpstreamClients:
+    """Реестр клиентов к апстримам, живущий всё время работы процесса."""
+
+    def __init__(self):
+        # Серверы A1111 за балансировщиком; у sd тот же get/post, что у httpx-клиента
+        self.sd = SDPool([_sd_backend(url) for url in settings.SD_BACKEND_URLS or [settings.COMFYUI_URL]])
+        self.polza = _make_client(
+            "polza",
+            settings.POLZA_API_URL,
+            max_connections=settings.POLZA_MAX_CONNECTIONS,
+            connect_timeout=settings.POLZA_CONNECT_TIMEOUT,
+            read_timeout=settings.POLZA_READ_TIMEOUT,
+            http2=settings.POLZA_HTTP2,
+            headers={"Authorization": f"Bearer {settings.POLZA_API_KEY}"},
+        )
+
+    def start(self, r: Optional[redis.Redis] = None) -> None:
+        self.sd.start(r)
+
+    def pool_stats(self) -> dict:
+        return {
+            **{f"sd:{b.url}": _pool_stats(b.client) for b in self.sd.backends},
+            "polza": _pool_stats(self.polza),
+        }
+
+    async def aclose(self) -> None:
+        await self.sd.aclose()
+        await self.polza.aclose()
+
+
+def get_http_clients(conn: HTTPConnection) -> UpstreamClients:
+    """Зависимость FastAPI: работает и для HTTP-запросов, и для WebSocket."""
+    return conn.app.state.http_clients
@@ -0,0 +1,202 @@
+# app/core/metrics.py
+"""
+Метрики Prometheus: HTTP, WebSocket, SQL, апстримы (A1111, polza.ai) и LLM.
+
+Отдаются на GET /metrics. Кардинальность меток ограничена: маршрут — это
+шаблон пути (/api/v1/image/jobs/{job_id}), а не сам путь; всё, что не
+сматчилось ни с одним маршрутом, попадает в "unmatched". Под несколькими
+воркерами uvicorn задайте PROMETHEUS_MULTIPROC_DIR — тогда /metrics
+собирает значения всех процессов.
+"""
+
+import os
+import time
+
+import httpx
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core import tracing
+
+# Границы под «быстрые» запросы API: от миллисекунды до десятка секунд
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Апстримы бывают долгими: генерация изображения идёт минутами
+UPSTREAM_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route"],
+                         buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being processed", ["method"],
+                       multiprocess_mode="livesum")
+
+WS_CONNECTIONS = Gauge("websocket_connections", "Open WebSocket connections", ["route"],
+                       multiprocess_mode="livesum")
+WS_FRAMES = Counter("websocket_frames_total", "WebSocket frames (rate() gives frames/s)", ["route", "direction"])
+
+DB_QUERY_LATENCY = Histogram("db_query_duration_seconds", "SQL statement latency", ["engine", "operation"],
+                             buckets=LATENCY_BUCKETS)
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "Failed SQL statements", ["engine", "operation"])
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections checked out from the pool", ["engine"],
+                            multiprocess_mode="livesum")
+
+UPSTREAM_LATENCY = Histogram("upstream_request_duration_seconds", "Upstream latency until response headers",
+                             ["upstream"], buckets=UPSTREAM_BUCKETS)
+UPSTREAM_REQUESTS = Counter("upstream_requests_total", "Upstream requests by outcome (2xx/4xx/5xx/error)",
+                            ["upstream", "outcome"])
+
+LLM_TTFT = Histogram("llm_time_to_first_token_seconds", "Time from request to the first LLM token",
+                     buckets=(0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30))
+LLM_TOKENS_PER_SECOND = Histogram("llm_tokens_per_second", "LLM generation speed after the first token",
+                                  buckets=(5, 10, 20, 30, 50, 75, 100, 150, 200, 400))
+LLM_COMPLETION_TOKENS = Counter("llm_completion_tokens_total", "Generated LLM tokens")
+
+_SQL_OPERATIONS = {"select", "insert", "update", "delete", "begin", "commit", "rollback"}
+
+
+def _route(scope: Scope) -> str:
+    return tracing.route_template(scope) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Чистый ASGI-middleware: не буферизует тело, поэтому не ломает стриминг и WebSocket."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self._websocket(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _http(self, scope: Scope, receive: Receive, send: Send) -> None:
+        method = scope["method"]
+        status = "500"
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            route = _route(scope)
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, route, status).inc()
+
+    async def _websocket(self, scope: Scope, receive: Receive, send: Send) -> None:
+        accepted = False
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "websocket.receive":
+                WS_FRAMES.labels(_route(scope), "in").inc()
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal accepted
+            await send(message)
+            if message["type"] == "websocket.send":
+                WS_FRAMES.labels(_route(scope), "out").inc()
+            elif message["type"] == "websocket.accept":
+                accepted = True
+                WS_CONNECTIONS.labels(_route(scope)).inc()
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            if accepted:
+                WS_CONNECTIONS.labels(_route(scope)).dec()
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+# --- SQLAlchemy ---
+
+def _operation(statement: str) -> str:
+    keyword = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ""
+    return keyword if keyword in _SQL_OPERATIONS else "other"
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """Время каждого SQL-запроса через события движка (для AsyncEngine передавайте .sync_engine)."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        DB_QUERY_LATENCY.labels(name, _operation(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        stack = context.connection.info.get("metrics_started") if context.connection is not None else None
+        if stack:
+            stack.pop()
+        DB_QUERY_ERRORS.labels(name, _operation(context.statement or "")).inc()
+
+    # События пула, а не set_function: так gauge работает и в multiprocess-режиме
+    checked_out = DB_POOL_CHECKED_OUT.labels(name)
+    event.listen(engine, "checkout", lambda *args: checked_out.inc())
+    event.listen(engine, "checkin", lambda *args: checked_out.dec())
+
+
+# --- httpx ---
+
+class InstrumentedTransport(httpx.AsyncHTTPTransport):
+    """AsyncHTTPTransport, который считает задержку до заголовков ответа и исходы запросов."""
+
+    def __init__(self, upstream: str, **kwargs):
+        super().__init__(**kwargs)
+        self._upstream = upstream
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            with tracing.span(f"upstream.{self._upstream}", method=request.method, path=request.url.path) as span:
+                if span is not None:
+                    # Апстрим с поддержкой W3C trace context продолжит нашу трассу
+                    request.headers["traceparent"] = f"00-{span.trace_id}-{span.span_id}-01"
+                response = await super().handle_async_request(request)
+                if span is not None:
+                    span.attributes["status"] = response.status_code
+        except Exception:
+            UPSTREAM_REQUESTS.labels(self._upstream, "error").inc()
+            raise
+        UPSTREAM_LATENCY.labels(self._upstream).observe(time.perf_counter() - started)
+        UPSTREAM_REQUESTS.labels(self._upstream, f"{response.status_code // 100}xx").inc()
+        return response
+
+
+# --- LLM ---
+
+def observe_llm_reply(time_to_first_token: float | None, duration: float, completion_tokens: int) -> None:
+    if time_to_first_token is None:
+        return
+    LLM_TTFT.observe(time_to_first_token)
+    LLM_COMPLETION_TOKENS.inc(completion_tokens)
+    generating = duration - time_to_first_token
+    if completion_tokens and generating > 0:
+        LLM_TOKENS_PER_SECOND.observe(completion_tokens / generating)
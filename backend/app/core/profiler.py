@@ -0,0 +1,65 @@
+# app/core/profiler.py
+"""
+Сэмплирующий профайлер живого процесса.
+
+Отдельный поток каждые interval секунд снимает стеки всех потоков
+(sys._current_frames) и считает одинаковые стеки. Результат — «folded stacks»
+(`thread;func (file:line);... count`), которые понимают flamegraph.pl,
+speedscope и inferno. Код приложения не инструментируется, поэтому вне
+сеанса профилирования цена нулевая, а во время — один поток, читающий стеки.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Сеанс профилирования уже идёт."""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})"
+
+
+def _sample(duration: float, interval: float) -> tuple[Counter, int]:
+    stacks: Counter = Counter()
+    own = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    deadline = time.monotonic() + duration
+    samples = 0
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, str(thread_id)))
+            stacks[";".join(reversed(labels))] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+async def profile(duration: float, interval: float, thread: Optional[str] = None) -> tuple[str, int]:
+    """
+    Профиль за duration секунд в folded-формате и число снятых сэмплов.
+    thread — оставить только этот поток (например MainThread с event loop).
+    """
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        stacks, samples = await asyncio.to_thread(_sample, duration, interval)
+    finally:
+        _lock.release()
+    lines = [f"{stack} {count}" for stack, count in stacks.most_common()
+             if thread is None or stack.startswith(f"{thread};")]
+    return "\n".join(lines) + "\n", samples
@@ -0,0 +1,272 @@
+# app/core/sd_pool.py
+"""
+Пул серверов Automatic1111: выбор бэкенда, пробы здоровья, circuit breaker и повтор.
+
+Запрос уходит на доступный бэкенд с наименьшим числом запросов в работе
+(least outstanding requests); на каждом одновременно идёт не больше
+IMAGE_WORKER_CONCURRENCY запросов — это слоты его GPU. Если все слоты заняты,
+запрос ждёт освободившегося, но не дольше SD_BACKEND_WAIT_TIMEOUT.
+
+Бэкенд выпадает из ротации, если провалил пробу /sdapi/v1/options или
+SD_BREAKER_FAILURES запросов подряд (breaker открыт). Через
+SD_BREAKER_COOLDOWN на него пускается один пробный запрос (half-open):
+успех возвращает бэкенд, неудача снова открывает breaker. Успешная проба
+здоровья тоже закрывает breaker после паузы.
+
+Запросы к A1111 без побочных эффектов, поэтому обрыв соединения или 5xx
+(например, перезапуск сервера) повторяется на другом бэкенде, до
+SD_RETRY_ATTEMPTS раз. Таймаут чтения не повторяется: сервер, скорее всего,
+ещё рисует, и повтор только удвоил бы нагрузку.
+
+Все бэкенды должны держать один и тот же чекпоинт: от него зависит ключ кэша.
+Чекпоинт берётся из той же пробы /sdapi/v1/options, без слота GPU: API не ждёт
+за генерацией, чтобы просто узнать имя модели.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import httpx
+import redis.asyncio as redis
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY_PREFIX = "sdpool:snapshot:"  # Состояние пула каждого процесса для /system/sd-backends
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_RETRY_STATUSES = {500, 502, 503, 504}
+_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError, httpx.ReadError,
+                 httpx.WriteError, httpx.PoolTimeout)
+_LATENCY_ALPHA = 0.2  # Вес нового замера в скользящем среднем задержки
+
+
+class NoBackendAvailableError(httpx.TransportError):
+    """Ни один SD-бэкенд не освободился за SD_BACKEND_WAIT_TIMEOUT (ловится как httpx.HTTPError)."""
+
+
+@dataclass
+class Backend:
+    url: str
+    client: httpx.AsyncClient
+    inflight: int = 0
+    healthy: bool = True
+    breaker: str = CLOSED
+    failures: int = 0  # Неудачи подряд
+    opened_at: float = 0.0
+    requests: int = 0
+    errors: int = 0
+    latency_ewma: Optional[float] = None
+    last_error: Optional[str] = None
+    checkpoint: Optional[str] = None  # sd_model_checkpoint из последней успешной пробы
+    probing: bool = field(default=False, repr=False)  # Пробный запрос half-open уже идёт
+
+    def available(self, now: float) -> bool:
+        if not self.healthy or self.inflight >= settings.IMAGE_WORKER_CONCURRENCY:
+            return False
+        if self.breaker == OPEN:
+            return now - self.opened_at >= settings.SD_BREAKER_COOLDOWN
+        if self.breaker == HALF_OPEN:
+            return not self.probing
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "breaker": self.breaker,
+            "inflight": self.inflight,
+            "capacity": settings.IMAGE_WORKER_CONCURRENCY,
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "latency_ewma_ms": round(self.latency_ewma * 1000) if self.latency_ewma is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class SDPool:
+    """Набор бэкендов с интерфейсом httpx.AsyncClient (get/post) для sd_api."""
+
+    def __init__(self, backends: list[Backend]):
+        self.backends = backends
+        self._changed = asyncio.Condition()
+        self._health: Optional[asyncio.Task] = None
+
+    @property
+    def capacity(self) -> int:
+        return len(self.backends) * settings.IMAGE_WORKER_CONCURRENCY
+
+    @property
+    def checkpoint(self) -> Optional[str]:
+        """Чекпоинт здорового бэкенда по последней пробе; None — пока неизвестен."""
+        return next((b.checkpoint for b in self.backends if b.healthy and b.checkpoint), None)
+
+    # --- Выбор бэкенда ---
+
+    def _pick(self, exclude: set[str]) -> Optional[Backend]:
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b.available(now)]
+        # Повтор — по возможности на другом бэкенде, но лучше тот же, чем никакого
+        candidates = [b for b in candidates if b.url not in exclude] or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=lambda b: (b.inflight, b.latency_ewma or 0.0))
+
+    async def _acquire(self, exclude: set[str]) -> Backend:
+        async def wait_for_backend() -> Backend:
+            async with self._changed:
+                while (backend := self._pick(exclude)) is None:
+                    # Просыпаемся и по таймеру: breaker мог остыть без всяких событий
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), settings.SD_BREAKER_COOLDOWN)
+                    except asyncio.TimeoutError:
+                        pass
+                backend.inflight += 1
+                if backend.breaker == OPEN:
+                    backend.breaker = HALF_OPEN
+                if backend.breaker == HALF_OPEN:
+                    backend.probing = True
+                return backend
+
+        try:
+            return await asyncio.wait_for(wait_for_backend(), settings.SD_BACKEND_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise NoBackendAvailableError("No Stable Diffusion backend available")
+
+    async def _release(self, backend: Backend, ok: Optional[bool], elapsed: float = 0.0,
+                       error: Optional[str] = None) -> None:
+        """ok=None — запрос не состоялся по нашей вине (отмена), в статистику не идёт."""
+        async with self._changed:
+            backend.inflight -= 1
+            backend.probing = False
+            if ok is not None:
+                backend.requests += 1
+            if ok:
+                backend.failures = 0
+                backend.breaker = CLOSED
+                backend.latency_ewma = elapsed if backend.latency_ewma is None else (
+                    _LATENCY_ALPHA * elapsed + (1 - _LATENCY_ALPHA) * backend.latency_ewma)
+            elif ok is not None:
+                backend.errors += 1
+                backend.failures += 1
+                backend.last_error = error
+                if backend.breaker == HALF_OPEN or backend.failures >= settings.SD_BREAKER_FAILURES:
+                    if backend.breaker != OPEN:
+                        logger.warning("SD backend %s ejected after %d failures: %s",
+                                       backend.url, backend.failures, error)
+                    backend.breaker = OPEN
+                    backend.opened_at = time.monotonic()
+            self._changed.notify_all()
+
+    # --- Запросы ---
+
+    async def request(self, method: str, url: str, on_backend: Optional[Callable[[Backend], None]] = None,
+                      **kwargs) -> httpx.Response:
+        """on_backend вызывается с бэкендом каждой попытки — sd_api опрашивает его прогресс."""
+        tried: set[str] = set()
+        for attempt in range(settings.SD_RETRY_ATTEMPTS + 1):
+            backend = await self._acquire(tried)
+            tried.add(backend.url)
+            if on_backend is not None:
+                on_backend(backend)
+            started = time.monotonic()
+            try:
+                response = await backend.client.request(method, url, **kwargs)
+            except _RETRY_ERRORS as e:
+                await self._release(backend, False, error=f"{type(e).__name__}: {e}")
+                if attempt == settings.SD_RETRY_ATTEMPTS:
+                    raise
+                logger.info("Retrying SD request on another backend after %s from %s",
+                            type(e).__name__, backend.url)
+                continue
+            except httpx.TimeoutException as e:
+                # Таймаут чтения — бэкенд завис или перегружен, но повторять нельзя: он может ещё рисовать
+                await self._release(backend, False, error=f"{type(e).__name__}: {e}")
+                raise
+            except BaseException:
+                await asyncio.shield(self._release(backend, None))
+                raise
+            if response.status_code in _RETRY_STATUSES:
+                await self._release(backend, False, error=f"HTTP {response.status_code}")
+                if attempt < settings.SD_RETRY_ATTEMPTS:
+                    logger.info("Retrying SD request on another backend after HTTP %d from %s",
+                                response.status_code, backend.url)
+                    continue
+                return response
+            await self._release(backend, True, time.monotonic() - started)
+            return response
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    # --- Пробы здоровья ---
+
+    async def _probe(self, backend: Backend) -> None:
+        try:
+            response = await backend.client.get("/sdapi/v1/options", timeout=settings.SD_HEALTH_TIMEOUT)
+            healthy = response.status_code == 200
+            error = None if healthy else f"HTTP {response.status_code}"
+            checkpoint = response.json().get("sd_model_checkpoint") if healthy else None
+        except (httpx.HTTPError, ValueError) as e:  # ValueError — ответ не JSON
+            healthy, error, checkpoint = False, f"{type(e).__name__}: {e}", None
+        async with self._changed:
+            if healthy != backend.healthy:
+                logger.warning("SD backend %s is %s%s", backend.url, "up" if healthy else "down",
+                               f" ({error})" if error else "")
+            backend.healthy = healthy
+            backend.checkpoint = checkpoint
+            if not healthy:
+                backend.last_error = error
+            elif backend.breaker == OPEN and time.monotonic() - backend.opened_at >= settings.SD_BREAKER_COOLDOWN:
+                backend.breaker, backend.failures = CLOSED, 0
+            self._changed.notify_all()
+
+    async def _health_loop(self, r: Optional[redis.Redis]) -> None:
+        snapshot_key = f"{SNAPSHOT_KEY_PREFIX}{socket.gethostname()}-{os.getpid()}"
+        while True:
+            await asyncio.gather(*(self._probe(b) for b in self.backends))
+            if r is not None:
+                try:
+                    await r.set(snapshot_key, json.dumps({"backends": self.stats(), "at": time.time()}),
+                                ex=int(settings.SD_HEALTH_INTERVAL * 3) + 1)
+                except redis.RedisError as e:
+                    logger.warning("Failed to publish SD pool snapshot: %s", e)
+            await asyncio.sleep(settings.SD_HEALTH_INTERVAL)
+
+    def start(self, r: Optional[redis.Redis] = None) -> None:
+        """Запускает пробы здоровья; с r — ещё и публикует состояние пула в Redis."""
+        self._health = asyncio.create_task(self._health_loop(r))
+
+    def stats(self) -> list[dict]:
+        return [b.stats() for b in self.backends]
+
+    async def aclose(self) -> None:
+        if self._health is not None:
+            self._health.cancel()
+            await asyncio.gather(self._health, return_exceptions=True)
+        for backend in self.backends:
+            await backend.client.aclose()
+
+
+async def cluster_stats(r: redis.Redis) -> dict:
+    """Последние снимки пулов всех процессов (API и воркеров генерации)."""
+    snapshots = {}
+    async for key in r.scan_iter(match=f"{SNAPSHOT_KEY_PREFIX}*"):
+        value = await r.get(key)
+        if value is not None:
+            snapshots[key.removeprefix(SNAPSHOT_KEY_PREFIX)] = json.loads(value)
+    return snapshots
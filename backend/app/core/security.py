@@ -1,5 +1,8 @@
 # app/core/security.py
 
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
@@ -8,11 +11,19 @@ from passlib.context import CryptContext
 
 # Предполагаем, что у вас есть файл config.py, загружающий переменные из .env
 # Если нет, создайте его или используйте os.getenv напрямую
+from app.core import tracing
 from app.core.config import settings  # settings.SECRET_KEY, settings.ALGORITHM, etc.
 from app.schemas import TokenPayload
 
-# Настройки хеширования паролей
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Настройки хеширования паролей. min = max = default, чтобы хеш с любой другой
+# стоимостью считался устаревшим и пересчитывался при входе (verify_and_update).
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
 
 
 # --- Пароли ---
@@ -27,6 +38,78 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+# bcrypt занимает CPU на сотни миллисекунд. В async-обработчиках его нельзя
+# вызывать напрямую: на это время встаёт весь event loop вместе с чатами.
+# Поэтому хеширование идёт в ограниченном пуле потоков (bcrypt отпускает GIL),
+# а очередь перед пулом ограничена и измеряется.
+
+class PasswordHasherBusy(Exception):
+    """Очередь на хеширование переполнена (PASSWORD_HASH_MAX_QUEUE)."""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_queue: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = asyncio.Semaphore(workers)
+        self._max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def run(self, fn, *args):
+        if self.waiting >= self._max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        with tracing.span("password_hash") as span:
+            queued_at = time.monotonic()
+            self.waiting += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                wait = time.monotonic() - queued_at
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                if span is not None:
+                    span.attributes["queue_wait_ms"] = round(wait * 1000, 2)
+                self.in_flight += 1
+                return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+            finally:
+                self.in_flight -= 1
+                self.completed += 1
+                self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait / self.completed * 1000, 2) if self.completed else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Хеширует пароль в пуле, не блокируя event loop."""
+    return await password_hasher.run(pwd_context.hash, password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """
+    Проверяет пароль в пуле. Вторым элементом возвращает новый хеш, если старый
+    посчитан с другой стоимостью (BCRYPT_ROUNDS поменяли) и его стоит сохранить.
+    """
+    return await password_hasher.run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
 # --- JWT Токены ---
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -62,6 +145,6 @@ def decode_token(token: str) -> Optional[TokenPayload]:
     """Декодирует и валидирует токен."""
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return TokenPayload(sub=payload.get("sub"))
-    except JWTError:
+        return TokenPayload(sub=payload.get("sub"), email=payload.get("email"), exp=payload.get("exp"))
+    except (JWTError, ValueError):
         return None
\ No newline at end of file
@@ -0,0 +1,241 @@
+# app/core/tracing.py
+"""
+Лёгкая трассировка запросов: спаны в contextvars, экспорт в JSON Lines и/или коллектор.
+
+Корневой спан создаёт TracingMiddleware (HTTP-запрос, WebSocket-соединение) или
+span(..., root=True) — например, на каждый ход чата. Внутри него:
+    with tracing.span("auth.get_current_user", cached=True): ...
+Автоматически пишутся спаны SQL-запросов (события движка), запросов к апстримам
+(InstrumentedTransport) и ожидания пула соединений.
+
+Входящий заголовок traceparent (W3C) продолжает чужую трассу, а в ответ
+уходит X-Trace-Id. При TRACING_ENABLED=False span() возвращает общий no-op
+контекст, а middleware и события движка не подключаются вовсе.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Optional
+
+import httpx
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH = 512
+EXPORT_INTERVAL = 1.0
+MAX_PENDING = 50_000  # Если экспорт не успевает, новые спаны отбрасываются
+
+_NOOP = nullcontext()
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str = field(default_factory=lambda: os.urandom(8).hex())
+    parent_id: Optional[str] = None
+    start: float = field(default_factory=time.time)
+    duration_ms: Optional[float] = None
+    attributes: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "name": self.name, "start": self.start, "duration_ms": self.duration_ms,
+            "attributes": self.attributes, "error": self.error,
+        }, ensure_ascii=False, default=str)
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+_pending: list[Span] = []
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current.get()
+    return span.trace_id if span else None
+
+
+def _finish(span: Span, started: float) -> None:
+    span.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+    if len(_pending) < MAX_PENDING:
+        _pending.append(span)
+
+
+@contextmanager
+def _span(name: str, root: bool, trace_id: Optional[str], parent_id: Optional[str], attributes: dict):
+    parent = None if root else _current.get()
+    if parent is None and not root:
+        yield None  # Вне трассы (не сэмплированный запрос, фоновая задача) — ничего не пишем
+        return
+    # Продолжение чужой трассы (trace_id задан) уже прошло сэмплирование у её начала
+    if parent is None and trace_id is None and random.random() >= settings.TRACE_SAMPLE_RATE:
+        yield None
+        return
+    span = Span(name=name, trace_id=parent.trace_id if parent else (trace_id or os.urandom(16).hex()),
+                parent_id=parent.span_id if parent else parent_id, attributes=attributes)
+    token = _current.set(span)
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException as e:
+        span.error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        _finish(span, started)
+
+
+def span(name: str, root: bool = False, trace_id: Optional[str] = None, parent_id: Optional[str] = None,
+         **attributes):
+    """Контекст спана; root=True начинает новую трассу. Без TRACING_ENABLED — no-op."""
+    if not settings.TRACING_ENABLED:
+        return _NOOP
+    return _span(name, root, trace_id, parent_id, attributes)
+
+
+# --- ASGI ---
+
+def _parse_traceparent(scope: Scope) -> tuple[Optional[str], Optional[str]]:
+    for key, value in scope.get("headers", ()):
+        if key == b"traceparent":
+            parts = value.decode("latin-1").split("-")
+            if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+                return parts[1], parts[2]
+    return None, None
+
+
+def route_template(scope: Scope) -> Optional[str]:
+    """
+    Полный шаблон сматченного маршрута (/api/v1/image/jobs/{job_id}) или None.
+    Новые FastAPI кладут в scope["route"] маршрут роутера без prefix из
+    include_router: prefix — это часть пути перед хвостом, который совпал
+    с шаблоном маршрута. У старых шаблон уже полный, и prefix выходит пустым.
+    """
+    route = scope.get("route")
+    regex = getattr(route, "path_regex", None)
+    if regex is None:
+        return None
+    template = getattr(route, "path_format", None) or route.path
+    path = scope["path"]
+    for i, char in enumerate(path + "/"):
+        # Хвост начинается с "/" или пуст (маршрут "" — сам prefix)
+        if char == "/" and regex.fullmatch(path[i:]):
+            return path[:i] + template
+    return template
+
+
+class TracingMiddleware:
+    """Корневой спан на каждый HTTP-запрос и WebSocket-соединение."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        trace_id, parent_id = _parse_traceparent(scope)
+        with _span(f"{scope['type']} {scope.get('method', 'WS')}", True, trace_id, parent_id,
+                   {"path": scope["path"]}) as root:
+            if root is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_wrapper(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    root.attributes["status"] = message["status"]
+                    message.setdefault("headers", [])
+                    message["headers"] = [*message["headers"], (b"x-trace-id", root.trace_id.encode())]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                template = route_template(scope)
+                if template is not None:
+                    # Имя по шаблону маршрута, чтобы трассы одного эндпоинта группировались
+                    root.name = f"{scope.get('method', 'WS')} {template}"
+
+
+# --- SQLAlchemy ---
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """Спан на каждый SQL-запрос внутри трассы. Без TRACING_ENABLED ничего не подключает."""
+    if not settings.TRACING_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        parent = _current.get()
+        if parent is not None:
+            conn.info.setdefault("trace_spans", []).append(
+                (Span(name="db.query", trace_id=parent.trace_id, parent_id=parent.span_id,
+                      attributes={"engine": name, "statement": statement[:500]}), time.perf_counter()))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None and conn.info.get("trace_spans"):
+            _finish(*conn.info["trace_spans"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        spans = context.connection.info.get("trace_spans") if context.connection is not None else None
+        if spans:
+            span, started = spans.pop()
+            span.error = type(context.original_exception).__name__
+            _finish(span, started)
+
+
+# --- Экспорт ---
+
+def _write_lines(path: str, lines: list[str]) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+async def _export(batch: list[Span], client: Optional[httpx.AsyncClient]) -> None:
+    lines = [s.to_json() for s in batch]
+    if settings.TRACE_EXPORT_PATH:
+        await asyncio.to_thread(_write_lines, settings.TRACE_EXPORT_PATH, lines)
+    if client is not None:
+        try:
+            await client.post(settings.TRACE_COLLECTOR_URL, content="[" + ",".join(lines) + "]",
+                              headers={"Content-Type": "application/json"})
+        except httpx.HTTPError as e:
+            logger.warning("Trace collector unavailable: %s", e)
+
+
+async def run_exporter() -> None:
+    """Фоновая задача процесса: раз в EXPORT_INTERVAL сбрасывает накопленные спаны."""
+    client = httpx.AsyncClient(timeout=5) if settings.TRACE_COLLECTOR_URL else None
+    try:
+        while True:
+            await asyncio.sleep(EXPORT_INTERVAL)
+            while _pending:
+                batch = _pending[:EXPORT_BATCH]
+                del _pending[:EXPORT_BATCH]
+                await _export(batch, client)
+    finally:
+        if _pending:
+            batch = _pending[:]
+            _pending.clear()
+            await asyncio.shield(_export(batch, client))
+        if client is not None:
+            await client.aclose()
@@ -0,0 +1,248 @@
+# app/core/ws_manager.py
+"""
+Учёт WebSocket-соединений: лимиты, heartbeat, уборка мёртвых и drain при остановке.
+
+    async with manager.connect(ws, user.id) as conn:
+        raw = await manager.receive_text(conn)
+
+Лимиты общие для всех воркеров и узлов: соединения лежат в Redis в sorted set'ах
+(ws:conns и ws:user:<id>) со сроком аренды в score. Аренду продлевает heartbeat
+процесса, поэтому соединения упавшего процесса сами выпадают из подсчёта через
+три интервала heartbeat, без ручной уборки.
+
+Heartbeat: раз в WS_HEARTBEAT_INTERVAL сервер шлёт {"type": "ping"}, клиент
+отвечает {"type": "pong"} (его до обработчика не доходит). Соединение, от
+которого ничего не приходило дольше WS_IDLE_TIMEOUT, закрывается — так
+уходят «мёртвые» мобильные клиенты, у которых TCP ещё не порвался.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+import redis.asyncio as redis
+from fastapi import WebSocket, WebSocketDisconnect, WebSocketException, status
+from starlette.requests import HTTPConnection
+from starlette.websockets import WebSocketState
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+CONNECTIONS_KEY = "ws:conns"
+USER_KEY_PREFIX = "ws:user:"
+PING_FRAME = json.dumps({"type": "ping"})
+
+# Сначала выбрасываем просроченные аренды, затем проверяем оба лимита и регистрируем
+_REGISTER_LUA = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then
+    return -1
+end
+if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[5]) then
+    return -2
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+return 1
+"""
+
+
+def _user_key(user_id: uuid.UUID) -> str:
+    return f"{USER_KEY_PREFIX}{user_id}"
+
+
+def _lease_seconds() -> float:
+    return settings.WS_HEARTBEAT_INTERVAL * 3
+
+
+def _is_pong(raw: str) -> bool:
+    if len(raw) > 64 or "pong" not in raw:
+        return False
+    try:
+        return json.loads(raw).get("type") == "pong"
+    except (ValueError, AttributeError):
+        return False
+
+
+@dataclass
+class Connection:
+    ws: WebSocket
+    user_id: uuid.UUID
+    route: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    opened_at: float = field(default_factory=time.monotonic)
+    last_seen: float = field(default_factory=time.monotonic)
+
+
+class ConnectionManager:
+    def __init__(self, r: redis.Redis):
+        self._r = r
+        self._connections: dict[str, Connection] = {}
+        self._closing = False
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._reaped = 0
+        self._rejected = {"global_limit": 0, "user_limit": 0, "draining": 0, "too_big": 0}
+
+    @asynccontextmanager
+    async def connect(self, ws: WebSocket, user_id: uuid.UUID) -> AsyncIterator[Connection]:
+        """Проверяет лимиты, принимает соединение и снимает его с учёта при выходе."""
+        if self._closing:
+            self._rejected["draining"] += 1
+            raise WebSocketException(code=status.WS_1012_SERVICE_RESTART, reason="Server is restarting")
+        route = getattr(ws.scope.get("route"), "path", ws.url.path)
+        conn = Connection(ws=ws, user_id=user_id, route=route)
+        result = await self._r.eval(
+            _REGISTER_LUA, 2, CONNECTIONS_KEY, _user_key(user_id),
+            time.time(), time.time() + _lease_seconds(), conn.id,
+            settings.WS_MAX_CONNECTIONS, settings.WS_MAX_CONNECTIONS_PER_USER, int(_lease_seconds()) + 1,
+        )
+        if int(result) == -1:
+            self._rejected["global_limit"] += 1
+            raise WebSocketException(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too many connections")
+        if int(result) == -2:
+            self._rejected["user_limit"] += 1
+            raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Too many connections for user")
+
+        self._connections[conn.id] = conn
+        self._drained.clear()
+        try:
+            await ws.accept()
+            yield conn
+        finally:
+            del self._connections[conn.id]
+            if not self._connections:
+                self._drained.set()
+            try:
+                async with self._r.pipeline(transaction=False) as pipe:
+                    pipe.zrem(CONNECTIONS_KEY, conn.id)
+                    pipe.zrem(_user_key(user_id), conn.id)
+                    await pipe.execute()
+            except redis.RedisError as e:
+                # Запись всё равно истечёт по аренде
+                logger.warning("Failed to unregister WebSocket %s: %s", conn.id, e)
+
+    async def receive_text(self, conn: Connection) -> str:
+        """
+        Следующий кадр клиента. Pong поглощается, слишком большой кадр закрывает
+        соединение с кодом 1009. Закрытое соединение — WebSocketDisconnect.
+        """
+        while True:
+            raw = await conn.ws.receive_text()
+            conn.last_seen = time.monotonic()
+            # Символ UTF-8 занимает до 4 байт: короткие кадры не кодируем ради проверки
+            if len(raw) * 4 > settings.WS_MAX_MESSAGE_BYTES and len(raw.encode()) > settings.WS_MAX_MESSAGE_BYTES:
+                self._rejected["too_big"] += 1
+                await self._close(conn, status.WS_1009_MESSAGE_TOO_BIG, "Message too big")
+                raise WebSocketDisconnect(code=status.WS_1009_MESSAGE_TOO_BIG)
+            if not _is_pong(raw):
+                return raw
+
+    async def _close(self, conn: Connection, code: int, reason: str) -> None:
+        if conn.ws.application_state != WebSocketState.CONNECTED:
+            return
+        try:
+            await asyncio.wait_for(conn.ws.close(code=code, reason=reason), settings.WS_HEARTBEAT_INTERVAL)
+        except (asyncio.TimeoutError, RuntimeError, WebSocketDisconnect, OSError):
+            pass  # Клиент уже недоступен — обработчик получит disconnect при чтении
+
+    async def _ping(self, conn: Connection) -> None:
+        if time.monotonic() - conn.last_seen > settings.WS_IDLE_TIMEOUT:
+            self._reaped += 1
+            logger.info("Reaping idle WebSocket %s of user %s", conn.id, conn.user_id)
+            await self._close(conn, status.WS_1001_GOING_AWAY, "Heartbeat timeout")
+            return
+        if conn.ws.application_state != WebSocketState.CONNECTED:
+            return
+        try:
+            await asyncio.wait_for(conn.ws.send_text(PING_FRAME), settings.WS_HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            self._reaped += 1
+            await self._close(conn, status.WS_1001_GOING_AWAY, "Heartbeat timeout")
+        except (RuntimeError, WebSocketDisconnect, OSError):
+            pass
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.WS_HEARTBEAT_INTERVAL)
+            connections = list(self._connections.values())
+            if not connections:
+                continue
+            await asyncio.gather(*(self._ping(conn) for conn in connections))
+            # Продлеваем аренду всем живым соединениям процесса одним запросом на ключ
+            expires = time.time() + _lease_seconds()
+            try:
+                async with self._r.pipeline(transaction=False) as pipe:
+                    pipe.zadd(CONNECTIONS_KEY, {conn.id: expires for conn in connections}, xx=True)
+                    for conn in connections:
+                        pipe.zadd(_user_key(conn.user_id), {conn.id: expires}, xx=True)
+                        pipe.expire(_user_key(conn.user_id), int(_lease_seconds()) + 1)
+                    await pipe.execute()
+            except redis.RedisError as e:
+                logger.warning("Failed to renew WebSocket leases: %s", e)
+
+    def start(self) -> None:
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def drain(self) -> None:
+        """
+        Перестаёт принимать соединения, закрывает открытые кодом 1012 (клиент
+        переподключается к другому воркеру и дочитывает ответ) и ждёт, пока
+        обработчики завершатся, но не дольше WS_DRAIN_TIMEOUT.
+        """
+        self._closing = True
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+        if not self._connections:
+            return
+        logger.info("Draining %d WebSocket connections", len(self._connections))
+        await asyncio.gather(*(self._close(conn, status.WS_1012_SERVICE_RESTART, "Server is restarting")
+                               for conn in list(self._connections.values())))
+        try:
+            await asyncio.wait_for(self._drained.wait(), settings.WS_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("%d WebSocket handlers did not finish in time", len(self._connections))
+
+    def stats(self) -> dict:
+        """Соединения этого процесса."""
+        now = time.monotonic()
+        per_user: dict[uuid.UUID, int] = {}
+        by_route: dict[str, int] = {}
+        for conn in self._connections.values():
+            per_user[conn.user_id] = per_user.get(conn.user_id, 0) + 1
+            by_route[conn.route] = by_route.get(conn.route, 0) + 1
+        return {
+            "pid": os.getpid(),
+            "connections": len(self._connections),
+            "users": len(per_user),
+            "max_per_user": max(per_user.values(), default=0),
+            "by_route": by_route,
+            "oldest_seconds": round(max((now - c.opened_at for c in self._connections.values()), default=0), 1),
+            "reaped": self._reaped,
+            "rejected": dict(self._rejected),
+            "draining": self._closing,
+        }
+
+    async def cluster_stats(self) -> dict:
+        """Соединения всех процессов (по живым арендам в Redis) и лимиты."""
+        total = await self._r.zcount(CONNECTIONS_KEY, time.time(), "+inf")
+        return {
+            "connections": total,
+            "limit": settings.WS_MAX_CONNECTIONS,
+            "limit_per_user": settings.WS_MAX_CONNECTIONS_PER_USER,
+        }
+
+
+def get_ws_manager(conn: HTTPConnection) -> ConnectionManager:
+    return conn.app.state.ws_manager
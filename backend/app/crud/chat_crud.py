@@ -0,0 +1,115 @@
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import load_only, raiseload, selectinload
+from app.crud.pagination import paginate
+from app.models import Character, ChatSession, ChatSummary, Message
+import uuid
+from typing import Optional
+
+
+async def get_user_character(db: AsyncSession, user_id: uuid.UUID, character_id: uuid.UUID) -> Optional[Character]:
+    """Получает персонажа, только если он принадлежит пользователю."""
+    result = await db.execute(
+        select(Character).where(Character.id == character_id, Character.owner_id == user_id)
+    )
+    return result.scalars().first()
+
+
+async def get_user_session(db: AsyncSession, user_id: uuid.UUID, session_id: uuid.UUID) -> Optional[ChatSession]:
+    """Получает чат-сессию пользователя."""
+    result = await db.execute(
+        select(ChatSession).where(ChatSession.id == session_id, ChatSession.user_id == user_id)
+    )
+    return result.scalars().first()
+
+
+async def create_session(db: AsyncSession, user_id: uuid.UUID, character_id: uuid.UUID) -> ChatSession:
+    """Создаёт новую чат-сессию с персонажем."""
+    db_session = ChatSession(user_id=user_id, character_id=character_id)
+    db.add(db_session)
+    await db.commit()
+    await db.refresh(db_session)
+    return db_session
+
+
+async def get_recent_messages(db: AsyncSession, session_id: uuid.UUID, limit: int) -> list[Message]:
+    """Последние `limit` сообщений сессии в хронологическом порядке."""
+    result = await db.execute(
+        select(Message)
+        .where(Message.session_id == session_id)
+        .order_by(Message.created_at.desc())
+        .limit(limit)
+    )
+    return list(reversed(result.scalars().all()))
+
+
+async def get_messages_between(db: AsyncSession, session_id: uuid.UUID, after: Optional[datetime],
+                               before: datetime, limit: int) -> list:
+    """Сообщения сессии с after < created_at < before, от старых к новым (только нужные колонки)."""
+    query = select(Message.id, Message.role, Message.content, Message.created_at).where(
+        Message.session_id == session_id, Message.created_at < before)
+    if after is not None:
+        query = query.where(Message.created_at > after)
+    result = await db.execute(query.order_by(Message.created_at).limit(limit))
+    return list(result.all())
+
+
+async def get_summary(db: AsyncSession, session_id: uuid.UUID) -> Optional[ChatSummary]:
+    result = await db.execute(select(ChatSummary).where(ChatSummary.session_id == session_id))
+    return result.scalars().first()
+
+
+async def save_summary(db: AsyncSession, session_id: uuid.UUID, content: str, tokens: int,
+                       covered_until: datetime, messages_covered: int) -> None:
+    """Создаёт или продвигает сводку сессии. Сводка не откатывается назад по covered_until."""
+    values = {"content": content, "tokens": tokens, "covered_until": covered_until,
+              "messages_covered": messages_covered}
+    stmt = insert(ChatSummary).values(session_id=session_id, **values)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[ChatSummary.session_id],
+        set_={**values, "updated_at": func.now()},
+        where=ChatSummary.covered_until < stmt.excluded.covered_until,
+    ))
+    await db.commit()
+
+
+async def get_messages_by_ids(db: AsyncSession, message_ids: list[uuid.UUID]) -> list[Message]:
+    """Сообщения по id (для долгой памяти чата), в произвольном порядке."""
+    result = await db.execute(
+        select(Message).where(Message.id.in_(message_ids)).options(raiseload("*"))
+    )
+    return list(result.scalars().all())
+
+
+# Списки постранично (см. app/crud/pagination.py). Стратегии загрузки заданы явно,
+# а остальные связи запрещены raiseload: страница — всегда фиксированное число запросов.
+
+async def list_user_characters(db: AsyncSession, user_id: uuid.UUID, cursor: Optional[str], limit: int) -> list[Character]:
+    """Страница персонажей пользователя, новые первыми (+1 строка на признак следующей страницы)."""
+    query = select(Character).where(Character.owner_id == user_id).options(raiseload("*"))
+    result = await db.execute(paginate(query, Character.created_at, Character.id, cursor, limit))
+    return list(result.scalars().all())
+
+
+async def list_user_sessions(db: AsyncSession, user_id: uuid.UUID, cursor: Optional[str], limit: int) -> list[ChatSession]:
+    """Страница чат-сессий с краткими данными персонажа: 2 запроса на страницу."""
+    query = (
+        select(ChatSession)
+        .where(ChatSession.user_id == user_id)
+        .options(
+            selectinload(ChatSession.character).load_only(Character.id, Character.name, Character.avatar_url),
+            raiseload("*"),
+        )
+    )
+    result = await db.execute(paginate(query, ChatSession.created_at, ChatSession.id, cursor, limit))
+    return list(result.scalars().all())
+
+
+async def list_messages(db: AsyncSession, session_id: uuid.UUID, cursor: Optional[str], limit: int) -> list:
+    """Страница сообщений, от новых к старым. Только нужные колонки — без ORM-объектов."""
+    query = select(Message.id, Message.role, Message.content, Message.created_at).where(Message.session_id == session_id)
+    result = await db.execute(paginate(query, Message.created_at, Message.id, cursor, limit))
+    return list(result.all())
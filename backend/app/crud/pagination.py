@@ -0,0 +1,53 @@
+"""
+Keyset-пагинация по (created_at, id), от новых к старым.
+
+Курсор — непрозрачная base64url-строка с последней (created_at, id) страницы;
+следующая страница — строки строго «старше» неё. В отличие от OFFSET, цена
+страницы не растёт с её номером, а вставки не сдвигают уже выданные строки.
+"""
+
+import base64
+import uuid
+from datetime import datetime
+from typing import Any, Optional
+
+from sqlalchemy import Select, tuple_
+
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, row_id: uuid.UUID) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split("|")
+        created_at = datetime.fromisoformat(created_at)
+        if created_at.tzinfo is None:
+            # Все created_at — timestamptz: такой курсор мы не выдавали, а сравнение
+            # naive и aware datetime с незаписанными строками упало бы TypeError
+            raise ValueError("naive timestamp")
+        return created_at, uuid.UUID(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursorError(cursor) from e
+
+
+def paginate(query: Select, created_col, id_col, cursor: Optional[str], limit: int) -> Select:
+    """Добавляет к запросу условие курсора, сортировку и limit+1 (чтобы узнать, есть ли ещё)."""
+    if cursor is not None:
+        query = query.where(tuple_(created_col, id_col) < tuple_(*decode_cursor(cursor)))
+    return query.order_by(created_col.desc(), id_col.desc()).limit(limit + 1)
+
+
+def page(rows: list, limit: int, key=lambda row: (row.created_at, row.id)) -> dict[str, Any]:
+    """Режет выборку из paginate() до limit и строит курсор следующей страницы."""
+    items = rows[:limit]
+    next_cursor = encode_cursor(*key(items[-1])) if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,158 @@
+"""
+Поиск по истории чатов и персонажам пользователя.
+
+Основной режим — полнотекстовый: tsvector-колонки с GIN-индексами (миграция 0004),
+каждое слово запроса ищется как префикс ("прив" найдёт «привет»). Если так
+ничего не нашлось (опечатка, обрывок слова короче трёх букв), первая страница
+повторяется в режиме триграмм: word_similarity по content / name и description.
+
+Выдача — messages и characters в одном списке по убыванию релевантности,
+с keyset-пагинацией по (rank, kind, id). Сниппеты строятся только для строк
+страницы, а не для всех совпадений.
+"""
+
+import base64
+import json
+import re
+import uuid
+from typing import Optional
+
+from sqlalchemy import Float, String, and_, cast, func, literal, literal_column, null, select, tuple_, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.pagination import InvalidCursorError
+from app.models import Character, ChatSession, Message
+
+SEARCH_CONFIG = "russian"  # Тот же конфиг, что в generated-колонках search_vector
+MIN_PREFIX_LENGTH = 3  # Более короткие слова как префикс совпадают почти со всем
+SNIPPET_OPTIONS = "StartSel=<b>, StopSel=</b>, MaxWords=30, MinWords=10, MaxFragments=2"
+TRIGRAM_SNIPPET_CHARS = 200
+
+_WORD_RE = re.compile(r"\w+")
+_CONFIG = literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+
+
+def _tsquery(q: str) -> Optional[str]:
+    words = [w for w in _WORD_RE.findall(q.lower()) if len(w) >= MIN_PREFIX_LENGTH]
+    return " & ".join(f"{w}:*" for w in words) or None
+
+
+def _encode_cursor(mode: str, rank: float, kind: str, row_id: uuid.UUID) -> str:
+    raw = json.dumps([mode, rank, kind, str(row_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[str, float, str, uuid.UUID]:
+    try:
+        mode, rank, kind, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if mode not in ("fts", "trigram"):
+            raise ValueError(mode)
+        return mode, float(rank), str(kind), uuid.UUID(row_id)
+    except (ValueError, TypeError, UnicodeDecodeError) as e:
+        raise InvalidCursorError(cursor) from e
+
+
+def _fts_hits(user_id: uuid.UUID, tsquery: str):
+    query = func.to_tsquery(_CONFIG, tsquery)
+    messages = (
+        select(
+            literal("message").label("kind"), Message.id, Message.session_id, ChatSession.character_id,
+            Message.content.label("text"), Message.created_at,
+            cast(func.ts_rank_cd(Message.search_vector, query), Float(53)).label("rank"),
+        )
+        .join(ChatSession, ChatSession.id == Message.session_id)
+        .where(ChatSession.user_id == user_id, Message.search_vector.op("@@")(query))
+    )
+    characters = (
+        select(
+            literal("character").label("kind"), Character.id.label("id"),
+            cast(null(), ChatSession.id.type).label("session_id"), Character.id.label("character_id"),
+            func.concat_ws(" — ", Character.name, Character.description).label("text"), Character.created_at,
+            cast(func.ts_rank_cd(Character.search_vector, query), Float(53)).label("rank"),
+        )
+        .where(Character.owner_id == user_id, Character.search_vector.op("@@")(query))
+    )
+    return union_all(messages, characters).subquery("hits"), query
+
+
+def _trigram_hits(user_id: uuid.UUID, q: str):
+    # `q <% text` — есть слово, похожее на q (pg_trgm.word_similarity_threshold); идёт по GIN-индексу
+    messages = (
+        select(
+            literal("message").label("kind"), Message.id, Message.session_id, ChatSession.character_id,
+            Message.content.label("text"), Message.created_at,
+            cast(func.word_similarity(q, Message.content), Float(53)).label("rank"),
+        )
+        .join(ChatSession, ChatSession.id == Message.session_id)
+        .where(ChatSession.user_id == user_id, literal(q).op("<%")(Message.content))
+    )
+    characters = (
+        select(
+            literal("character").label("kind"), Character.id.label("id"),
+            cast(null(), ChatSession.id.type).label("session_id"), Character.id.label("character_id"),
+            func.concat_ws(" — ", Character.name, Character.description).label("text"), Character.created_at,
+            cast(func.greatest(func.word_similarity(q, Character.name),
+                               func.word_similarity(q, Character.description)), Float(53)).label("rank"),
+        )
+        # OR двух `<%` — BitmapOr по индексам name и description (миграции 0004, 0006)
+        .where(Character.owner_id == user_id,
+               literal(q).op("<%")(Character.name) | literal(q).op("<%")(Character.description))
+    )
+    return union_all(messages, characters).subquery("hits")
+
+
+def _snippet(mode: str, hits, q: str, tsquery):
+    if mode == "fts":
+        return func.ts_headline(_CONFIG, hits.c.text, tsquery, SNIPPET_OPTIONS)
+    # Кусок текста вокруг первого вхождения (или начало текста, если совпадение нечёткое)
+    start = func.greatest(1, func.strpos(func.lower(hits.c.text), func.lower(q)) - TRIGRAM_SNIPPET_CHARS // 4)
+    return func.substr(hits.c.text, start, TRIGRAM_SNIPPET_CHARS)
+
+
+async def _page(db: AsyncSession, mode: str, user_id: uuid.UUID, q: str,
+                after: Optional[tuple[float, str, uuid.UUID]], limit: int) -> list[dict]:
+    tsquery = None
+    if mode == "fts":
+        if _tsquery(q) is None:
+            raise InvalidCursorError(q)  # Курсор от другого запроса
+        hits, tsquery = _fts_hits(user_id, _tsquery(q))
+    else:
+        hits = _trigram_hits(user_id, q)
+
+    page_query = select(hits)
+    if after is not None:
+        # Порядок (rank DESC, kind ASC, id ASC): «после» курсора — меньший rank либо тот же rank и больший ключ
+        rank, kind, row_id = after
+        page_query = page_query.where(
+            (hits.c.rank < rank) | and_(hits.c.rank == rank, tuple_(hits.c.kind, hits.c.id) > tuple_(kind, row_id))
+        )
+    page_rows = page_query.order_by(hits.c.rank.desc(), hits.c.kind, hits.c.id).limit(limit + 1).subquery("page")
+
+    # ts_headline дорогой — считаем его только для строк страницы
+    result = await db.execute(
+        select(page_rows.c.kind, page_rows.c.id, page_rows.c.session_id, page_rows.c.character_id,
+               page_rows.c.created_at, page_rows.c.rank,
+               cast(_snippet(mode, page_rows, q, tsquery), String).label("snippet"))
+        .order_by(page_rows.c.rank.desc(), page_rows.c.kind, page_rows.c.id)
+    )
+    return [dict(row._mapping, mode=mode) for row in result.all()]
+
+
+async def search(db: AsyncSession, user_id: uuid.UUID, q: str, cursor: Optional[str], limit: int) -> dict:
+    """Страница результатов: {"items": [...], "next_cursor": ...} — как у остальных списков."""
+    if cursor is not None:
+        mode, rank, kind, row_id = _decode_cursor(cursor)
+        rows = await _page(db, mode, user_id, q, (rank, kind, row_id), limit)
+    else:
+        rows = []
+        if _tsquery(q) is not None:
+            rows = await _page(db, "fts", user_id, q, None, limit)
+        if not rows:
+            rows = await _page(db, "trigram", user_id, q, None, limit)
+
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = _encode_cursor(last["mode"], last["rank"], last["kind"], last["id"])
+    return {"items": items, "next_cursor": next_cursor}
@@ -2,7 +2,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.models import User
 from app.schemas import UserCreate
-from app.core.security import get_password_hash
+from app.core.security import get_password_hash_async
 import uuid
 from typing import Optional
 
@@ -19,7 +19,7 @@ async def get_user_by_id(db: AsyncSession, user_id: uuid.UUID) -> User | None:
 
 async def create_user(db: AsyncSession, user: UserCreate) -> User:
     """Создает нового пользователя."""
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
 
     db_user = User(
         email=user.email,
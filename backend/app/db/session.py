@@ -1,29 +1,147 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import time
+from pathlib import Path
+
+from alembic.config import Config as AlembicConfig
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from fastapi.requests import HTTPConnection
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
-from app.db.base import Base
+from app.core import tracing
+from app.core.metrics import instrument_engine
 import redis.asyncio as redis
 
+
+ALEMBIC_INI = Path(__file__).resolve().parents[2] / "alembic.ini"
+
+
 # SQLAlchemy
-engine = create_async_engine(settings.DATABASE_URL, echo=True, future=True)
+class PoolStats:
+    """Сколько запросы ждали соединение из пула (замер в get_db / get_read_db)."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float) -> None:
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+_pool_stats: dict[AsyncEngine, PoolStats] = {}
+
+
+def create_engine(url: str, name: str) -> AsyncEngine:
+    """Единственное место, где создаются движки: все параметры пула берутся из Settings."""
+    engine = create_async_engine(
+        url,
+        echo=settings.DB_ECHO,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE},
+    )
+    _pool_stats[engine] = PoolStats()
+    instrument_engine(engine.sync_engine, name)
+    tracing.instrument_engine(engine.sync_engine, name)
+    return engine
+
+
+engine = create_engine(settings.DATABASE_URL, "primary")
 AsyncSessionLocal = sessionmaker(
     bind=engine,
     class_=AsyncSession,
     expire_on_commit=False,
 )
 
-async def init_db():
-    async with engine.begin() as conn:
-        # await conn.run_sync(Base.metadata.drop_all) # Раскомментировать для сброса БД
-        await conn.run_sync(Base.metadata.create_all)
+# Только для чтения: реплика, если она задана, иначе тот же пул, что и у записи.
+# Реплика может отставать — сюда не стоит ходить за тем, что только что записали.
+read_engine = create_engine(settings.DATABASE_READ_URL, "replica") if settings.DATABASE_READ_URL else engine
+ReadSessionLocal = sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+)
+
+class SchemaOutdatedError(RuntimeError):
+    """Версия схемы в БД не совпадает с последней миграцией."""
+
+
+async def check_schema_version():
+    """
+    Схему создают и меняют миграции (`alembic upgrade head`), а не приложение:
+    при старте только сверяем ревизию в БД с последней в migrations/versions.
+    """
+    head = ScriptDirectory.from_config(AlembicConfig(ALEMBIC_INI)).get_current_head()
+    async with engine.connect() as conn:
+        current = await conn.run_sync(lambda sync_conn: MigrationContext.configure(sync_conn).get_current_revision())
+    if current != head:
+        raise SchemaOutdatedError(f"Database schema is at {current}, expected {head}; run `alembic upgrade head`")
+
+async def dispose_engines():
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+
+
+async def _session(session_factory: sessionmaker, stats: PoolStats):
+    async with session_factory() as session:
+        # Берём соединение сразу, чтобы измерить ожидание пула
+        started = time.monotonic()
+        try:
+            with tracing.span("db.pool.checkout"):
+                await session.connection()
+        except PoolTimeoutError:
+            stats.timeouts += 1
+            raise
+        stats.record(time.monotonic() - started)
+        yield session
 
 async def get_db() -> AsyncSession:
-    async with AsyncSessionLocal() as session:
+    async for session in _session(AsyncSessionLocal, _pool_stats[engine]):
+        yield session
+
+async def get_read_db() -> AsyncSession:
+    """Сессия для эндпоинтов, которые только читают (см. DATABASE_READ_URL)."""
+    async for session in _session(ReadSessionLocal, _pool_stats[read_engine]):
         yield session
 
+
+def pool_status(engine: AsyncEngine) -> dict:
+    """Заполненность пула и время ожидания соединения."""
+    pool = engine.pool
+    stats = _pool_stats[engine]
+    checked_out = pool.checkedout()
+    capacity = pool.size() + settings.DB_MAX_OVERFLOW
+    return {
+        "size": pool.size(),
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        "saturation": round(checked_out / capacity, 3) if capacity else 0.0,
+        "checkouts": stats.checkouts,
+        "timeouts": stats.timeouts,
+        "avg_wait_ms": round(stats.total_wait / stats.checkouts * 1000, 2) if stats.checkouts else 0.0,
+        "max_wait_ms": round(stats.max_wait * 1000, 2),
+    }
+
+
+def db_pool_stats() -> dict:
+    stats = {"primary": pool_status(engine)}
+    if read_engine is not engine:
+        stats["replica"] = pool_status(read_engine)
+    return stats
+
 # Redis
 async def get_redis_pool():
     return await redis.from_url(settings.REDIS_URL, encoding="utf-8", decode_responses=True)
 
-async def get_redis(request):
-    return request.app.state.redis
\ No newline at end of file
+async def get_redis(conn: HTTPConnection) -> redis.Redis:
+    return conn.app.state.redis
@@ -1,7 +1,7 @@
 import uuid
-from sqlalchemy import Column, String, Text, ForeignKey, DateTime, func, Boolean
-from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Text, ForeignKey, DateTime, func, Boolean, Index, Computed, Integer
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
 from app.db.base import Base
 
 
@@ -17,18 +17,36 @@ class User(Base):
 
 
 class Character(Base):
+    __table_args__ = (
+        Index("ix_characters_owner_id_created_at", "owner_id", "created_at"),  # Список персонажей владельца
+        # Поиск (см. app/crud/search_crud.py)
+        Index("ix_characters_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_characters_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_characters_description_trgm", "description", postgresql_using="gin",
+              postgresql_ops={"description": "gin_trgm_ops"}),
+    )
+
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String(100), nullable=False)
     description = Column(Text)
     avatar_url = Column(String(512))  # URL аватара
     system_prompt = Column(Text)  # Промпт для "личности"
     owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Считается самим Postgres при вставке/изменении; в обычных запросах не грузится
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(description, '')), 'B')", persisted=True)))
 
     owner = relationship("User", back_populates="characters")
     chat_sessions = relationship("ChatSession", back_populates="character")
 
 
 class ChatSession(Base):
+    __table_args__ = (
+        Index("ix_chat_sessions_user_id_created_at", "user_id", "created_at"),  # Список сессий пользователя
+    )
+
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     title = Column(String(200), default="New Chat")
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -38,13 +56,36 @@ class ChatSession(Base):
     user = relationship("User", back_populates="chat_sessions")
     character = relationship("Character", back_populates="chat_sessions")
     messages = relationship("Message", back_populates="session", cascade="all, delete-orphan")
+    summary = relationship("ChatSummary", back_populates="session", uselist=False, cascade="all, delete-orphan")
 
 
 class Message(Base):
+    __table_args__ = (
+        Index("ix_messages_session_id_created_at", "session_id", "created_at"),  # История сессии
+        # Поиск (см. app/crud/search_crud.py)
+        Index("ix_messages_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_messages_content_trgm", "content", postgresql_using="gin", postgresql_ops={"content": "gin_trgm_ops"}),
+    )
+
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     session_id = Column(UUID(as_uuid=True), ForeignKey("chat_sessions.id"), nullable=False)
     role = Column(String(50), nullable=False)  # 'user' or 'ai'
     content = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    search_vector = deferred(Column(TSVECTOR, Computed("to_tsvector('russian', content)", persisted=True)))
+
+    session = relationship("ChatSession", back_populates="messages")
+
+
+class ChatSummary(Base):
+    """Сводка давней части сессии: пишет фоновая задача, читает сборка промпта (см. app/services/chat_summary.py)."""
+    __tablename__ = "chat_summaries"  # Автоматическое имя было бы chat_summarys
+
+    session_id = Column(UUID(as_uuid=True), ForeignKey("chat_sessions.id", ondelete="CASCADE"), primary_key=True)
+    content = Column(Text, nullable=False)
+    tokens = Column(Integer, nullable=False)
+    covered_until = Column(DateTime(timezone=True), nullable=False)  # created_at последнего сведённого сообщения
+    messages_covered = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
-    session = relationship("ChatSession", back_populates="messages")
\ No newline at end of file
+    session = relationship("ChatSession", back_populates="summary")
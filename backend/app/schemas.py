@@ -1,7 +1,14 @@
 from pydantic import BaseModel, EmailStr, UUID4
-from typing import Optional, List
+from typing import Generic, Optional, List, TypeVar
 from datetime import datetime
 
+T = TypeVar("T")
+
+# --- Pagination ---
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None  # None — это последняя страница
+
 # --- User Schemas ---
 class UserBase(BaseModel):
     email: EmailStr
@@ -23,7 +30,9 @@ class Token(BaseModel):
     token_type: str = "bearer"
 
 class TokenPayload(BaseModel):
-    sub: str # user email
+    sub: str  # user id
+    email: Optional[str] = None
+    exp: Optional[int] = None
 
 # --- Character Schemas ---
 class CharacterBase(BaseModel):
@@ -38,6 +47,14 @@ class CharacterCreate(CharacterBase):
 class CharacterPublic(CharacterBase):
     id: UUID4
     owner_id: UUID4
+    created_at: datetime
+    class Config:
+        from_attributes = True
+
+class CharacterSummary(BaseModel):
+    id: UUID4
+    name: str
+    avatar_url: Optional[str] = None
     class Config:
         from_attributes = True
 
@@ -59,14 +76,43 @@ class ChatSessionPublic(ChatSessionBase):
     id: UUID4
     user_id: UUID4
     character_id: UUID4
-    messages: List[MessagePublic] = []
+    created_at: datetime
+    character: CharacterSummary
+    # Сообщения не встраиваются: их листают через /chat/sessions/{id}/messages
     class Config:
         from_attributes = True
 
+# --- Search Schemas ---
+class SearchHit(BaseModel):
+    kind: str  # message | character
+    id: UUID4
+    session_id: Optional[UUID4] = None  # Для сообщений
+    character_id: UUID4
+    snippet: str  # Совпадения выделены <b>...</b> (в полнотекстовом режиме)
+    rank: float
+    mode: str  # fts | trigram
+    created_at: datetime
+
 # --- Image Gen Schemas ---
 class Txt2ImgRequest(BaseModel):
     prompt: str
     negative_prompt: Optional[str] = "ugly, bad art, deformed"
     steps: Optional[int] = 20
     width: Optional[int] = 1024
-    height: Optional[int] = 1024
\ No newline at end of file
+    height: Optional[int] = 1024
+    seed: int = -1  # -1 — случайный seed
+    checkpoint: Optional[str] = None  # None — текущий чекпоинт A1111
+    use_cache: bool = False  # Разрешить отдать кэшированный результат для случайного seed
+
+class ImageJobPublic(BaseModel):
+    id: str
+    status: str  # queued | running | done | error | cancelled
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    cached: bool = False  # Результат взят из кэша, GPU не использовался
+    progress: Optional[float] = None  # 0..1, пока задача выполняется
+    eta_seconds: Optional[float] = None
+    preview_seq: Optional[int] = None  # Номер последнего кадра GET /jobs/{id}/preview
+    cancel_requested: bool = False
@@ -0,0 +1,344 @@
+# app/services/chat_generation.py
+"""
+Генерация ответов чата, отвязанная от WebSocket.
+
+Процесс, держащий сокет клиента, только ставит задачу в Redis Stream
+chat:gen, а генерирует её любой процесс (run_generators в lifespan каждого
+воркера, группа потребителей — каждая задача достаётся ровно одному).
+Кадры ответа генератор пишет в отдельный стрим chat:reply:<message_id>,
+откуда их читает (relay) владелец сокета. Поэтому:
+    * воркеров uvicorn и узлов может быть сколько угодно;
+    * клиент, переподключившийся к любому воркеру, дочитывает ответ
+      с места обрыва, а не генерирует его заново;
+    * медленный клиент больше не тормозит чтение ответа модели —
+      кадры копятся в стриме (их число ограничено CHAT_MAX_TOKENS).
+
+Сессия занята, пока существует ключ chat:active:<session>. Пока задача ждёт
+в очереди, он живёт CHAT_GENERATION_IDLE_TIMEOUT (позже генератор её не
+возьмёт), а взявший задачу генератор продлевает его на
+CHAT_ACTIVE_LEASE_SECONDS, пока жив: если процесс упал, сессия освободится
+сама за время аренды, а не через CHAT_REPLY_TTL_SECONDS.
+
+Отмена — ключ chat:cancel:<message_id> с TTL, который генератор опрашивает.
+Отключение клиента генерацию не отменяет: ответ дописывается и сохраняется,
+чтобы его можно было дочитать. Сохраняет ответ (MessageWriter + кэш истории)
+тоже генератор.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import socket
+import time
+import uuid
+from contextlib import aclosing
+from typing import Awaitable, Callable, Optional
+
+import httpx
+import redis.asyncio as redis
+
+from app.core import metrics, tracing
+from app.core.config import settings
+from app.core.http_clients import UpstreamClients
+from app.services import chat_history, chat_protocol, llm_client
+from app.services.message_writer import MessageWriter
+
+logger = logging.getLogger(__name__)
+
+JOBS_STREAM = "chat:gen"
+JOBS_GROUP = "generators"
+JOBS_MAXLEN = 10_000
+REPLY_KEY_PREFIX = "chat:reply:"
+ACTIVE_KEY_PREFIX = "chat:active:"  # Сессия -> id ответа, который сейчас генерируется
+CANCEL_KEY_PREFIX = "chat:cancel:"
+
+# Записи стрима ответа получают явные id 0-1, 0-2, ...: message_start — 0-1,
+# дельта с seq=k — 0-(k+2). Так seq из протокола однозначно задаёт место,
+# с которого продолжать чтение после переподключения.
+_FIRST_DELTA_OFFSET = 2
+
+# Сравнение с id ответа и действие над ключом занятости — атомарно: между GET и DEL
+# ключ мог истечь и достаться следующему ответу
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class ReplyInProgressError(Exception):
+    """В сессии уже генерируется ответ."""
+
+
+class GenerationLostError(Exception):
+    """Генератор не прислал ни одного кадра за CHAT_GENERATION_IDLE_TIMEOUT."""
+
+
+def _reply_key(message_id: str) -> str:
+    return f"{REPLY_KEY_PREFIX}{message_id}"
+
+
+def _active_key(session_id: uuid.UUID) -> str:
+    return f"{ACTIVE_KEY_PREFIX}{session_id}"
+
+
+def _cancel_key(message_id: str) -> str:
+    return f"{CANCEL_KEY_PREFIX}{message_id}"
+
+
+def offset_after(seq: Optional[int]) -> int:
+    """Номер записи стрима, после которой продолжать чтение; seq=None — с самого начала."""
+    return 0 if seq is None else max(seq + _FIRST_DELTA_OFFSET, 0)
+
+
+# --- Сторона сокета ---
+
+async def active_reply(r: redis.Redis, session_id: uuid.UUID) -> Optional[str]:
+    return await r.get(_active_key(session_id))
+
+
+async def claim(r: redis.Redis, session_id: uuid.UUID, message_id: str) -> None:
+    """
+    Занимает сессию под новый ответ. Бросает ReplyInProgressError.
+    Пока задачу не взял генератор, занятость живёт CHAT_GENERATION_IDLE_TIMEOUT.
+    """
+    ttl = math.ceil(settings.CHAT_GENERATION_IDLE_TIMEOUT)
+    if not await r.set(_active_key(session_id), message_id, nx=True, ex=ttl):
+        raise ReplyInProgressError()
+
+
+async def submit(r: redis.Redis, session_id: uuid.UUID, message_id: str, messages: list[dict]) -> None:
+    """Ставит генерацию в очередь; сессия должна быть занята через claim()."""
+    job = {
+        "session_id": str(session_id),
+        "message_id": message_id,
+        "messages": json.dumps(messages, ensure_ascii=False),
+        "enqueued_at": str(time.time()),
+    }
+    span = tracing.current_span()
+    if span is not None:
+        job.update(trace_id=span.trace_id, parent_id=span.span_id)
+    await r.xadd(JOBS_STREAM, job, maxlen=JOBS_MAXLEN, approximate=True)
+
+
+async def release(r: redis.Redis, session_id: uuid.UUID, message_id: str) -> None:
+    """Освобождает сессию, если она всё ещё занята этим ответом."""
+    await r.eval(_RELEASE_LUA, 1, _active_key(session_id), message_id)
+
+
+async def cancel(r: redis.Redis, message_id: str) -> None:
+    await r.set(_cancel_key(message_id), "1", ex=settings.CHAT_REPLY_TTL_SECONDS)
+
+
+async def relay(r: redis.Redis, message_id: str, send: Callable[[str], Awaitable[None]], after: int = 0) -> None:
+    """
+    Пересылает кадры ответа, начиная с записи after + 1, до message_end/error включительно.
+    Бросает GenerationLostError, если кадров нет дольше CHAT_GENERATION_IDLE_TIMEOUT.
+    """
+    key = _reply_key(message_id)
+    last = f"0-{after}"
+    block_ms = int(settings.CHAT_GENERATION_IDLE_TIMEOUT * 1000)
+    while True:
+        response = await r.xread({key: last}, count=100, block=block_ms)
+        if not response:
+            raise GenerationLostError()
+        for entry_id, fields in response[0][1]:
+            last = entry_id
+            await send(fields["frame"])
+            if fields.get("end"):
+                return
+
+
+# --- Сторона генератора ---
+
+class _ReplyStream:
+    """Запись кадров одного ответа в его стрим."""
+
+    def __init__(self, r: redis.Redis, message_id: str):
+        self._r = r
+        self._key = _reply_key(message_id)
+        self._offset = 0
+
+    async def emit(self, frame: str, end: bool = False) -> None:
+        self._offset += 1
+        fields = {"frame": frame, **({"end": "1"} if end else {})}
+        await self._r.xadd(self._key, fields, id=f"0-{self._offset}")
+        if self._offset == 1 or end:
+            await self._r.expire(self._key, settings.CHAT_REPLY_TTL_SECONDS)
+
+
+async def _stream_reply(out: _ReplyStream, client: httpx.AsyncClient, messages: list[dict],
+                        message_id: str, reply: dict) -> None:
+    """
+    Пишет ответ модели в стрим дельтами. Накопленный текст и usage пишутся в `reply`,
+    чтобы они были доступны и при отмене задачи.
+    """
+    started = time.monotonic()
+    usage: dict = {}
+    frames = 0
+    await out.emit(chat_protocol.message_start(message_id))
+    # aclosing: при отмене задачи поток модели закрывается сразу, а не при сборке мусора
+    pieces = chat_protocol.coalesce(llm_client.stream_chat(client, messages, usage),
+                                    settings.CHAT_COALESCE_WINDOW_MS / 1000)
+    async with aclosing(pieces):
+        async for piece in pieces:
+            if "time_to_first_token_ms" not in reply:
+                reply["time_to_first_token_ms"] = round((time.monotonic() - started) * 1000)
+            reply["text"] += piece
+            await out.emit(chat_protocol.delta(message_id, frames, piece))
+            frames += 1
+    reply["usage"] = {
+        **usage,
+        "chars": len(reply["text"]),
+        "frames": frames,
+        "time_to_first_token_ms": reply.get("time_to_first_token_ms"),
+        "duration_ms": round((time.monotonic() - started) * 1000),
+    }
+    ttft = reply.get("time_to_first_token_ms")
+    metrics.observe_llm_reply(ttft / 1000 if ttft is not None else None, time.monotonic() - started,
+                              usage.get("completion_tokens") or chat_history.count_tokens(reply["text"]))
+
+
+async def _watch_cancel(r: redis.Redis, message_id: str, task: asyncio.Task) -> None:
+    key = _cancel_key(message_id)
+    while not task.done():
+        if await r.exists(key):
+            task.cancel()
+            return
+        await asyncio.sleep(settings.CHAT_CANCEL_POLL_INTERVAL)
+
+
+async def _hold_claim(r: redis.Redis, session_id: uuid.UUID, message_id: str) -> None:
+    """Продлевает занятость сессии, пока генератор жив; после падения процесса она истечёт."""
+    lease = settings.CHAT_ACTIVE_LEASE_SECONDS
+    while True:
+        try:
+            if not await r.eval(_RENEW_LUA, 1, _active_key(session_id), message_id, lease):
+                return  # Сессию уже освободили (generation_lost у читателя)
+        except redis.RedisError as e:
+            logger.warning("Failed to renew chat session claim %s: %s", session_id, e)
+        await asyncio.sleep(lease / 3)
+
+
+async def _generate(r: redis.Redis, clients: UpstreamClients, writer: MessageWriter, job: dict) -> None:
+    session_id = uuid.UUID(job["session_id"])
+    message_id = job["message_id"]
+    out = _ReplyStream(r, message_id)
+    reply = {"text": ""}
+    try:
+        if time.time() - float(job["enqueued_at"]) > settings.CHAT_GENERATION_IDLE_TIMEOUT:
+            # Клиент уже получил generation_lost, отвечать поздно
+            await out.emit(chat_protocol.error("generation_lost", "Ответ не начал генерироваться вовремя"), end=True)
+            return
+        messages = json.loads(job["messages"])
+        holder = asyncio.create_task(_hold_claim(r, session_id, message_id))
+        reply_task = asyncio.create_task(_stream_reply(out, clients.polza, messages, message_id, reply))
+        watcher = asyncio.create_task(_watch_cancel(r, message_id, reply_task))
+        try:
+            await asyncio.wait({reply_task})
+        except asyncio.CancelledError:
+            # Остановка процесса: сохраняем, что успели, и закрываем ответ для читателей
+            reply_task.cancel()
+            await asyncio.gather(reply_task, return_exceptions=True)
+            await asyncio.shield(_finish(r, writer, session_id, message_id, reply, out, chat_protocol.error(
+                "generation_interrupted", "Генерация прервана перезапуском сервера")))
+            raise
+        finally:
+            watcher.cancel()
+            holder.cancel()
+
+        if reply_task.cancelled():
+            end_frame = chat_protocol.message_end(message_id, reply.get("usage", {}), cancelled=True)
+        elif isinstance(reply_task.exception(), httpx.HTTPError):
+            logger.warning("LLM stream failed: %s", reply_task.exception())
+            end_frame = chat_protocol.error("upstream_error", "Ошибка ответа модели")
+        elif reply_task.exception() is not None:
+            logger.error("Chat generation %s failed", message_id, exc_info=reply_task.exception())
+            end_frame = chat_protocol.error("internal_error", "Не удалось сгенерировать ответ")
+        else:
+            end_frame = chat_protocol.message_end(message_id, reply["usage"])
+        await _finish(r, writer, session_id, message_id, reply, out, end_frame)
+    finally:
+        await r.delete(_cancel_key(message_id))
+        await release(r, session_id, message_id)
+
+
+async def _finish(r: redis.Redis, writer: MessageWriter, session_id: uuid.UUID, message_id: str,
+                  reply: dict, out: _ReplyStream, end_frame: str) -> None:
+    # Сначала история и освобождение сессии, потом завершающий кадр:
+    # следующий ход клиента уже видит этот ответ и не получает busy
+    if reply["text"]:
+        ai_row = writer.add(session_id, "ai", reply["text"], uuid.UUID(message_id))
+        await chat_history.append(r, session_id, ai_row)
+    await release(r, session_id, message_id)
+    await out.emit(end_frame, end=True)
+
+
+async def _run_job(r: redis.Redis, clients: UpstreamClients, writer: MessageWriter, job: dict) -> None:
+    with tracing.span("chat.reply", root=True, trace_id=job.get("trace_id"), parent_id=job.get("parent_id"),
+                      message_id=job["message_id"]):
+        try:
+            await _generate(r, clients, writer, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Chat generation %s crashed", job.get("message_id"))
+
+
+async def _ensure_group(r: redis.Redis) -> None:
+    try:
+        await r.xgroup_create(JOBS_STREAM, JOBS_GROUP, id="$", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def run_generators(r: redis.Redis, clients: UpstreamClients, writer: MessageWriter) -> None:
+    """
+    Фоновая задача процесса: забирает задачи из chat:gen, не больше
+    CHAT_GENERATION_CONCURRENCY одновременно. Задачи читаются с NOACK:
+    генерацию, прерванную падением процесса, не повторяем — читатель
+    получит generation_lost по таймауту.
+    """
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    slots = asyncio.Semaphore(settings.CHAT_GENERATION_CONCURRENCY)
+    running: set[asyncio.Task] = set()
+    await _ensure_group(r)
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                response = await r.xreadgroup(JOBS_GROUP, consumer, {JOBS_STREAM: ">"}, count=1,
+                                              block=5000, noack=True)
+            except redis.ResponseError as e:
+                slots.release()
+                if "NOGROUP" not in str(e):
+                    raise
+                await _ensure_group(r)  # Стрим удалили (FLUSHALL) — создаём группу заново
+                continue
+            except redis.ConnectionError as e:
+                slots.release()
+                logger.warning("Chat generator lost Redis connection: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if not response:
+                slots.release()
+                continue
+            for _, job in response[0][1]:
+                task = asyncio.create_task(_run_job(r, clients, writer, job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                task.add_done_callback(lambda _: slots.release())
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
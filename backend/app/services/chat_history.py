@@ -0,0 +1,135 @@
+# app/services/chat_history.py
+"""
+Горячий кэш истории чата и сборка контекста под бюджет токенов.
+
+Для каждой сессии в Redis лежит кольцевой буфер последних
+CHAT_HISTORY_MESSAGES сообщений (chat:hist:<session_id>). Он пополняется
+при записи и заполняется из БД при первом промахе, поэтому ход диалога
+стоит O(окна), а не O(всей истории). Число токенов считается один раз
+при записи сообщения и хранится рядом с текстом.
+"""
+
+import json
+import re
+import uuid
+from datetime import datetime
+from typing import Optional, Sequence
+
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.crud import chat_crud
+from app.db.session import ReadSessionLocal
+from app.services.message_writer import MessageWriter
+
+HISTORY_KEY_PREFIX = "chat:hist:"
+
+# Служебные токены на сообщение в формате chat/completions
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Приближённый подсчёт токенов без загрузки BPE-словаря: слово ~ 1 токен
+    на каждые 4 символа, знак препинания — отдельный токен. Для бюджета
+    контекста точности хватает, а считается за микросекунды.
+    """
+    return sum(1 + len(t) // 4 if t[0].isalnum() or t[0] == "_" else 1 for t in _TOKEN_RE.findall(text))
+
+
+def _key(session_id: uuid.UUID) -> str:
+    return f"{HISTORY_KEY_PREFIX}{session_id}"
+
+
+def _serialize(row: dict) -> str:
+    return json.dumps({
+        "id": str(row["id"]),
+        "role": row["role"],
+        "content": row["content"],
+        "created_at": row["created_at"].isoformat() if row.get("created_at") else None,
+        "tokens": row.get("tokens") or count_tokens(row["content"]),
+    }, ensure_ascii=False)
+
+
+async def append(r: redis.Redis, session_id: uuid.UUID, row: dict) -> None:
+    """
+    Дописывает сообщение в буфер, если он уже прогрет. RPUSHX не создаёт ключ:
+    иначе частичный буфер из одного сообщения выглядел бы как полная история.
+    """
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.rpushx(_key(session_id), _serialize(row))
+        pipe.ltrim(_key(session_id), -settings.CHAT_HISTORY_MESSAGES, -1)
+        pipe.expire(_key(session_id), settings.CHAT_HISTORY_TTL_SECONDS)
+        await pipe.execute()
+
+
+async def _load(r: redis.Redis, session_id: uuid.UUID, writer: MessageWriter) -> list[dict]:
+    # Отставание реплики прикрывают буфер записи (merge_pending) и сам кольцевой буфер
+    async with ReadSessionLocal() as db:
+        messages = await chat_crud.get_recent_messages(db, session_id, settings.CHAT_HISTORY_MESSAGES)
+    rows = [{"id": m.id, "session_id": m.session_id, "role": m.role, "content": m.content,
+             "created_at": m.created_at} for m in messages]
+    # Сообщения, ещё лежащие в буфере записи, тоже часть истории
+    rows = writer.merge_pending(session_id, rows, settings.CHAT_HISTORY_MESSAGES)
+    serialized = [_serialize(row) for row in rows]
+    if serialized:
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.delete(_key(session_id))
+            pipe.rpush(_key(session_id), *serialized)
+            pipe.expire(_key(session_id), settings.CHAT_HISTORY_TTL_SECONDS)
+            await pipe.execute()
+    return [json.loads(s) for s in serialized]
+
+
+async def recent(r: redis.Redis, session_id: uuid.UUID, writer: MessageWriter) -> list[dict]:
+    """Последние сообщения сессии (role, content, tokens) в хронологическом порядке."""
+    cached = await r.lrange(_key(session_id), 0, -1)
+    if cached:
+        return [json.loads(s) for s in cached]
+    return await _load(r, session_id, writer)
+
+
+async def tail(r: redis.Redis, session_id: uuid.UUID) -> list[dict]:
+    """
+    Сообщения из буфера (id, role, content, created_at) без прогрева из БД. Буфер
+    пополняют все процессы, включая генератор ответа, поэтому здесь видны и строки,
+    которые ещё лежат в буфере записи MessageWriter другого процесса.
+    """
+    rows = []
+    for raw in await r.lrange(_key(session_id), 0, -1):
+        message = json.loads(raw)
+        if message["created_at"]:
+            rows.append({"id": uuid.UUID(message["id"]), "role": message["role"], "content": message["content"],
+                         "created_at": datetime.fromisoformat(message["created_at"])})
+    return rows
+
+
+def fit_to_budget(history: list[dict], budget: int) -> list[dict]:
+    """Берёт самые свежие сообщения, пока их суммарные токены укладываются в бюджет."""
+    selected = []
+    for message in reversed(history):
+        budget -= message["tokens"] + MESSAGE_OVERHEAD_TOKENS
+        if budget < 0:
+            break
+        selected.append(message)
+    selected.reverse()
+    return selected
+
+
+def build_context(system_prompt: Optional[str], history: list[dict], user_text: str,
+                  memories: Sequence[dict] = (), summary: Optional[dict] = None) -> list[dict]:
+    """
+    История, обрезанная так, чтобы промпт целиком уложился в CHAT_CONTEXT_TOKEN_BUDGET.
+    memories — вспомненные давние сообщения (chat_memory.recall), summary — сводка
+    давней части разговора (chat_summary.get); их место вычитается из бюджета.
+    """
+    budget = settings.CHAT_CONTEXT_TOKEN_BUDGET - count_tokens(user_text) - MESSAGE_OVERHEAD_TOKENS
+    if system_prompt:
+        budget -= count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+    if summary:
+        budget -= summary["tokens"] + MESSAGE_OVERHEAD_TOKENS
+    if memories:
+        budget -= sum(m["tokens"] + MESSAGE_OVERHEAD_TOKENS for m in memories) + MESSAGE_OVERHEAD_TOKENS
+    return fit_to_budget(history, budget)
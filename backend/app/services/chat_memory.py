@@ -0,0 +1,352 @@
+# app/services/chat_memory.py
+"""
+Долгая память чата: поиск по смыслу среди всех сообщений сессии.
+
+Окно истории (chat_history) помнит только последние CHAT_HISTORY_MESSAGES
+сообщений. Более старые попадают в промпт, только если похожи на новое
+сообщение пользователя: до CHAT_MEMORY_TOP_K сообщений с косинусной
+близостью не ниже CHAT_MEMORY_MIN_SCORE, в пределах CHAT_MEMORY_TOKEN_BUDGET.
+
+Записанные в БД сообщения (MessageWriter) попадают в стрим chat:embed, откуда
+их пачками забирает memory_worker.py: считает эмбеддинги локальной моделью
+fastembed (ONNX на CPU) и дописывает в индекс сессии. Индекс — два файла в
+CHAT_MEMORY_DIR/<модель>/: <session>.f32 — нормированные векторы float32
+подряд (N×dim), <session>.ids — id сообщений по 16 байт. Поиск открывает их
+через memmap и считает близость одним матричным произведением: на 100k
+сообщений это единицы миллисекунд, а векторы держит page cache, общий для
+всех воркеров, а не память процесса.
+
+Пачка подтверждается только после записи в индекс. Упавшую пачку воркер
+повторяет по одному сообщению, чтобы одна плохая запись не держала
+остальные; запись, доставленную _MAX_DELIVERIES раз, перекладывает
+в стрим chat:embed:dead (для разбора вручную) и больше не повторяет.
+
+Модель для запросов грузится в lifespan каждого процесса API: первый ход
+чата не ждёт её загрузки, но каждый воркер uvicorn держит свою копию
+(порядка сотен МБ на процесс) — за отсутствие сетевого вызова на каждом
+ходе платим памятью.
+
+Файлы только дописываются. Векторы пишутся раньше id, а число строк берётся
+по файлу id, поэтому читатель не видит недописанную строку.
+"""
+
+import asyncio
+import fcntl
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.crud import chat_crud
+from app.db.session import ReadSessionLocal
+from app.services.chat_history import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+logger = logging.getLogger(__name__)
+
+EMBED_STREAM = "chat:embed"
+EMBED_GROUP = "embedders"
+DEAD_STREAM = "chat:embed:dead"  # Записи, которые так и не удалось проиндексировать
+STATS_KEY = "memory:stats"
+
+_ID_BYTES = 16
+_STREAM_MAXLEN = 100_000  # Предохранитель, если воркер памяти не запущен
+_CLAIM_IDLE_MS = 60_000  # Пачку упавшего воркера забирает другой через минуту
+_MAX_DELIVERIES = 5  # Столько доставок без подтверждения — запись в DEAD_STREAM
+
+_model = None
+_model_lock = threading.Lock()
+
+
+# --- Индекс сессии ---
+
+def _index_dir() -> Path:
+    # Векторы разных моделей несравнимы: у каждой модели свой каталог
+    return Path(settings.CHAT_MEMORY_DIR) / settings.CHAT_MEMORY_MODEL.replace("/", "__")
+
+
+def _paths(session_id: uuid.UUID) -> tuple[Path, Path]:
+    base = _index_dir() / str(session_id)
+    return base.with_suffix(".f32"), base.with_suffix(".ids")
+
+
+def index_size(session_id: uuid.UUID) -> int:
+    try:
+        return _paths(session_id)[1].stat().st_size // _ID_BYTES
+    except FileNotFoundError:
+        return 0
+
+
+def append(session_id: uuid.UUID, ids: list[uuid.UUID], vectors: np.ndarray) -> None:
+    """Дописывает векторы сообщений в индекс сессии (блокирующий вызов)."""
+    vec_path, ids_path = _paths(session_id)
+    vec_path.parent.mkdir(parents=True, exist_ok=True)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    with open(ids_path, "ab") as ids_file:
+        # Одну сессию могут дописывать несколько воркеров памяти
+        fcntl.flock(ids_file, fcntl.LOCK_EX)
+        try:
+            count = os.fstat(ids_file.fileno()).st_size // _ID_BYTES
+            with open(vec_path, "ab") as vec_file:
+                # Прошлая запись могла оборваться между файлами: отбрасываем векторы без id
+                vec_file.truncate(count * vectors.shape[1] * vectors.itemsize)
+                vec_file.write(vectors.tobytes())
+            ids_file.write(b"".join(message_id.bytes for message_id in ids))
+            ids_file.flush()
+        finally:
+            fcntl.flock(ids_file, fcntl.LOCK_UN)
+
+
+def search(session_id: uuid.UUID, query: np.ndarray, k: int,
+           exclude: set[uuid.UUID]) -> list[tuple[uuid.UUID, float]]:
+    """
+    До k самых близких к query сообщений сессии (id, косинусная близость),
+    не ниже CHAT_MEMORY_MIN_SCORE и не из exclude. Блокирующий вызов.
+    """
+    vec_path, ids_path = _paths(session_id)
+    count = index_size(session_id)
+    if count == 0:
+        return []
+    vectors = np.memmap(vec_path, dtype=np.float32, mode="r", shape=(count, query.shape[0]))
+    scores = vectors @ query  # Векторы нормированы: скалярное произведение и есть косинус
+    # Кандидатов берём с запасом: часть из них может оказаться в окне истории
+    take = min(count, k + len(exclude))
+    top = np.argpartition(scores, count - take)[count - take:] if take < count else np.arange(count)
+    top = top[np.argsort(scores[top])[::-1]]
+
+    ids = np.memmap(ids_path, dtype=np.uint8, mode="r", shape=(count, _ID_BYTES))
+    hits: list[tuple[uuid.UUID, float]] = []
+    for row in top:
+        if scores[row] < settings.CHAT_MEMORY_MIN_SCORE or len(hits) == k:
+            break
+        message_id = uuid.UUID(bytes=ids[row].tobytes())
+        # Повторно доставленная пачка может дописать сообщение дважды
+        if message_id not in exclude and all(message_id != hit[0] for hit in hits):
+            hits.append((message_id, float(scores[row])))
+    return hits
+
+
+# --- Эмбеддинги ---
+
+def _embedder():
+    global _model
+    with _model_lock:
+        if _model is None:
+            # onnxruntime тяжёлый: импортируем и грузим модель при первой надобности
+            from fastembed import TextEmbedding
+            _model = TextEmbedding(settings.CHAT_MEMORY_MODEL, threads=settings.CHAT_MEMORY_THREADS,
+                                   cache_dir=str(Path(settings.CHAT_MEMORY_DIR) / "models"))
+        return _model
+
+
+async def load_model() -> None:
+    """Загружает модель заранее (lifespan); при ошибке recall попробует снова при первом вызове."""
+    try:
+        await asyncio.to_thread(_embedder)
+    except Exception:
+        logger.exception("Failed to load memory model %s", settings.CHAT_MEMORY_MODEL)
+
+
+def embed(texts: list[str]) -> np.ndarray:
+    """Нормированные эмбеддинги текстов, float32 (N×dim). Блокирующий вызов."""
+    vectors = np.asarray(list(_embedder().embed(texts, batch_size=settings.CHAT_MEMORY_BATCH_SIZE)),
+                         dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+# --- Чтение: вспомнить давние сообщения ---
+
+async def recall(r: redis.Redis, session_id: uuid.UUID, text: str, exclude: set[uuid.UUID]) -> list[dict]:
+    """
+    Давние сообщения сессии, близкие к text, в хронологическом порядке и в пределах
+    CHAT_MEMORY_TOKEN_BUDGET. exclude — id сообщений, которые уже есть в окне истории.
+    Память — подсказка: при любой ошибке чат продолжает работать без неё.
+    """
+    # Всё, что есть в индексе, и так в окне истории — модель не нужна
+    if index_size(session_id) <= len(exclude):
+        return []
+    started = time.perf_counter()
+    try:
+        hits = await asyncio.to_thread(
+            lambda: search(session_id, embed([text])[0], settings.CHAT_MEMORY_TOP_K, exclude))
+        if not hits:
+            return []
+        async with ReadSessionLocal() as db:
+            messages = {m.id: m for m in await chat_crud.get_messages_by_ids(db, [hit[0] for hit in hits])}
+    except Exception:
+        logger.exception("Memory recall failed for session %s", session_id)
+        return []
+
+    budget = settings.CHAT_MEMORY_TOKEN_BUDGET
+    recalled = []
+    for message_id, score in hits:  # От самых близких: они первыми получают бюджет
+        message = messages.get(message_id)
+        if message is None:
+            continue
+        tokens = count_tokens(message.content)
+        if tokens + MESSAGE_OVERHEAD_TOKENS > budget:
+            continue
+        budget -= tokens + MESSAGE_OVERHEAD_TOKENS
+        recalled.append({"id": str(message.id), "role": message.role, "content": message.content,
+                         "created_at": message.created_at, "tokens": tokens, "score": score})
+    recalled.sort(key=lambda m: m["created_at"])
+    await _record(r, recalls=1, recalled=len(recalled), recall_ms_total=(time.perf_counter() - started) * 1000)
+    return recalled
+
+
+# --- Запись: очередь и воркер эмбеддингов ---
+
+async def enqueue(r: redis.Redis, rows: list[dict]) -> None:
+    """Ставит записанные в БД сообщения в очередь на индексацию (хук MessageWriter)."""
+    rows = [row for row in rows if len(row["content"]) >= settings.CHAT_MEMORY_MIN_CHARS]
+    if not rows:
+        return
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            for row in rows:
+                pipe.xadd(EMBED_STREAM, {"id": str(row["id"]), "session_id": str(row["session_id"]),
+                                         "content": row["content"]},
+                          maxlen=_STREAM_MAXLEN, approximate=True)
+            await pipe.execute()
+    except redis.RedisError as e:
+        # Сообщения останутся в БД, просто не будут вспоминаться
+        logger.warning("Failed to queue %d messages for memory index: %s", len(rows), e)
+
+
+async def _index_batch(r: redis.Redis, entries: list) -> None:
+    started = time.perf_counter()
+    entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+    if entries:
+        vectors = await asyncio.to_thread(embed, [fields["content"] for _, fields in entries])
+        by_session: dict[str, list[int]] = {}
+        for i, (_, fields) in enumerate(entries):
+            by_session.setdefault(fields["session_id"], []).append(i)
+        for session_id, rows in by_session.items():
+            ids = [uuid.UUID(entries[i][1]["id"]) for i in rows]
+            await asyncio.to_thread(append, uuid.UUID(session_id), ids, vectors[rows])
+        entry_ids = [entry_id for entry_id, _ in entries]
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.xack(EMBED_STREAM, EMBED_GROUP, *entry_ids)
+            pipe.xdel(EMBED_STREAM, *entry_ids)
+            await pipe.execute()
+    await _record(r, batches=1, embedded=len(entries), embed_ms_total=(time.perf_counter() - started) * 1000)
+
+
+async def _ensure_group(r: redis.Redis) -> None:
+    try:
+        await r.xgroup_create(EMBED_STREAM, EMBED_GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _dead_letter(r: redis.Redis, entries: list) -> None:
+    entry_ids = [entry_id for entry_id, _ in entries]
+    async with r.pipeline(transaction=False) as pipe:
+        for entry_id, fields in entries:
+            pipe.xadd(DEAD_STREAM, {**(fields or {}), "entry_id": entry_id}, maxlen=_STREAM_MAXLEN, approximate=True)
+        pipe.xack(EMBED_STREAM, EMBED_GROUP, *entry_ids)
+        pipe.xdel(EMBED_STREAM, *entry_ids)
+        await pipe.execute()
+    logger.error("Gave up indexing %d messages after %d deliveries: %s", len(entries), _MAX_DELIVERIES,
+                 ", ".join(entry_ids))
+    await _record(r, dead_lettered=len(entries))
+
+
+async def _drop_exhausted(r: redis.Redis, entries: list) -> list:
+    """Убирает из повторно доставленной пачки записи, исчерпавшие _MAX_DELIVERIES."""
+    async with r.pipeline(transaction=False) as pipe:
+        for entry_id, _ in entries:
+            pipe.xpending_range(EMBED_STREAM, EMBED_GROUP, min=entry_id, max=entry_id, count=1)
+        pending = await pipe.execute()
+    exhausted = {info[0]["message_id"] for info in pending
+                 if info and info[0]["times_delivered"] >= _MAX_DELIVERIES}
+    if exhausted:
+        await _dead_letter(r, [entry for entry in entries if entry[0] in exhausted])
+    return [entry for entry in entries if entry[0] not in exhausted]
+
+
+async def _index_each(r: redis.Redis, entries: list) -> None:
+    # Пачка упала: пишем по одной, чтобы неудачная запись не держала остальные
+    for entry in entries:
+        try:
+            await _index_batch(r, [entry])
+        except Exception as e:
+            logger.warning("Failed to index message entry %s: %s", entry[0], e)
+
+
+async def run_embedders(r: redis.Redis) -> None:
+    """
+    Главный цикл memory_worker.py. Пачка подтверждается только после записи
+    в индекс; пачку упавшего воркера через _CLAIM_IDLE_MS забирает другой.
+    """
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    await _ensure_group(r)
+    while True:
+        try:
+            _, entries, *_ = await r.xautoclaim(EMBED_STREAM, EMBED_GROUP, consumer, _CLAIM_IDLE_MS,
+                                                count=settings.CHAT_MEMORY_BATCH_SIZE)
+            if entries:
+                entries = await _drop_exhausted(r, entries)
+                if not entries:
+                    continue
+            else:
+                response = await r.xreadgroup(EMBED_GROUP, consumer, {EMBED_STREAM: ">"},
+                                              count=settings.CHAT_MEMORY_BATCH_SIZE, block=5000)
+                entries = response[0][1] if response else []
+        except redis.ResponseError as e:
+            if "NOGROUP" not in str(e):
+                raise
+            await _ensure_group(r)  # Стрим удалили (FLUSHALL) — создаём группу заново
+            continue
+        except redis.ConnectionError as e:
+            logger.warning("Memory worker lost Redis connection: %s", e)
+            await asyncio.sleep(1)
+            continue
+        if not entries:
+            continue
+        try:
+            await _index_batch(r, entries)
+        except Exception:
+            # Неподтверждённое повторим после _CLAIM_IDLE_MS
+            logger.exception("Failed to index %d messages", len(entries))
+            if len(entries) > 1:
+                await _index_each(r, entries)
+            await asyncio.sleep(1)
+
+
+async def _record(r: redis.Redis, **counters: float) -> None:
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            for name, value in counters.items():
+                if isinstance(value, float):
+                    pipe.hincrbyfloat(STATS_KEY, name, value)
+                else:
+                    pipe.hincrby(STATS_KEY, name, value)
+            await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Failed to record memory stats: %s", e)
+
+
+async def stats(r: redis.Redis) -> dict:
+    counters = await r.hgetall(STATS_KEY)
+    batches, embedded = int(counters.get("batches", 0)), int(counters.get("embedded", 0))
+    recalls = int(counters.get("recalls", 0))
+    return {
+        "enabled": settings.CHAT_MEMORY_ENABLED,
+        "model": settings.CHAT_MEMORY_MODEL,
+        "queued": await r.xlen(EMBED_STREAM),  # Проиндексированные записи удаляются из стрима
+        "dead_lettered": int(counters.get("dead_lettered", 0)),
+        "embedded": embedded,
+        "avg_batch_size": embedded / batches if batches else 0.0,
+        "avg_embed_ms": float(counters.get("embed_ms_total", 0)) / batches if batches else 0.0,
+        "recalls": recalls,
+        "avg_recalled": int(counters.get("recalled", 0)) / recalls if recalls else 0.0,
+        "avg_recall_ms": float(counters.get("recall_ms_total", 0)) / recalls if recalls else 0.0,
+    }
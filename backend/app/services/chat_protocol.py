@@ -0,0 +1,105 @@
+# app/services/chat_protocol.py
+"""
+JSON-протокол чата поверх WebSocket.
+
+Сервер -> клиент:
+    {"type": "connected", "session_id": ..., "active_message_id": ...}  # id ответа, который ещё генерируется
+    {"type": "user_message", "message_id": ..., "text": "..."}      # эхо сообщения пользователя
+    {"type": "message_start", "message_id": ..., "role": "ai"}
+    {"type": "delta", "message_id": ..., "seq": 0, "text": "..."}   # только новый фрагмент
+    {"type": "message_end", "message_id": ..., "usage": {...}, "cancelled": false}
+    {"type": "error", "code": ..., "detail": ...}
+    {"type": "ping"}                                                # heartbeat, см. ws_manager
+Клиент -> сервер:
+    {"type": "user_message", "text": "..."}  (или просто текст)
+    {"type": "cancel"}                       # остановить генерацию текущего ответа
+    {"type": "pong"}                         # ответ на ping; без него соединение закроется
+
+Переподключение: если в сессии ещё генерируется ответ, сервер сразу досылает его
+кадры. С ?resume_seq=<seq последней полученной дельты> — только недостающие,
+без параметра — с message_start.
+"""
+
+import asyncio
+import json
+from typing import AsyncIterator, Optional
+
+
+def connected(session_id: str, active_message_id: Optional[str] = None) -> str:
+    return json.dumps({"type": "connected", "session_id": session_id, "active_message_id": active_message_id})
+
+
+def user_message(message_id: str, text: str) -> str:
+    return json.dumps({"type": "user_message", "message_id": message_id, "text": text}, ensure_ascii=False)
+
+
+def message_start(message_id: str, role: str = "ai") -> str:
+    return json.dumps({"type": "message_start", "message_id": message_id, "role": role})
+
+
+def delta(message_id: str, seq: int, text: str) -> str:
+    return json.dumps({"type": "delta", "message_id": message_id, "seq": seq, "text": text},
+                      ensure_ascii=False)
+
+
+def message_end(message_id: str, usage: dict, cancelled: bool = False) -> str:
+    return json.dumps({"type": "message_end", "message_id": message_id, "usage": usage, "cancelled": cancelled})
+
+
+def error(code: str, detail: str) -> str:
+    return json.dumps({"type": "error", "code": code, "detail": detail}, ensure_ascii=False)
+
+
+def parse_client_frame(raw: str) -> Optional[dict]:
+    """Возвращает кадр клиента вида {"type": ..., "text": ...} или None, если он не распознан."""
+    try:
+        frame = json.loads(raw)
+    except ValueError:
+        frame = raw  # Старые клиенты шлют просто текст
+    if isinstance(frame, str):
+        return {"type": "user_message", "text": frame} if frame.strip() else None
+    if not isinstance(frame, dict):
+        return None
+    if frame.get("type") == "user_message" and isinstance(frame.get("text"), str) and frame["text"].strip():
+        return frame
+    if frame.get("type") == "cancel":
+        return frame
+    return None
+
+
+async def coalesce(chunks: AsyncIterator[str], window: float) -> AsyncIterator[str]:
+    """
+    Склеивает фрагменты, пришедшие в пределах `window` секунд от первого
+    фрагмента пачки, чтобы отправлять один кадр вместо десятка мелких.
+    Закрытие coalesce закрывает и chunks (поток модели не висит до сборки мусора);
+    вызывающему стоит закрывать его явно, через contextlib.aclosing.
+    """
+    loop = asyncio.get_running_loop()
+    it = chunks.__aiter__()
+    buffer: list[str] = []
+    deadline = 0.0
+    pending = asyncio.ensure_future(it.__anext__())
+    try:
+        while True:
+            timeout = max(deadline - loop.time(), 0) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield "".join(buffer)
+                buffer.clear()
+                continue
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+            if not buffer:
+                deadline = loop.time() + window
+            buffer.append(chunk)
+            pending = asyncio.ensure_future(it.__anext__())
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        pending.cancel()
+        # aclose() нельзя вызывать, пока __anext__ ещё выполняется
+        await asyncio.gather(pending, return_exceptions=True)
+        if hasattr(it, "aclose"):
+            await it.aclose()
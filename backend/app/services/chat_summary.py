@@ -0,0 +1,269 @@
+# app/services/chat_summary.py
+"""
+Сводка давней части разговора: промпт = сводка + свежее окно истории.
+
+Когда несведённая часть окна истории длиннее CHAT_SUMMARY_TRIGGER_TOKENS
+(или окно заполнено, а сводка до него не доходит), ход чата ставит задачу
+в стрим chat:summarize. Задача одна на сессию: ключ
+chat:summarize:pending:<session> ставится через SET NX и снимается, когда
+задача отработала (или истекает, если процесс упал).
+
+Задачу берёт любой процесс (run_summarizers в lifespan, как генерация
+ответов) и сворачивает в сводку всё, что старше последних
+CHAT_SUMMARY_KEEP_TOKENS истории: старая сводка + следующая пачка сообщений
+→ новая сводка, пачка за пачкой. Сводка хранится в chat_summaries
+(covered_until — created_at последнего сведённого сообщения) и кэшируется
+в Redis, откуда её читает сборка промпта; сообщения до covered_until из
+окна истории в промпт уже не идут.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+import httpx
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.core.http_clients import UpstreamClients
+from app.crud import chat_crud
+from app.db.session import AsyncSessionLocal, ReadSessionLocal
+from app.services import llm_client
+from app.services.chat_history import count_tokens
+
+logger = logging.getLogger(__name__)
+
+JOBS_STREAM = "chat:summarize"
+JOBS_GROUP = "summarizers"
+JOBS_MAXLEN = 10_000
+SUMMARY_KEY_PREFIX = "chat:summary:"  # Кэш сводки; "{}" — сводки пока нет
+PENDING_KEY_PREFIX = "chat:summarize:pending:"
+STATS_KEY = "chat:summary:stats"
+
+_PENDING_TTL_SECONDS = 10 * 60  # Задачу упавшего процесса можно поставить заново
+_CHUNK_MESSAGES = 200
+
+_SPEAKERS = {"user": "Пользователь", "ai": "Персонаж"}
+_INSTRUCTIONS = (
+    "Ты ведёшь краткое содержание переписки пользователя с персонажем. Дополни его новыми "
+    "сообщениями: сохрани факты о пользователе, имена, договорённости, планы и важные события, "
+    "опусти приветствия и пустую болтовню. Пиши кратко, в третьем лице, без вступлений. "
+    "Верни только обновлённое содержание целиком."
+)
+
+
+def _summary_key(session_id: uuid.UUID) -> str:
+    return f"{SUMMARY_KEY_PREFIX}{session_id}"
+
+
+def _pending_key(session_id: uuid.UUID) -> str:
+    return f"{PENDING_KEY_PREFIX}{session_id}"
+
+
+# --- Сборка промпта ---
+
+async def _cache(r: redis.Redis, session_id: uuid.UUID, summary: dict) -> None:
+    await r.set(_summary_key(session_id), json.dumps(summary, ensure_ascii=False),
+                ex=settings.CHAT_HISTORY_TTL_SECONDS)
+
+
+async def get(r: redis.Redis, session_id: uuid.UUID) -> Optional[dict]:
+    """Сводка сессии {content, tokens, covered_until} или None; из Redis, при промахе — из БД."""
+    cached = await r.get(_summary_key(session_id))
+    if cached is None:
+        async with ReadSessionLocal() as db:
+            row = await chat_crud.get_summary(db, session_id)
+        summary = {"content": row.content, "tokens": row.tokens,
+                   "covered_until": row.covered_until.isoformat()} if row else {}
+        await _cache(r, session_id, summary)
+    else:
+        summary = json.loads(cached)
+    return summary or None
+
+
+def unsummarized(history: list[dict], summary: Optional[dict]) -> list[dict]:
+    """Сообщения окна истории, которых ещё нет в сводке."""
+    if summary is None:
+        return history
+    covered_until = datetime.fromisoformat(summary["covered_until"])
+    return [m for m in history if not m["created_at"] or datetime.fromisoformat(m["created_at"]) > covered_until]
+
+
+async def schedule_if_needed(r: redis.Redis, session_id: uuid.UUID, history: list[dict],
+                             fresh: list[dict]) -> None:
+    """
+    Ставит задачу сводки, если несведённая история длинная или окно заполнено
+    и сводка до него не доходит (старые сообщения выпадали бы из промпта бесследно).
+    history — всё окно истории, fresh — его несведённая часть.
+    """
+    needed = sum(m["tokens"] for m in fresh) > settings.CHAT_SUMMARY_TRIGGER_TOKENS or (
+        len(history) >= settings.CHAT_HISTORY_MESSAGES and len(fresh) == len(history))
+    if not needed:
+        return
+    try:
+        if await r.set(_pending_key(session_id), "1", nx=True, ex=_PENDING_TTL_SECONDS):
+            await r.xadd(JOBS_STREAM, {"session_id": str(session_id)}, maxlen=JOBS_MAXLEN, approximate=True)
+    except redis.RedisError as e:
+        # Не страшно: следующий ход попробует снова
+        logger.warning("Failed to schedule summary for session %s: %s", session_id, e)
+
+
+# --- Фоновая задача ---
+
+async def _fold(client: httpx.AsyncClient, summary: str, messages: list) -> str:
+    lines = "\n".join(f"{_SPEAKERS.get(m.role, m.role)}: {m.content}" for m in messages)
+    return await llm_client.complete(client, [
+        {"role": "system", "content": _INSTRUCTIONS},
+        {"role": "user", "content": f"Текущее содержание:\n{summary or '(пусто)'}\n\nНовые сообщения:\n{lines}"},
+    ], settings.CHAT_SUMMARY_MAX_TOKENS)
+
+
+def _fit_chunk(messages: list) -> list:
+    """Сколько сообщений пачки влезает в CHAT_SUMMARY_CHUNK_TOKENS (хотя бы одно)."""
+    budget = settings.CHAT_SUMMARY_CHUNK_TOKENS
+    for i, message in enumerate(messages):
+        budget -= count_tokens(message.content)
+        if budget < 0:
+            return messages[:max(i, 1)]
+    return messages
+
+
+async def _summarize(r: redis.Redis, clients: UpstreamClients, session_id: uuid.UUID) -> None:
+    # Основная БД, а не реплика: сводку могли продвинуть только что. Сессии БД
+    # короткие — соединение не держится, пока модель пишет сводку
+    async with AsyncSessionLocal() as db:
+        row = await chat_crud.get_summary(db, session_id)
+        recent = await chat_crud.get_recent_messages(db, session_id, settings.CHAT_HISTORY_MESSAGES)
+    if not recent:
+        return
+    # Свежий хвост (не меньше одного сообщения) остаётся дословным, сводится всё старше него
+    kept, kept_tokens = 0, 0
+    for message in reversed(recent):
+        kept_tokens += count_tokens(message.content)
+        if kept and kept_tokens > settings.CHAT_SUMMARY_KEEP_TOKENS:
+            break
+        kept += 1
+    if kept == len(recent) and len(recent) < settings.CHAT_HISTORY_MESSAGES:
+        return  # Вся история и так дословно в окне
+    keep_from = recent[-kept].created_at
+
+    content = row.content if row else ""
+    covered_until = row.covered_until if row else None
+    covered = row.messages_covered if row else 0
+    chunks = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            messages = await chat_crud.get_messages_between(db, session_id, covered_until, keep_from,
+                                                            _CHUNK_MESSAGES)
+        if not messages:
+            break
+        messages = _fit_chunk(messages)
+        started = time.perf_counter()
+        content = await _fold(clients.polza, content, messages)
+        await _record(r, chunks=1, messages=len(messages), llm_ms_total=(time.perf_counter() - started) * 1000)
+        covered_until, covered, chunks = messages[-1].created_at, covered + len(messages), chunks + 1
+        # Сохраняем после каждой пачки: длинную историю не придётся сводить заново после сбоя
+        async with AsyncSessionLocal() as db:
+            await chat_crud.save_summary(db, session_id, content, count_tokens(content), covered_until, covered)
+        await _cache(r, session_id, {"content": content, "tokens": count_tokens(content),
+                                     "covered_until": covered_until.isoformat()})
+    if chunks:
+        logger.info("Summarized %d chunks of session %s (%d messages covered)", chunks, session_id, covered)
+
+
+async def _run_job(r: redis.Redis, clients: UpstreamClients, session_id: uuid.UUID) -> None:
+    try:
+        await _summarize(r, clients, session_id)
+        await _record(r, jobs=1)
+    except asyncio.CancelledError:
+        raise
+    except httpx.HTTPError as e:
+        logger.warning("Summary of session %s failed: %s", session_id, e)
+        await _record(r, failures=1)
+    except Exception:
+        logger.exception("Summary of session %s crashed", session_id)
+        await _record(r, failures=1)
+    finally:
+        await asyncio.shield(r.delete(_pending_key(session_id)))
+
+
+async def _ensure_group(r: redis.Redis) -> None:
+    try:
+        # С начала стрима: задачи, поставленные до первого запуска, тоже нужны
+        await r.xgroup_create(JOBS_STREAM, JOBS_GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def run_summarizers(r: redis.Redis, clients: UpstreamClients) -> None:
+    """
+    Фоновая задача процесса: забирает задачи из chat:summarize, не больше
+    CHAT_SUMMARY_CONCURRENCY одновременно. Читаем с NOACK, как и генерацию:
+    задача, потерянная с процессом, поставится снова после истечения ключа.
+    """
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    slots = asyncio.Semaphore(settings.CHAT_SUMMARY_CONCURRENCY)
+    running: set[asyncio.Task] = set()
+    await _ensure_group(r)
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                response = await r.xreadgroup(JOBS_GROUP, consumer, {JOBS_STREAM: ">"}, count=1,
+                                              block=5000, noack=True)
+            except redis.ResponseError as e:
+                slots.release()
+                if "NOGROUP" not in str(e):
+                    raise
+                await _ensure_group(r)
+                continue
+            except redis.ConnectionError as e:
+                slots.release()
+                logger.warning("Chat summarizer lost Redis connection: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if not response:
+                slots.release()
+                continue
+            for _, job in response[0][1]:
+                task = asyncio.create_task(_run_job(r, clients, uuid.UUID(job["session_id"])))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                task.add_done_callback(lambda _: slots.release())
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+async def _record(r: redis.Redis, **counters: float) -> None:
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            for name, value in counters.items():
+                if isinstance(value, float):
+                    pipe.hincrbyfloat(STATS_KEY, name, value)
+                else:
+                    pipe.hincrby(STATS_KEY, name, value)
+            await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Failed to record summary stats: %s", e)
+
+
+async def stats(r: redis.Redis) -> dict:
+    counters = await r.hgetall(STATS_KEY)
+    chunks = int(counters.get("chunks", 0))
+    return {
+        "enabled": settings.CHAT_SUMMARY_ENABLED,
+        "jobs": int(counters.get("jobs", 0)),
+        "failures": int(counters.get("failures", 0)),
+        "chunks": chunks,
+        "messages_summarized": int(counters.get("messages", 0)),
+        "avg_llm_ms": float(counters.get("llm_ms_total", 0)) / chunks if chunks else 0.0,
+    }
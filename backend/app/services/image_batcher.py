@@ -0,0 +1,188 @@
+# app/services/image_batcher.py
+"""
+Микробатчинг txt2img: совместимые задачи уходят в A1111 одним запросом с batch_size=N.
+
+A1111 рисует батч одним промптом, а seed-ы картинок батча идут подряд
+(seed, seed+1, ...). Поэтому совместимыми считаются задачи, у которых
+совпадают все параметры, кроме seed (prompt, negative, размер, steps,
+чекпоинт), и объединяются только задачи со случайным seed: задача с явным
+seed должна давать ровно свою картинку, она идёт в A1111 отдельно.
+
+Первая задача группы ждёт попутчиков до IMAGE_BATCH_WINDOW_MS (или пока
+группа не наберёт IMAGE_BATCH_MAX_SIZE), затем ждёт свободный слот GPU —
+пока слот занят, группа продолжает пополняться. Одновременно в A1111 идёт
+не больше запросов, чем слотов во всём пуле SD-бэкендов, как и без батчинга.
+Размеры батчей и добавленная ожиданием задержка копятся в imgbatch:stats.
+
+Прогресс батча рассылается всем его задачам. Отменённая задача просто
+теряет свою картинку; запрос к A1111 прерывается, только когда отменены
+все задачи батча.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.core.sd_pool import SDPool
+from app.services import sd_api
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = "imgbatch:stats"
+
+RANDOM_SEED = -1
+
+# Поля, которые не мешают объединить задачи в батч
+_NON_BATCH_FIELDS = {"seed", "use_cache"}
+
+
+@dataclass
+class _Pending:
+    request: dict
+    future: asyncio.Future
+    on_progress: Optional[sd_api.ProgressCallback] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+def is_batchable(request: dict) -> bool:
+    return request.get("seed", RANDOM_SEED) == RANDOM_SEED
+
+
+def group_key(request: dict) -> str:
+    return json.dumps({k: v for k, v in request.items() if k not in _NON_BATCH_FIELDS}, sort_keys=True)
+
+
+class Txt2ImgBatcher:
+    def __init__(self, client: SDPool, r: redis.Redis):
+        self._client = client
+        self._r = r
+        self._slots = asyncio.Semaphore(client.capacity)
+        self._groups: dict[str, list[_Pending]] = {}
+        self._full: dict[str, asyncio.Event] = {}
+        self._drivers: set[asyncio.Task] = set()
+
+    async def txt2img(self, request: dict, on_progress: Optional[sd_api.ProgressCallback] = None) -> dict:
+        """То же, что sd_api.txt2img для одной картинки, но через общий батч."""
+        if not is_batchable(request):
+            started = time.monotonic()
+            async with self._slots:
+                waited = time.monotonic() - started
+                data = await sd_api.txt2img(self._client, request, on_progress)
+            await self._record([waited])
+            return data
+
+        key = group_key(request)
+        pending = _Pending(request, asyncio.get_running_loop().create_future(), on_progress)
+        group = self._groups.setdefault(key, [])
+        group.append(pending)
+        if len(group) == 1:
+            # Первая задача группы запускает её «водителя»; он один на группу
+            self._full[key] = asyncio.Event()
+            self._spawn(self._drive(key))
+        elif len(group) >= settings.IMAGE_BATCH_MAX_SIZE:
+            self._full[key].set()
+        return await pending.future
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._drivers.add(task)
+        task.add_done_callback(self._drivers.discard)
+
+    async def _drive(self, key: str) -> None:
+        group = self._groups[key]
+        remaining = group[0].enqueued_at + settings.IMAGE_BATCH_WINDOW_MS / 1000 - time.monotonic()
+        if remaining > 0 and len(group) < settings.IMAGE_BATCH_MAX_SIZE:
+            try:
+                await asyncio.wait_for(self._full[key].wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        async with self._slots:
+            batch = [p for p in group[:settings.IMAGE_BATCH_MAX_SIZE] if not p.future.done()]
+            del group[:settings.IMAGE_BATCH_MAX_SIZE]
+            if group:
+                # Остаток уже дождался окна — следующий водитель сразу встанет за слотом
+                self._full[key] = asyncio.Event()
+                self._spawn(self._drive(key))
+            else:
+                del self._groups[key], self._full[key]
+            if batch:
+                await self._run(batch)
+
+    async def _run(self, batch: list[_Pending]) -> None:
+        now = time.monotonic()
+        request = {**batch[0].request, "batch_size": len(batch)}
+
+        async def fan_out(progress: dict) -> None:
+            await asyncio.gather(*(p.on_progress(progress) for p in batch
+                                   if p.on_progress is not None and not p.future.done()))
+
+        call = asyncio.create_task(sd_api.txt2img(self._client, request, fan_out))
+
+        def abandon(_) -> None:
+            if not call.done() and all(p.future.done() for p in batch):
+                call.cancel()
+
+        for pending in batch:
+            pending.future.add_done_callback(abandon)
+        try:
+            data = await call
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+            return  # Все задачи батча отменены, генерация в A1111 прервана
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+        images = data.get("images", [])
+        # С batch_size > 1 A1111 может вернуть первой картинкой сетку всего батча
+        images = images[-len(batch):] if len(images) > len(batch) else images
+        for i, pending in enumerate(batch):
+            if pending.future.done():
+                continue  # Задачу отменили, пока шёл запрос: её картинка пропадает
+            if i < len(images):
+                pending.future.set_result({**data, "images": [images[i]]})
+            else:
+                pending.future.set_exception(
+                    RuntimeError(f"A1111 returned {len(images)} images for a batch of {len(batch)}"))
+        await self._record([now - pending.enqueued_at for pending in batch])
+
+    async def _record(self, delays: list[float]) -> None:
+        try:
+            async with self._r.pipeline(transaction=False) as pipe:
+                pipe.hincrby(STATS_KEY, "batches", 1)
+                pipe.hincrby(STATS_KEY, "images", len(delays))
+                pipe.hincrby(STATS_KEY, f"size:{len(delays)}", 1)
+                pipe.hincrbyfloat(STATS_KEY, "delay_ms_total", sum(delays) * 1000)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Failed to record batch stats: %s", e)
+
+    async def aclose(self) -> None:
+        for task in self._drivers:
+            task.cancel()
+        await asyncio.gather(*self._drivers, return_exceptions=True)
+        for group in self._groups.values():
+            for pending in group:
+                pending.future.cancel()
+
+
+async def stats(r: redis.Redis) -> dict:
+    counters = await r.hgetall(STATS_KEY)
+    batches, images = int(counters.get("batches", 0)), int(counters.get("images", 0))
+    sizes = {int(k.split(":", 1)[1]): int(v) for k, v in counters.items() if k.startswith("size:")}
+    return {
+        "batches": batches,
+        "images": images,
+        "avg_batch_size": images / batches if batches else 0.0,
+        "batch_sizes": dict(sorted(sizes.items())),
+        # Сколько в среднем задача ждала батча и слота GPU сверх обычной очереди
+        "avg_added_delay_ms": float(counters.get("delay_ms_total", 0)) / images if images else 0.0,
+    }
@@ -0,0 +1,75 @@
+# app/services/image_cache.py
+"""
+Кэш результатов txt2img.
+
+Ключ — sha256 канонического JSON всего запроса (prompt, negative, steps,
+размер, seed) вместе с чекпоинтом модели. Значение — результат задачи
+(digest-ы файлов в ImageStore), сами изображения лежат в хранилище.
+Размер ограничен IMAGE_CACHE_MAX_ENTRIES с вытеснением по LRU, каждая
+запись дополнительно живёт не дольше IMAGE_CACHE_TTL_SECONDS. Место на диске
+ограничивает сборщик ImageStore (IMAGE_STORE_MAX_BYTES); запись, чьи файлы
+он уже удалил, считается промахом.
+"""
+
+import hashlib
+import json
+import time
+from typing import Optional
+
+import redis.asyncio as redis
+
+from app.core.config import settings
+
+ENTRY_KEY_PREFIX = "imgcache:entry:"
+LRU_KEY = "imgcache:lru"  # zset: ключ -> время последнего обращения
+STATS_KEY = "imgcache:stats"
+
+RANDOM_SEED = -1
+
+# Поля запроса, которые не влияют на картинку
+_NON_RENDER_FIELDS = {"use_cache"}
+
+
+def is_cacheable(request: dict) -> bool:
+    """С явным seed результат детерминирован; случайный seed кэшируется только по явному согласию."""
+    return request.get("seed", RANDOM_SEED) != RANDOM_SEED or bool(request.get("use_cache"))
+
+
+def cache_key(request: dict, checkpoint: str) -> str:
+    canonical = {k: v for k, v in request.items() if k not in _NON_RENDER_FIELDS}
+    canonical["checkpoint"] = checkpoint
+    raw = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def get(r: redis.Redis, key: str) -> Optional[dict]:
+    value = await r.get(f"{ENTRY_KEY_PREFIX}{key}")
+    if value is None:
+        await r.hincrby(STATS_KEY, "misses", 1)
+        await r.zrem(LRU_KEY, key)  # Запись могла истечь по TTL
+        return None
+    await r.hincrby(STATS_KEY, "hits", 1)
+    await r.zadd(LRU_KEY, {key: time.time()})
+    return json.loads(value)
+
+
+async def put(r: redis.Redis, key: str, result: dict) -> None:
+    await r.set(f"{ENTRY_KEY_PREFIX}{key}", json.dumps(result), ex=settings.IMAGE_CACHE_TTL_SECONDS)
+    await r.zadd(LRU_KEY, {key: time.time()})
+    overflow = await r.zcard(LRU_KEY) - settings.IMAGE_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        evicted = await r.zpopmin(LRU_KEY, overflow)
+        await r.delete(*(f"{ENTRY_KEY_PREFIX}{k}" for k, _ in evicted))
+        await r.hincrby(STATS_KEY, "evictions", len(evicted))
+
+
+async def stats(r: redis.Redis) -> dict:
+    counters = {k: int(v) for k, v in (await r.hgetall(STATS_KEY)).items()}
+    hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "evictions": counters.get("evictions", 0),
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        "entries": await r.zcard(LRU_KEY),
+    }
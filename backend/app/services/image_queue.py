@@ -0,0 +1,378 @@
+# app/services/image_queue.py
+"""
+Очередь задач генерации изображений в Redis.
+
+API только ставит задачу и сразу отдаёт её id, а отдельный пул воркеров
+(см. worker.py) разбирает очередь с реальной параллельностью GPU.
+
+Справедливость: у каждого пользователя своя FIFO-очередь, а воркеры обходят
+пользователей по кругу (кольцо imgq:users), поэтому один пользователь
+со стопкой задач не блокирует остальных.
+
+Надёжность: вместе с задачей воркер атомарно берёт её в аренду (imgq:leases,
+срок IMAGE_JOB_LEASE_SECONDS) и продлевает аренду, пока работает. Если воркер
+упал или его убил OOM, аренда истекает, и сборщик (он есть в каждом процессе
+воркеров) возвращает задачу в начало очереди пользователя, а после
+IMAGE_JOB_MAX_ATTEMPTS попыток помечает её ошибкой — клиенты, опрашивающие
+задачу, не ждут вечно.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+import redis.asyncio as redis
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+USERS_RING_KEY = "imgq:users"  # Кольцо пользователей, у которых есть ожидающие задачи
+DEPTH_KEY = "imgq:depth"  # Общее число задач в очереди
+USER_QUEUE_PREFIX = "imgq:user:"
+JOB_KEY_PREFIX = "imgq:job:"
+EVENTS_CHANNEL_PREFIX = "imgq:events:"
+CANCEL_KEY_PREFIX = "imgq:cancel:"  # Флаг отмены выполняющейся задачи, его проверяет воркер
+PREVIEW_KEY_PREFIX = "imgq:preview:"  # Последний промежуточный кадр (WebP в base64)
+LEASES_KEY = "imgq:leases"  # Выполняющиеся задачи: id -> срок аренды (мс по часам Redis)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+STATUS_CANCELLED = "cancelled"
+FINAL_STATUSES = (STATUS_DONE, STATUS_ERROR, STATUS_CANCELLED)
+
+# Скрипты выполняются атомарно, поэтому глубина очереди и кольцо пользователей
+# не рассинхронизируются при параллельных вызовах из нескольких процессов.
+# Ключи очередей пользователей собираются внутри скрипта: это допустимо
+# для одиночного Redis (не Redis Cluster), который и используется в compose.
+_ENQUEUE_LUA = """
+local depth = tonumber(redis.call('GET', KEYS[1]) or '0')
+if depth >= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('INCR', KEYS[1])
+local len = redis.call('RPUSH', ARGV[2] .. ARGV[3], ARGV[4])
+if len == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[3])
+end
+return depth + 1
+"""
+
+# Время аренды берётся по часам Redis: у воркеров на разных узлах часы могут расходиться
+_DEQUEUE_LUA = """
+local user = redis.call('LPOP', KEYS[2])
+if not user then
+    return false
+end
+local user_key = ARGV[1] .. user
+local job = redis.call('LPOP', user_key)
+if redis.call('LLEN', user_key) > 0 then
+    redis.call('RPUSH', KEYS[2], user)
+end
+if job then
+    redis.call('DECR', KEYS[1])
+    local now = redis.call('TIME')
+    redis.call('ZADD', KEYS[3], now[1] * 1000 + math.floor(now[2] / 1000) + tonumber(ARGV[2]), job)
+end
+return job
+"""
+
+# Продлевает аренду, если её ещё не забрал сборщик
+_RENEW_LEASE_LUA = """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return 0
+end
+local now = redis.call('TIME')
+redis.call('ZADD', KEYS[1], now[1] * 1000 + math.floor(now[2] / 1000) + tonumber(ARGV[2]), ARGV[1])
+return 1
+"""
+
+# Сборщик просроченных аренд: задача возвращается в начало очереди пользователя,
+# а после ARGV[5] попыток (или если её отменили) завершается. Возвращает пары
+# id, новый статус — для оповещения подписчиков.
+_REAP_LUA = """
+local now = redis.call('TIME')
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now[1] * 1000 + math.floor(now[2] / 1000))
+local reaped = {}
+for _, job_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[3], job_id)
+    local job_key = ARGV[2] .. job_id
+    local status = redis.call('HGET', job_key, 'status')
+    if status == 'queued' or status == 'running' then
+        local attempts = redis.call('HINCRBY', job_key, 'attempts', 1)
+        if redis.call('EXISTS', ARGV[3] .. job_id) == 1 then
+            redis.call('HSET', job_key, 'status', 'cancelled', 'finished_at', ARGV[6])
+            status = 'cancelled'
+        elseif attempts >= tonumber(ARGV[5]) then
+            redis.call('HSET', job_key, 'status', 'error', 'error', ARGV[4], 'finished_at', ARGV[6])
+            status = 'error'
+        else
+            local user = redis.call('HGET', job_key, 'user_id')
+            redis.call('HSET', job_key, 'status', 'queued')
+            redis.call('HDEL', job_key, 'started_at', 'worker', 'progress', 'eta_seconds', 'preview_seq')
+            redis.call('INCR', KEYS[1])
+            if redis.call('LPUSH', ARGV[1] .. user, job_id) == 1 then
+                redis.call('RPUSH', KEYS[2], user)
+            end
+            status = 'queued'
+        end
+        table.insert(reaped, job_id)
+        table.insert(reaped, status)
+    end
+end
+return reaped
+"""
+
+# Снимает задачу из очереди пользователя, если воркер её ещё не забрал
+_CANCEL_QUEUED_LUA = """
+local user_key = ARGV[1] .. ARGV[2]
+local removed = redis.call('LREM', user_key, 1, ARGV[3])
+if removed > 0 then
+    redis.call('DECR', KEYS[1])
+    if redis.call('LLEN', user_key) == 0 then
+        redis.call('LREM', KEYS[2], 0, ARGV[2])
+    end
+end
+return removed
+"""
+
+
+class QueueFullError(Exception):
+    """Очередь достигла IMAGE_QUEUE_MAX_DEPTH."""
+
+
+def _job_key(job_id: str) -> str:
+    return f"{JOB_KEY_PREFIX}{job_id}"
+
+
+def _cancel_key(job_id: str) -> str:
+    return f"{CANCEL_KEY_PREFIX}{job_id}"
+
+
+def _preview_key(job_id: str) -> str:
+    return f"{PREVIEW_KEY_PREFIX}{job_id}"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _new_job(user_id: uuid.UUID, payload: dict, **fields) -> dict:
+    return {
+        "id": uuid.uuid4().hex,
+        "user_id": str(user_id),
+        "status": STATUS_QUEUED,
+        "payload": json.dumps(payload),
+        "created_at": _now(),
+        **fields,
+    }
+
+
+async def submit_job(r: redis.Redis, user_id: uuid.UUID, payload: dict, cache_key: Optional[str] = None) -> dict:
+    """
+    Создаёт задачу и ставит её в очередь пользователя. Бросает QueueFullError.
+    Если передан cache_key, воркер положит результат в кэш под этим ключом.
+    """
+    job = _new_job(user_id, payload, **({"cache_key": cache_key} if cache_key else {}))
+    job_id = job["id"]
+    await r.hset(_job_key(job_id), mapping=job)
+    await r.expire(_job_key(job_id), settings.IMAGE_JOB_TTL_SECONDS)
+
+    position = await r.eval(
+        _ENQUEUE_LUA, 2, DEPTH_KEY, USERS_RING_KEY,
+        settings.IMAGE_QUEUE_MAX_DEPTH, USER_QUEUE_PREFIX, str(user_id), job_id,
+    )
+    if int(position) < 0:
+        await r.delete(_job_key(job_id))
+        raise QueueFullError()
+    return job
+
+
+async def complete_from_cache(r: redis.Redis, user_id: uuid.UUID, payload: dict, result: dict) -> dict:
+    """Создаёт сразу завершённую задачу с результатом из кэша, минуя очередь и GPU."""
+    now = _now()
+    job = _new_job(user_id, payload, status=STATUS_DONE, result=json.dumps(result),
+                   started_at=now, finished_at=now, cached="1")
+    await r.hset(_job_key(job["id"]), mapping=job)
+    await r.expire(_job_key(job["id"]), settings.IMAGE_JOB_TTL_SECONDS)
+    return job
+
+
+async def get_job(r: redis.Redis, job_id: str) -> Optional[dict]:
+    job = await r.hgetall(_job_key(job_id))
+    return job or None
+
+
+async def queue_depth(r: redis.Redis) -> int:
+    return int(await r.get(DEPTH_KEY) or 0)
+
+
+async def _publish(r: redis.Redis, job_id: str, fields: dict) -> None:
+    event = {k: v for k, v in fields.items() if k != "result"}
+    event["id"] = job_id
+    await r.publish(f"{EVENTS_CHANNEL_PREFIX}{job_id}", json.dumps(event))
+
+
+async def _update_job(r: redis.Redis, job_id: str, **fields) -> None:
+    """Обновляет поля задачи и оповещает подписчиков через pub/sub."""
+    await r.hset(_job_key(job_id), mapping=fields)
+    await _publish(r, job_id, fields)
+
+
+async def cancel_job(r: redis.Redis, job: dict) -> dict:
+    """
+    Отменяет задачу. Ожидающая в очереди снимается сразу; выполняющуюся отменит
+    воркер при ближайшей проверке флага (и прервёт генерацию в A1111).
+    """
+    if job["status"] in FINAL_STATUSES:
+        return job
+    removed = await r.eval(_CANCEL_QUEUED_LUA, 2, DEPTH_KEY, USERS_RING_KEY, USER_QUEUE_PREFIX, job["user_id"], job["id"])
+    if int(removed):
+        fields = {"status": STATUS_CANCELLED, "finished_at": _now()}
+    else:
+        await r.set(_cancel_key(job["id"]), "1", ex=settings.IMAGE_JOB_TTL_SECONDS)
+        fields = {"cancel_requested": "1"}
+    await _update_job(r, job["id"], **fields)
+    return {**job, **fields}
+
+
+async def report_progress(r: redis.Redis, job_id: str, progress: dict) -> None:
+    """Пишет прогресс в задачу и рассылает его подписчикам; кадр превью — отдельным ключом."""
+    fields = {"progress": f"{progress['progress']:.3f}"}
+    if progress.get("eta_seconds") is not None:
+        fields["eta_seconds"] = f"{progress['eta_seconds']:.1f}"
+    if progress.get("preview") is not None:
+        await r.set(_preview_key(job_id), base64.b64encode(progress["preview"]).decode(),
+                    ex=settings.IMAGE_PREVIEW_TTL_SECONDS)
+        fields["preview_seq"] = str(progress["preview_seq"])
+    await _update_job(r, job_id, **fields)
+
+
+async def get_preview(r: redis.Redis, job_id: str) -> Optional[bytes]:
+    encoded = await r.get(_preview_key(job_id))
+    return base64.b64decode(encoded) if encoded else None
+
+
+async def _watch_cancel(r: redis.Redis, job_id: str, task: asyncio.Task) -> bool:
+    while not task.done():
+        if await r.exists(_cancel_key(job_id)):
+            task.cancel()
+            return True
+        await asyncio.sleep(settings.IMAGE_PROGRESS_INTERVAL)
+    return False
+
+
+def _lease_ms() -> int:
+    return settings.IMAGE_JOB_LEASE_SECONDS * 1000
+
+
+async def _dequeue(r: redis.Redis) -> Optional[str]:
+    return await r.eval(_DEQUEUE_LUA, 3, DEPTH_KEY, USERS_RING_KEY, LEASES_KEY, USER_QUEUE_PREFIX, _lease_ms())
+
+
+async def _hold_lease(r: redis.Redis, job_id: str) -> None:
+    """Продлевает аренду задачи, пока воркер её выполняет."""
+    while True:
+        await asyncio.sleep(settings.IMAGE_JOB_LEASE_SECONDS / 3)
+        try:
+            if not await r.eval(_RENEW_LEASE_LUA, 1, LEASES_KEY, job_id, _lease_ms()):
+                # Процесс не успевал продлевать аренду, и задачу уже вернули в очередь
+                logger.warning("Image job %s lease expired while running", job_id)
+                return
+        except redis.RedisError as e:
+            logger.warning("Failed to renew lease of image job %s: %s", job_id, e)
+
+
+async def reap_expired(r: redis.Redis) -> int:
+    """Разбирает задачи с истёкшей арендой (воркер упал); возвращает их число."""
+    reaped = await r.eval(
+        _REAP_LUA, 3, DEPTH_KEY, USERS_RING_KEY, LEASES_KEY,
+        USER_QUEUE_PREFIX, JOB_KEY_PREFIX, CANCEL_KEY_PREFIX, "Worker lost",
+        settings.IMAGE_JOB_MAX_ATTEMPTS, _now(),
+    )
+    for job_id, status in zip(reaped[::2], reaped[1::2]):
+        logger.warning("Image job %s lost its worker, now %s", job_id, status)
+        fields = {"status": status}
+        if status in FINAL_STATUSES:
+            fields["finished_at"] = _now()
+        await _publish(r, job_id, fields)
+    return len(reaped) // 2
+
+
+async def _reaper_loop(r: redis.Redis) -> None:
+    while True:
+        await asyncio.sleep(settings.IMAGE_JOB_LEASE_SECONDS / 3)
+        try:
+            await reap_expired(r)
+        except redis.RedisError as e:
+            logger.warning("Image job reaper failed: %s", e)
+
+
+# Обработчик получает задачу целиком (payload уже разобран) и возвращает результат
+JobHandler = Callable[[dict], Awaitable[dict]]
+
+
+async def _process(r: redis.Redis, handler: JobHandler, worker: str, job_id: str) -> None:
+    job = await get_job(r, job_id)
+    if job is None:
+        # Задача истекла, пока ждала в очереди
+        return
+
+    if await r.exists(_cancel_key(job_id)):
+        # Отменили между тем, как задачу забрали из очереди, и этой проверкой
+        await _update_job(r, job_id, status=STATUS_CANCELLED, finished_at=_now())
+        return
+
+    await _update_job(r, job_id, status=STATUS_RUNNING, started_at=_now(), worker=worker)
+    job["payload"] = json.loads(job["payload"])
+    handler_task = asyncio.create_task(handler(job))
+    watcher = asyncio.create_task(_watch_cancel(r, job_id, handler_task))
+    holder = asyncio.create_task(_hold_lease(r, job_id))
+    try:
+        result = await handler_task
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            await _update_job(r, job_id, status=STATUS_ERROR, error="Worker stopped", finished_at=_now())
+            raise
+        # Задачу отменил пользователь (_watch_cancel), воркер продолжает работу
+        await _update_job(r, job_id, status=STATUS_CANCELLED, finished_at=_now())
+    except Exception as e:
+        logger.exception("Image job %s failed in worker %s", job_id, worker)
+        await _update_job(r, job_id, status=STATUS_ERROR, error=str(e), finished_at=_now())
+    else:
+        await _update_job(r, job_id, status=STATUS_DONE, result=json.dumps(result), finished_at=_now())
+    finally:
+        watcher.cancel()
+        holder.cancel()
+    await r.expire(_job_key(job_id), settings.IMAGE_JOB_TTL_SECONDS)
+
+
+async def _worker_loop(r: redis.Redis, handler: JobHandler, worker: str) -> None:
+    while True:
+        job_id = await _dequeue(r)
+        if job_id is None:
+            await asyncio.sleep(settings.IMAGE_QUEUE_POLL_INTERVAL)
+            continue
+        try:
+            await _process(r, handler, worker, job_id)
+        finally:
+            # Статус задачи уже итоговый; если процесс упадёт до ZREM, сборщик просто снимет аренду
+            await r.zrem(LEASES_KEY, job_id)
+
+
+async def run_workers(r: redis.Redis, handler: JobHandler, concurrency: int) -> None:
+    """
+    Запускает `concurrency` воркеров, разбирающих очередь, и сборщик просроченных
+    аренд, и ждёт их завершения.
+    """
+    process = f"{socket.gethostname()}-{os.getpid()}"
+    workers = (_worker_loop(r, handler, f"{process}-{n}") for n in range(concurrency))
+    await asyncio.gather(_reaper_loop(r), *workers)
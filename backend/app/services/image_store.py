@@ -0,0 +1,174 @@
+# app/services/image_store.py
+"""
+Контентно-адресуемое хранилище сгенерированных изображений на диске.
+
+Файл называется sha256 своего содержимого и лежит в шардированном каталоге
+<root>/ab/cd/<digest>.png, поэтому одинаковые картинки хранятся один раз,
+а URL вида /api/v1/image/files/<digest> можно кэшировать в браузере навсегда.
+
+На изображения ссылаются только задачи (IMAGE_JOB_TTL_SECONDS) и кэш
+результатов (IMAGE_CACHE_TTL_SECONDS), оба в Redis. mtime оригинала — время
+последней ссылки: повторное сохранение и попадание в кэш его обновляют.
+Сборщик в worker.py раз в IMAGE_STORE_SWEEP_INTERVAL удаляет изображения,
+на которые уже ничего не может ссылаться, и, если хранилище больше
+IMAGE_STORE_MAX_BYTES, самые давно использованные — но не моложе
+IMAGE_JOB_TTL_SECONDS, на них ещё могут ссылаться задачи.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from app.core.config import settings
+
+# Вариант -> суффикс файла
+VARIANTS = {
+    "original": ".png",
+    "webp": ".webp",
+    "thumb": ".thumb.webp",
+}
+MEDIA_TYPES = {
+    "original": "image/png",
+    "webp": "image/webp",
+    "thumb": "image/webp",
+}
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+logger = logging.getLogger(__name__)
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _render_variants(src: str, webp_dst: str, thumb_dst: str, quality: int, thumb_size: int) -> None:
+    """Перекодирует PNG в WebP и делает превью. Выполняется в отдельном процессе."""
+    from PIL import Image
+
+    with Image.open(src) as img:
+        img.save(webp_dst + ".tmp", format="WEBP", quality=quality, method=4)
+        os.replace(webp_dst + ".tmp", webp_dst)
+        img.thumbnail((thumb_size, thumb_size))
+        img.save(thumb_dst + ".tmp", format="WEBP", quality=quality, method=4)
+        os.replace(thumb_dst + ".tmp", thumb_dst)
+
+
+def _touch(paths: list[Path]) -> bool:
+    """Обновляет mtime файлов; False, если какого-то уже нет."""
+    try:
+        for path in paths:
+            os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _sweep(root: Path, max_bytes: int, max_age: float, min_age: float) -> tuple[int, int]:
+    """
+    Удаляет изображения старше max_age, затем самые старые, пока всё хранилище
+    больше max_bytes, не трогая моложе min_age. Возвращает (удалено, байт осталось).
+    """
+    images: dict[str, list] = {}  # digest -> [mtime оригинала, байт всех вариантов, файлы]
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            digest = name.split(".", 1)[0]
+            if not DIGEST_RE.match(digest):
+                continue
+            path = Path(dirpath) / name
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            image = images.setdefault(digest, [0.0, 0, []])
+            if name == f"{digest}{VARIANTS['original']}":
+                image[0] = stat.st_mtime
+            image[1] += stat.st_size
+            image[2].append(path)
+
+    now = time.time()
+    total = sum(size for _, size, _ in images.values())
+    removed = 0
+    # Варианты без оригинала (mtime 0) идут первыми
+    for digest, (mtime, size, paths) in sorted(images.items(), key=lambda item: item[1][0]):
+        if now - mtime < min_age or (now - mtime < max_age and total <= max_bytes):
+            break
+        original = root / digest[:2] / digest[2:4] / f"{digest}{VARIANTS['original']}"
+        try:
+            if original.stat().st_mtime != mtime:
+                continue  # Картинку только что сохранили снова или отдали из кэша
+        except FileNotFoundError:
+            pass
+        for path in paths:
+            path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed, total
+
+
+class ImageStore:
+    def __init__(self, root: str, executor: Optional[ProcessPoolExecutor] = None):
+        self.root = Path(root)
+        # Пул процессов нужен только там, где изображения пишутся (worker.py)
+        self.executor = executor
+
+    def path(self, digest: str, variant: str = "original") -> Path:
+        return self.root / digest[:2] / digest[2:4] / f"{digest}{VARIANTS[variant]}"
+
+    async def save(self, data: bytes) -> str:
+        """Сохраняет PNG (если его ещё нет) и возвращает digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not await asyncio.to_thread(_touch, [path]):
+            await asyncio.to_thread(_write_atomic, path, data)
+        if self.executor is not None and not self.path(digest, "thumb").exists():
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, _render_variants, str(path),
+                str(self.path(digest, "webp")), str(self.path(digest, "thumb")),
+                settings.IMAGE_WEBP_QUALITY, settings.IMAGE_THUMB_SIZE,
+            )
+        return digest
+
+    def available_variants(self, digest: str) -> list[str]:
+        return [v for v in VARIANTS if self.path(digest, v).exists()]
+
+    async def touch(self, digests: list[str]) -> bool:
+        """Отмечает изображения использованными; False, если какое-то уже удалено сборщиком."""
+        return await asyncio.to_thread(_touch, [self.path(digest) for digest in digests])
+
+    async def run_sweeper(self) -> None:
+        """Фоновая задача worker.py: держит хранилище в пределах IMAGE_STORE_MAX_BYTES."""
+        max_age = max(settings.IMAGE_JOB_TTL_SECONDS, settings.IMAGE_CACHE_TTL_SECONDS)
+        while True:
+            try:
+                removed, total = await asyncio.to_thread(
+                    _sweep, self.root, settings.IMAGE_STORE_MAX_BYTES, max_age, settings.IMAGE_JOB_TTL_SECONDS)
+            except OSError as e:
+                logger.warning("Image store sweep failed: %s", e)
+            else:
+                if removed:
+                    logger.info("Image store sweep removed %d images, %d bytes left", removed, total)
+                if total > settings.IMAGE_STORE_MAX_BYTES:
+                    logger.warning("Image store holds %d bytes over IMAGE_STORE_MAX_BYTES in images "
+                                   "younger than IMAGE_JOB_TTL_SECONDS", total - settings.IMAGE_STORE_MAX_BYTES)
+            await asyncio.sleep(settings.IMAGE_STORE_SWEEP_INTERVAL)
+
+
+def get_image_store() -> ImageStore:
+    """Зависимость FastAPI: только чтение, без пула процессов."""
+    return ImageStore(settings.IMAGE_STORE_DIR)
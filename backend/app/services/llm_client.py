@@ -0,0 +1,90 @@
+# app/services/llm_client.py
+"""
+Потоковый клиент к polza.ai (OpenAI-совместимый /chat/completions со stream=true).
+
+Ответ читается как Server-Sent Events по общему пулу соединений
+(UpstreamClients.polza). Если потребитель перестаёт итерировать генератор
+или отменяет задачу, контекст client.stream() закрывается и соединение
+с апстримом рвётся сразу — недочитанные токены больше не оплачиваются.
+"""
+
+import json
+from typing import AsyncIterator, Iterable, Optional
+
+import httpx
+
+from app.core.config import settings
+
+# Роли в таблице messages -> роли OpenAI API
+_ROLE_MAP = {"user": "user", "ai": "assistant", "system": "system"}
+
+
+# Подписи ролей во вспомненных сообщениях
+_MEMORY_SPEAKERS = {"user": "Пользователь", "ai": "Ты"}
+
+
+def build_messages(system_prompt: Optional[str], history: Iterable[dict], user_text: str,
+                   memories: Iterable[dict] = (), summary: Optional[str] = None) -> list[dict]:
+    """
+    Собирает промпт: личность персонажа, сводка давней части разговора и вспомненные
+    давние сообщения (отдельными system-сообщениями), история сессии (role/content)
+    и новое сообщение.
+    """
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    if summary:
+        messages.append({"role": "system", "content": f"Краткое содержание более раннего разговора:\n{summary}"})
+    recalled = [f"{_MEMORY_SPEAKERS.get(m['role'], m['role'])}: {m['content']}" for m in memories]
+    if recalled:
+        messages.append({"role": "system",
+                         "content": "Из более ранних сообщений этого разговора:\n" + "\n".join(recalled)})
+    for message in history:
+        messages.append({"role": _ROLE_MAP.get(message["role"], "user"), "content": message["content"]})
+    messages.append({"role": "user", "content": user_text})
+    return messages
+
+
+async def stream_chat(
+        client: httpx.AsyncClient,
+        messages: list[dict],
+        usage: Optional[dict] = None,
+) -> AsyncIterator[str]:
+    """
+    Отдаёт фрагменты текста ответа по мере их прихода.
+    Если передан `usage`, в него записывается статистика токенов из последнего кадра.
+    """
+    body = {
+        "model": settings.POLZA_MODEL,
+        "messages": messages,
+        "max_tokens": settings.CHAT_MAX_TOKENS,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+    async with client.stream("POST", "/chat/completions", json=body) as response:
+        if response.is_error:
+            await response.aread()
+            response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue  # Пустые строки-разделители, комментарии ": keep-alive"
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            if "error" in event:
+                raise httpx.HTTPStatusError(str(event["error"]), request=response.request, response=response)
+            if usage is not None and event.get("usage"):
+                usage.update(event["usage"])
+            for choice in event.get("choices", []):
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    yield content
+
+
+async def complete(client: httpx.AsyncClient, messages: list[dict], max_tokens: int) -> str:
+    """Ответ модели целиком, без стриминга — для фоновых задач вроде сводки истории."""
+    body = {"model": settings.POLZA_MODEL, "messages": messages, "max_tokens": max_tokens}
+    response = await client.post("/chat/completions", json=body)
+    response.raise_for_status()
+    return response.json()["choices"][0]["message"]["content"].strip()
@@ -0,0 +1,135 @@
+# app/services/message_writer.py
+"""
+Отложенная (write-behind) запись сообщений чата.
+
+Горячий цикл WebSocket только кладёт строку в буфер, а запись в БД идёт
+одним bulk INSERT для всех соединений процесса — когда буфер набрал
+CHAT_WRITE_BATCH_SIZE строк или прошло CHAT_WRITE_FLUSH_INTERVAL секунд.
+Буфер гарантированно сбрасывается при отключении клиента и остановке
+приложения. Пока строки не записаны, их видно через pending_for().
+Записанные строки передаются хуку on_flushed (индексация долгой памяти).
+
+Если пачка не записалась из-за самих данных (сессию удалили — нарушен FK,
+дубль id), она пишется по одной строке, а такие строки логируются
+и выбрасываются: повтор их не исправит, а остальные сообщения процесса
+ждали бы за ними. Остальные ошибки (БД недоступна) — повод повторить всю
+пачку при следующем сбросе.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from starlette.requests import HTTPConnection
+
+from app.core.config import settings
+from app.models import Message
+
+logger = logging.getLogger(__name__)
+
+_PERMANENT_ERRORS = (IntegrityError, DataError)  # Ошибки в данных строки: повтор не поможет
+
+
+class MessageWriter:
+    def __init__(self, session_factory: async_sessionmaker,
+                 on_flushed: Optional[Callable[[list[dict]], Awaitable[None]]] = None):
+        self._session_factory = session_factory
+        self._on_flushed = on_flushed
+        self._buffer: list[dict] = []
+        self._inflight: list[dict] = []  # Уже забраны на запись, но ещё не закоммичены
+        self._flush_lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._size_flush: Optional[asyncio.Task] = None
+
+    def add(self, session_id: uuid.UUID, role: str, content: str, message_id: Optional[uuid.UUID] = None) -> dict:
+        """
+        Ставит сообщение в очередь на запись и сразу возвращает строку.
+        id и created_at генерируются здесь, чтобы порядок не зависел от момента вставки.
+        """
+        row = {
+            "id": message_id or uuid.uuid4(),
+            "session_id": session_id,
+            "role": role,
+            "content": content,
+            "created_at": datetime.now(timezone.utc),
+        }
+        self._buffer.append(row)
+        if len(self._buffer) >= settings.CHAT_WRITE_BATCH_SIZE and (
+                self._size_flush is None or self._size_flush.done()):
+            self._size_flush = asyncio.create_task(self.flush())
+        return row
+
+    def pending_for(self, session_id: uuid.UUID) -> list[dict]:
+        """Незаписанные сообщения сессии (read-your-writes для чтения истории)."""
+        return [row for row in self._inflight + self._buffer if row["session_id"] == session_id]
+
+    def merge_pending(self, session_id: uuid.UUID, rows: list[dict], limit: Optional[int] = None) -> list[dict]:
+        """Добавляет к строкам из БД незаписанные, без дублей, в хронологическом порядке."""
+        seen = {row["id"] for row in rows}
+        merged = rows + [row for row in self.pending_for(session_id) if row["id"] not in seen]
+        merged.sort(key=lambda row: row["created_at"])
+        return merged[-limit:] if limit else merged
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            self._inflight, self._buffer = self._buffer, []
+            try:
+                try:
+                    async with self._session_factory() as db:
+                        await db.execute(insert(Message), self._inflight)
+                        await db.commit()
+                except _PERMANENT_ERRORS as e:
+                    logger.warning("Chat message batch rejected (%s), writing rows one by one", type(e).__name__)
+                    self._inflight = await self._insert_each(self._inflight)
+            except Exception:
+                logger.exception("Failed to flush %d chat messages, will retry", len(self._inflight))
+                self._buffer[:0] = self._inflight
+                overflow = len(self._buffer) - settings.CHAT_WRITE_MAX_BUFFER
+                if overflow > 0:
+                    logger.error("Chat write buffer overflow, dropping %d oldest messages", overflow)
+                    del self._buffer[:overflow]
+            else:
+                if self._on_flushed is not None:
+                    await self._on_flushed(self._inflight)
+            finally:
+                self._inflight = []
+
+    async def _insert_each(self, rows: list[dict]) -> list[dict]:
+        """Пишет строки по одной (SAVEPOINT на строку), выбрасывая непригодные; возвращает записанные."""
+        written = []
+        async with self._session_factory() as db:
+            for row in rows:
+                try:
+                    async with db.begin_nested():
+                        await db.execute(insert(Message), [row])
+                except _PERMANENT_ERRORS as e:
+                    logger.error("Dropping chat message %s of session %s: %s", row["id"], row["session_id"], e.orig)
+                else:
+                    written.append(row)
+            await db.commit()
+        return written
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(settings.CHAT_WRITE_FLUSH_INTERVAL)
+            await self.flush()
+
+    def start(self) -> None:
+        self._timer = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+        await self.flush()
+
+
+def get_message_writer(conn: HTTPConnection) -> MessageWriter:
+    return conn.app.state.message_writer
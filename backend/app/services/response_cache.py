@@ -0,0 +1,118 @@
+# app/services/response_cache.py
+"""
+Read-through кэш JSON-ответов пользовательских эндпоинтов с ETag.
+
+Ответ хранится в Redis уже сериализованным вместе со своим ETag (хеш тела).
+Ключ включает «версию» данных пользователя (rcache:ver:<user_id>): любая
+запись меняет версию через invalidate_user(), и старые ответы просто перестают
+находиться, а потом истекают по TTL. Версия — случайный токен, а не счётчик,
+поэтому её потеря (eviction в Redis) не вернёт устаревшие записи.
+
+Клиент с If-None-Match, совпадающим с текущим ETag, получает 304: без запроса
+в Postgres и без повторной сериализации. Попадания считаются по маршрутам.
+"""
+
+import hashlib
+import uuid
+from typing import Any, Awaitable, Callable
+
+import redis.asyncio as redis
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+from app.core.config import settings
+
+VERSION_KEY_PREFIX = "rcache:ver:"
+ENTRY_KEY_PREFIX = "rcache:entry:"
+STATS_KEY = "rcache:stats"
+
+
+async def _version(r: redis.Redis, user_id: uuid.UUID) -> str:
+    key = f"{VERSION_KEY_PREFIX}{user_id}"
+    version = await r.get(key)
+    if version is None:
+        # NX: два одновременных промаха должны прийти к одной версии
+        await r.set(key, uuid.uuid4().hex, nx=True, ex=settings.RESPONSE_CACHE_TTL_SECONDS * 2)
+        version = await r.get(key)
+    return version
+
+
+async def invalidate_user(r: redis.Redis, user_id: uuid.UUID) -> None:
+    """Вызывать после commit любой записи, меняющей данные пользователя (профиль, персонажи)."""
+    await r.set(f"{VERSION_KEY_PREFIX}{user_id}", uuid.uuid4().hex, ex=settings.RESPONSE_CACHE_TTL_SECONDS * 2)
+
+
+def _serialize(response_model: Any, value: Any) -> str:
+    adapter = TypeAdapter(response_model)
+    return adapter.dump_json(adapter.validate_python(value, from_attributes=True)).decode()
+
+
+def _etag(body: str) -> str:
+    return f'W/"{hashlib.sha1(body.encode()).hexdigest()}"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """
+    Совпадает ли If-None-Match с etag: список через запятую, "*" или слабое
+    сравнение (RFC 9110, 13.1.2) — префикс W/ с обеих сторон не учитывается.
+    """
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in (t.strip().removeprefix("W/") for t in header.split(","))
+
+
+def _response(body: str, etag: str) -> Response:
+    # private: ответ персональный; no-cache: браузер хранит, но каждый раз перепроверяет ETag
+    return Response(content=body, media_type="application/json",
+                    headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+
+async def cached_json(request: Request, r: redis.Redis, route: str, user_id: uuid.UUID, variant: str,
+                      response_model: Any, loader: Callable[[], Awaitable[Any]]) -> Response:
+    """
+    Ответ маршрута `route` для пользователя: из Redis или через loader().
+    `variant` различает ответы одного маршрута (параметры запроса, id объекта).
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        body = _serialize(response_model, await loader())
+        etag = _etag(body)
+        return Response(status_code=304, headers={"ETag": etag}) if not_modified(request, etag) \
+            else _response(body, etag)
+
+    key = f"{ENTRY_KEY_PREFIX}{route}:{user_id}:{await _version(r, user_id)}:{variant}"
+    etag = await r.hget(key, "etag")
+    if etag is not None:
+        if not_modified(request, etag):
+            await r.hincrby(STATS_KEY, f"{route}:not_modified", 1)
+            return Response(status_code=304, headers={"ETag": etag})
+        body = await r.hget(key, "body")
+        if body is not None:
+            await r.hincrby(STATS_KEY, f"{route}:hits", 1)
+            return _response(body, etag)
+
+    await r.hincrby(STATS_KEY, f"{route}:misses", 1)
+    body = _serialize(response_model, await loader())
+    etag = _etag(body)
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={"etag": etag, "body": body})
+        pipe.expire(key, settings.RESPONSE_CACHE_TTL_SECONDS)
+        await pipe.execute()
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return _response(body, etag)
+
+
+async def stats(r: redis.Redis) -> dict:
+    """{маршрут: {hits, not_modified, misses, hit_rate}} — 304 тоже считается попаданием."""
+    routes: dict[str, dict] = {}
+    for field, value in (await r.hgetall(STATS_KEY)).items():
+        route, counter = field.rsplit(":", 1)
+        routes.setdefault(route, {"hits": 0, "not_modified": 0, "misses": 0})[counter] = int(value)
+    for counters in routes.values():
+        served = counters["hits"] + counters["not_modified"]
+        total = served + counters["misses"]
+        counters["hit_rate"] = round(served / total, 3) if total else 0.0
+    return routes
@@ -0,0 +1,122 @@
+# app/services/sd_api.py
+
+import asyncio
+import base64
+import io
+import logging
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from PIL import Image
+
+from app.core.config import settings
+from app.core.sd_pool import Backend, SDPool
+
+logger = logging.getLogger(__name__)
+
+# Получает {"progress", "eta_seconds", "step", "steps", "preview", "preview_seq"}; preview — WebP или None
+ProgressCallback = Callable[[dict], Awaitable[None]]
+
+def to_a1111_payload(request: dict) -> dict:
+    """Превращает Txt2ImgRequest в тело запроса A1111, убирая служебные поля."""
+    payload = {k: v for k, v in request.items() if k not in ("checkpoint", "use_cache")}
+    if request.get("checkpoint"):
+        payload["override_settings"] = {"sd_model_checkpoint": request["checkpoint"]}
+    return payload
+
+
+def _shrink_preview(encoded: str) -> bytes:
+    """Кадр live preview из A1111 (PNG в base64) → уменьшенный WebP."""
+    with Image.open(io.BytesIO(base64.b64decode(encoded))) as image:
+        image = image.convert("RGB")
+        image.thumbnail((settings.IMAGE_PREVIEW_SIZE, settings.IMAGE_PREVIEW_SIZE))
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", quality=70)
+    return buffer.getvalue()
+
+
+async def _poll_progress(backend: Backend, on_progress: ProgressCallback) -> None:
+    """
+    Опрашивает /sdapi/v1/progress бэкенда, пока идёт запрос. A1111 знает только
+    о текущей задаче сервера, поэтому на бэкенде должен идти один запрос за раз
+    (IMAGE_WORKER_CONCURRENCY=1), иначе прогресс будет чужим.
+    """
+    last_image, preview_seq = None, 0
+    while True:
+        await asyncio.sleep(settings.IMAGE_PROGRESS_INTERVAL)
+        try:
+            r = await backend.client.get(
+                "/sdapi/v1/progress",
+                params={"skip_current_image": not settings.IMAGE_PREVIEWS_ENABLED},
+                timeout=settings.SD_HEALTH_TIMEOUT,
+            )
+            r.raise_for_status()
+            data = r.json()
+        except httpx.HTTPError as e:
+            logger.debug("SD progress poll failed on %s: %s", backend.url, e)
+            continue
+        state = data.get("state") or {}
+        preview = None
+        if data.get("current_image") and data["current_image"] != last_image:
+            last_image = data["current_image"]
+            try:
+                preview = await asyncio.to_thread(_shrink_preview, last_image)
+                preview_seq += 1
+            except (OSError, ValueError) as e:
+                logger.debug("Bad SD preview from %s: %s", backend.url, e)
+        await on_progress({
+            "progress": float(data.get("progress") or 0.0),
+            "eta_seconds": data.get("eta_relative"),
+            "step": state.get("sampling_step"),
+            "steps": state.get("sampling_steps"),
+            "preview": preview,
+            "preview_seq": preview_seq,
+        })
+
+
+async def _interrupt(backend: Backend) -> None:
+    try:
+        await backend.client.post("/sdapi/v1/interrupt", timeout=settings.SD_HEALTH_TIMEOUT)
+    except httpx.HTTPError as e:
+        logger.warning("Failed to interrupt SD backend %s: %s", backend.url, e)
+
+
+async def txt2img(client: SDPool, request: dict, on_progress: Optional[ProgressCallback] = None) -> dict:
+    """
+    Отправляет задачу в Automatic1111 (txt2img API) и возвращает его JSON-ответ.
+    `client` — общий пул UpstreamClients.sd: он сам выбирает сервер и повторяет запрос при сбое.
+    С on_progress, пока идёт запрос, раз в IMAGE_PROGRESS_INTERVAL сообщает прогресс.
+    Отмена корутины прерывает генерацию на сервере (/sdapi/v1/interrupt), а не
+    только рвёт соединение: иначе A1111 дорисовал бы ненужную картинку.
+    """
+    backend: Optional[Backend] = None
+    poller: Optional[asyncio.Task] = None
+
+    def started(chosen: Backend) -> None:
+        nonlocal backend, poller
+        backend = chosen
+        if poller is not None:
+            poller.cancel()  # Повтор на другом бэкенде
+        if on_progress is not None:
+            poller = asyncio.create_task(_poll_progress(chosen, on_progress))
+
+    try:
+        r = await client.post("/sdapi/v1/txt2img", json=to_a1111_payload(request), on_backend=started)
+    except asyncio.CancelledError:
+        # interrupt останавливает всё, что рисует сервер, — только если других наших запросов на нём нет
+        if backend is not None and backend.inflight == 0:
+            await asyncio.shield(_interrupt(backend))
+        raise
+    finally:
+        if poller is not None:
+            poller.cancel()
+    r.raise_for_status()
+    return r.json()
+
+
+def current_checkpoint(client: SDPool) -> Optional[str]:
+    """
+    Имя загруженного в A1111 чекпоинта по последней пробе здоровья пула
+    (обновляется каждые SD_HEALTH_INTERVAL). None, если ни одна проба ещё не прошла.
+    """
+    return client.checkpoint
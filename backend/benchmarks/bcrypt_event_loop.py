@@ -0,0 +1,95 @@
+# Насколько bcrypt в обработчике логина тормозит остальные соединения.
+#
+# Моделирует один воркер uvicorn: «чат» шлёт кадр каждые FRAME_MS и меряет,
+# на сколько каждый кадр опоздал, пока параллельно идёт всплеск логинов.
+# Сравниваются два режима: bcrypt прямо в корутине (security.verify_password,
+# как было) и security.verify_and_update_password — тот же пул PasswordHasher,
+# что и в API. Результат — JSON в stdout:
+#   python -m benchmarks.bcrypt_event_loop --logins 32 --rounds 12 --workers 2
+# Лимит очереди — PASSWORD_HASH_MAX_QUEUE из окружения, отказы видны в "rejected".
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+FRAME_MS = 20
+PASSWORD = "password"
+
+
+def _percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def _chat(stop: asyncio.Event, lateness: list[float]) -> None:
+    interval = FRAME_MS / 1000
+    expected = time.perf_counter() + interval
+    while not stop.is_set():
+        await asyncio.sleep(max(0.0, expected - time.perf_counter()))
+        lateness.append((time.perf_counter() - expected) * 1000)
+        expected += interval
+
+
+async def _run(security, mode: str, logins: int, hashed: str) -> dict:
+    login_ms: list[float] = []
+    rejected = 0
+
+    async def login() -> None:
+        nonlocal rejected
+        started = time.perf_counter()
+        if mode == "blocking":
+            security.verify_password(PASSWORD, hashed)
+        else:
+            try:
+                await security.verify_and_update_password(PASSWORD, hashed)
+            except security.PasswordHasherBusy:
+                rejected += 1
+                return
+        login_ms.append((time.perf_counter() - started) * 1000)
+
+    stop = asyncio.Event()
+    lateness: list[float] = []
+    chat = asyncio.create_task(_chat(stop, lateness))
+    await asyncio.sleep(0.2)  # Прогрев: несколько кадров без нагрузки
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    total = time.perf_counter() - started
+    stop.set()
+    await chat
+    return {
+        "mode": mode,
+        "logins_per_s": round(len(login_ms) / total, 2),
+        "rejected": rejected,
+        "login_p50_ms": round(statistics.median(login_ms), 1) if login_ms else 0.0,
+        "login_p95_ms": round(_percentile(login_ms, 0.95), 1),
+        "frames": len(lateness),
+        "frame_late_p50_ms": round(statistics.median(lateness), 1),
+        "frame_late_p99_ms": round(_percentile(lateness, 0.99), 1),
+        "frame_late_max_ms": round(max(lateness), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="bcrypt vs event loop lag")
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    # Настройки читаются при импорте: задаём их до него, чтобы мерить ровно тот пул, что работает в API
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+    from app.core import security
+
+    hashed = security.get_password_hash(PASSWORD)
+    results = [asyncio.run(_run(security, mode, args.logins, hashed)) for mode in ("blocking", "offloaded")]
+    print(json.dumps({"rounds": args.rounds, "logins": args.logins, "workers": args.workers,
+                      "hasher": security.password_hasher.stats(), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Проверка, что горячие запросы идут по индексам из миграций.
+#
+# Для каждого запроса снимается EXPLAIN (FORMAT JSON) и ищется Index Scan
+# (Index Only / Bitmap Index) по ожидаемому индексу. На пустой или маленькой
+# таблице планировщик честно выберет Seq Scan, поэтому он отключается на время
+# проверки (SET LOCAL enable_seqscan = off): так проверяется, что индекс
+# подходит под форму запроса, а не что он выгоден на текущих данных.
+#   alembic upgrade head && python -m benchmarks.explain_queries
+# Код выхода 1, если хотя бы один запрос обошёлся без своего индекса.
+import asyncio
+import json
+import sys
+import uuid
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.core.config import settings
+from app.models import Character, ChatSession, Message
+
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+
+def _queries() -> dict:
+    some_id = uuid.uuid4()
+    return {
+        "messages_recent": (
+            select(Message.id, Message.role, Message.content, Message.created_at)
+            .where(Message.session_id == some_id)
+            .order_by(Message.created_at.desc(), Message.id.desc()).limit(51),
+            "ix_messages_session_id_created_at",
+        ),
+        "chat_sessions_of_user": (
+            select(ChatSession).where(ChatSession.user_id == some_id)
+            .order_by(ChatSession.created_at.desc(), ChatSession.id.desc()).limit(21),
+            "ix_chat_sessions_user_id_created_at",
+        ),
+        "characters_of_owner": (
+            select(Character).where(Character.owner_id == some_id)
+            .order_by(Character.created_at.desc(), Character.id.desc()).limit(21),
+            "ix_characters_owner_id_created_at",
+        ),
+    }
+
+
+def _index_nodes(plan: dict):
+    if plan.get("Node Type") in INDEX_NODES:
+        yield plan["Node Type"], plan.get("Index Name")
+    for child in plan.get("Plans", ()):
+        yield from _index_nodes(child)
+
+
+async def main() -> int:
+    engine = create_async_engine(settings.DATABASE_URL)
+    report, failed = {}, False
+    async with engine.connect() as conn:
+        for name, (query, index) in _queries().items():
+            sql = str(query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+            async with conn.begin():
+                await conn.execute(text("SET LOCAL enable_seqscan = off"))
+                raw = (await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar()
+            plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+            nodes = list(_index_nodes(plan))
+            ok = any(index_name == index for _, index_name in nodes)
+            failed |= not ok
+            report[name] = {"expected_index": index, "ok": ok, "index_nodes": nodes,
+                            "top_node": plan["Node Type"]}
+    await engine.dispose()
+    print(json.dumps(report, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
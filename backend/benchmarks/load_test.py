@@ -0,0 +1,344 @@
+# Нагрузочный тест бэкенда: логин, генерация изображений и стриминг чата.
+#
+# С --spawn поднимает всё сам: заглушки polza.ai и A1111 (stubs/), миграции,
+# uvicorn с приложением и воркер генерации. Нужны только Postgres и Redis —
+# например `docker compose up -d postgres redis` и DATABASE_URL/REDIS_URL в окружении:
+#   python -m benchmarks.load_test --spawn --concurrency 20 --out results/$(git rev-parse --short HEAD).json
+# Против уже запущенного стека (тогда память процесса не меряется):
+#   python -m benchmarks.load_test --base-url http://localhost:8000
+# Сравнить с прошлым прогоном (изменение p50/p95/p99, throughput, TTFT и памяти в %):
+#   python -m benchmarks.load_test --spawn --compare results/baseline.json
+#
+# Задержки заглушек задаются их переменными окружения (LLM_STUB_FIRST_TOKEN_MS,
+# LLM_STUB_TOKEN_MS, SD_STUB_LATENCY_MS, SD_STUB_NOISE...), они передаются как есть.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional
+
+import httpx
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+BACKEND_PORT = 8100
+LLM_STUB_PORT = 9100
+SD_STUB_PORT = 9200
+PASSWORD = "bench-password"
+
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    values = sorted(values)
+
+    def pick(p: float) -> float:
+        return round(values[min(len(values) - 1, int(len(values) * p))], 1)
+
+    return {"p50_ms": round(statistics.median(values), 1), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "max_ms": round(values[-1], 1)}
+
+
+def _rss_kb(pid: Optional[int]) -> Optional[dict]:
+    """Текущая и пиковая RSS процесса из /proc (только Linux)."""
+    if pid is None:
+        return None
+    try:
+        fields = dict(line.split(":", 1) for line in Path(f"/proc/{pid}/status").read_text().splitlines())
+    except OSError:
+        return None
+    return {"rss_kb": int(fields["VmRSS"].split()[0]), "peak_rss_kb": int(fields["VmHWM"].split()[0])}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.extra: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self, wall: float) -> dict:
+        result = {
+            "completed": len(self.latencies),
+            "errors": self.errors,
+            "throughput_per_s": round(len(self.latencies) / wall, 2) if wall else None,
+            "wall_s": round(wall, 2),
+            **_percentiles(self.latencies),
+        }
+        for name, values in self.extra.items():
+            result[name] = _percentiles(values)
+        return result
+
+
+async def _run_concurrently(concurrency: int, total: int, fn) -> float:
+    """Запускает fn(i) total раз, не больше concurrency одновременно. Возвращает время прогона."""
+    counter = iter(range(total))
+
+    async def worker(slot: int):
+        for i in counter:
+            await fn(slot, i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(slot) for slot in range(concurrency)))
+    return time.perf_counter() - started
+
+
+# --- Сценарии ---
+
+async def scenario_auth(client: httpx.AsyncClient, users: list[dict], concurrency: int, total: int) -> dict:
+    rec = Recorder()
+
+    async def login(slot: int, i: int):
+        user = users[i % len(users)]
+        started = time.perf_counter()
+        response = await client.post("/api/v1/auth/token", data={"username": user["email"], "password": PASSWORD})
+        if response.status_code == 200:
+            rec.latencies.append((time.perf_counter() - started) * 1000)
+        else:
+            rec.error(str(response.status_code))
+
+    return rec.summary(await _run_concurrently(concurrency, total, login))
+
+
+async def scenario_image(client: httpx.AsyncClient, users: list[dict], concurrency: int, total: int,
+                         width: int, height: int, prompts: int = 0, timeout: float = 600.0) -> dict:
+    """
+    latency — от POST /generate до статуса done; submit — только постановка в очередь.
+    prompts > 0 — промпты берутся из такого числа вариантов, и задачи могут попадать в общий батч.
+    Задача, не завершившаяся за timeout секунд, считается ошибкой job_timeout.
+    """
+    rec = Recorder()
+    rec.extra["submit"] = []
+
+    async def generate(slot: int, i: int):
+        headers = {"Authorization": f"Bearer {users[slot % len(users)]['token']}"}
+        prompt = f"bench {i % prompts}" if prompts else f"bench {uuid.uuid4().hex}"
+        body = {"prompt": prompt, "steps": 20, "width": width, "height": height}
+        started = time.perf_counter()
+        response = await client.post("/api/v1/image/generate", json=body, headers=headers)
+        if response.status_code != 202:
+            rec.error(str(response.status_code))
+            return
+        rec.extra["submit"].append((time.perf_counter() - started) * 1000)
+        job_id = response.json()["id"]
+        while time.perf_counter() - started < timeout:
+            await asyncio.sleep(0.05)
+            job = (await client.get(f"/api/v1/image/jobs/{job_id}", headers=headers)).json()
+            if job["status"] == "done":
+                rec.latencies.append((time.perf_counter() - started) * 1000)
+                return
+            if job["status"] in ("error", "cancelled"):
+                rec.error(f"job_{job['status']}")
+                return
+        rec.error("job_timeout")
+
+    return rec.summary(await _run_concurrently(concurrency, total, generate))
+
+
+async def scenario_chat(ws_url: str, users: list[dict], concurrency: int, turns: int) -> dict:
+    """latency — полный ответ; time_to_first_token — до первого delta-кадра. Одно соединение на слот."""
+    rec = Recorder()
+    rec.extra["time_to_first_token"] = []
+    rec.extra["connect"] = []
+
+    async def converse(slot: int, _):
+        user = users[slot % len(users)]
+        url = f"{ws_url}/api/v1/chat/stream?token={user['token']}&character_id={user['character_id']}"
+        started = time.perf_counter()
+        try:
+            async with websockets.connect(url, max_size=None) as ws:
+                assert json.loads(await ws.recv())["type"] == "connected"
+                rec.extra["connect"].append((time.perf_counter() - started) * 1000)
+                for turn in range(turns):
+                    sent = time.perf_counter()
+                    await ws.send(json.dumps({"type": "user_message", "text": f"Привет! Ход {turn}"}))
+                    first = None
+                    while True:
+                        frame = json.loads(await ws.recv())
+                        if frame["type"] == "delta" and first is None:
+                            first = time.perf_counter()
+                            rec.extra["time_to_first_token"].append((first - sent) * 1000)
+                        elif frame["type"] == "message_end":
+                            rec.latencies.append((time.perf_counter() - sent) * 1000)
+                            break
+                        elif frame["type"] == "error":
+                            rec.error(frame["code"])
+                            break
+        except (OSError, websockets.WebSocketException) as e:
+            rec.error(type(e).__name__)
+
+    wall = await _run_concurrently(concurrency, concurrency, converse)
+    return rec.summary(wall)
+
+
+# --- Окружение ---
+
+async def _setup_users(client: httpx.AsyncClient, count: int) -> list[dict]:
+    """Регистрирует пользователей, логинит их и создаёт каждому персонажа."""
+    users = []
+    run_id = uuid.uuid4().hex[:8]
+    for i in range(count):
+        email = f"bench-{run_id}-{i}@example.com"
+        (await client.post("/api/v1/auth/register", json={"email": email, "password": PASSWORD})).raise_for_status()
+        token = (await client.post("/api/v1/auth/token", data={"username": email, "password": PASSWORD})).json()
+        headers = {"Authorization": f"Bearer {token['access_token']}"}
+        character = (await client.post("/api/v1/users/me/characters", headers=headers, json={
+            "name": "Bench", "system_prompt": "Отвечай коротко."})).json()
+        users.append({"email": email, "token": token["access_token"], "character_id": character["id"]})
+    return users
+
+
+async def _wait_ready(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not come up in {timeout}s")
+            await asyncio.sleep(0.5)
+
+
+@asynccontextmanager
+async def _spawned_stack():
+    """Заглушки + миграции + приложение + воркер. Отдаёт (base_url, pid приложения)."""
+    env = {
+        **os.environ,
+        "COMFYUI_URL": f"http://127.0.0.1:{SD_STUB_PORT}",
+        "POLZA_API_URL": f"http://127.0.0.1:{LLM_STUB_PORT}/v1",
+        "POLZA_API_KEY": os.environ.get("POLZA_API_KEY", "bench"),
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "bench-secret"),
+        # Нагрузка идёт от --users пользователей, каждый держит несколько сокетов
+        "WS_MAX_CONNECTIONS_PER_USER": os.environ.get("WS_MAX_CONNECTIONS_PER_USER", "1000"),
+    }
+    uvicorn = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning"]
+    processes = []
+
+    def start(args: list[str]) -> subprocess.Popen:
+        process = subprocess.Popen(args, cwd=BACKEND_DIR, env=env)
+        processes.append(process)
+        return process
+
+    try:
+        start(uvicorn + ["stubs.llm_stub:app", "--port", str(LLM_STUB_PORT)])
+        start(uvicorn + ["stubs.sd_stub:app", "--port", str(SD_STUB_PORT)])
+        subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=BACKEND_DIR, env=env, check=True)
+        app = start(uvicorn + ["main:app", "--port", str(BACKEND_PORT), "--ws", "websockets"])
+        start([sys.executable, "worker.py"])
+        base_url = f"http://127.0.0.1:{BACKEND_PORT}"
+        for url in (f"http://127.0.0.1:{LLM_STUB_PORT}/stats", f"http://127.0.0.1:{SD_STUB_PORT}/stats", base_url):
+            await _wait_ready(url)
+        yield base_url, app.pid
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(current: dict, baseline: dict) -> dict:
+    """Относительное изменение числовых метрик, в процентах (плюс — стало больше)."""
+    def diff(now, before):
+        if isinstance(now, dict) and isinstance(before, dict):
+            nested = {k: diff(now[k], before[k]) for k in now if k in before}
+            return {k: v for k, v in nested.items() if v is not None} or None
+        if isinstance(now, (int, float)) and isinstance(before, (int, float)) and before:
+            return round((now - before) / before * 100, 1)
+        return None
+
+    return diff(current["scenarios"], baseline["scenarios"]) or {}
+
+
+async def _run(args, base_url: str, app_pid: Optional[int]) -> dict:
+    scenarios = {}
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        users = await _setup_users(client, min(args.concurrency, args.users))
+        ws_url = base_url.replace("http", "ws", 1)
+        for name in args.scenarios.split(","):
+            if name == "auth":
+                result = await scenario_auth(client, users, args.concurrency, args.requests)
+            elif name == "image":
+                result = await scenario_image(client, users, args.concurrency, args.image_requests,
+                                              args.width, args.height, args.image_prompts, args.image_timeout)
+            elif name == "chat":
+                result = await scenario_chat(ws_url, users, args.concurrency, args.turns)
+            else:
+                raise SystemExit(f"Unknown scenario {name!r}")
+            result["memory"] = _rss_kb(app_pid)
+            scenarios[name] = result
+            print(json.dumps({name: result}, ensure_ascii=False), file=sys.stderr, flush=True)
+    return scenarios
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="backend load test")
+    parser.add_argument("--spawn", action="store_true", help="поднять заглушки, приложение и воркер")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--scenarios", default="auth,image,chat")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200, help="логинов в сценарии auth")
+    parser.add_argument("--image-requests", type=int, default=20)
+    parser.add_argument("--image-prompts", type=int, default=0,
+                        help="число разных промптов в сценарии image (0 — все уникальные, без батчинга)")
+    parser.add_argument("--image-timeout", type=float, default=600.0,
+                        help="сколько секунд ждать завершения задачи в сценарии image")
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--turns", type=int, default=3, help="реплик на соединение в сценарии chat")
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    if args.spawn:
+        async with _spawned_stack() as (base_url, app_pid):
+            scenarios = await _run(args, base_url, app_pid)
+    else:
+        scenarios = await _run(args, args.base_url, None)
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "stubs": {k: v for k, v in os.environ.items() if k.startswith(("LLM_STUB_", "SD_STUB_"))},
+        "scenarios": scenarios,
+    }
+    if args.compare:
+        report["compare"] = {"baseline": args.compare,
+                             "change_pct": _compare(report, json.loads(Path(args.compare).read_text()))}
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
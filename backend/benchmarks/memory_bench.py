@@ -0,0 +1,71 @@
+# Бенчмарк поиска долгой памяти чата (app/services/chat_memory.py) без модели.
+#
+# Пишет индекс одной сессии из случайных нормированных векторов в CHAT_MEMORY_DIR
+# (по умолчанию — во временный каталог) и печатает JSON с латентностью search():
+# первый запрос после сброса page cache не измеряется, дальше — тёплый индекс.
+#   python -m benchmarks.memory_bench --messages 100000
+#   python -m benchmarks.memory_bench --messages 100000 --dim 768 --runs 200
+# Время эмбеддинга запроса сюда не входит: оно не зависит от длины истории.
+import argparse
+import json
+import statistics
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+from app.core.config import settings
+from app.services import chat_memory
+
+APPEND_BATCH = 10_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="chat memory benchmark")
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=settings.CHAT_MEMORY_TOP_K)
+    parser.add_argument("--window", type=int, default=settings.CHAT_HISTORY_MESSAGES,
+                        help="столько последних сообщений исключается как окно истории")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.CHAT_MEMORY_DIR = tmp
+        session_id = uuid.uuid4()
+        rng = np.random.default_rng(0)
+        ids = [uuid.uuid4() for _ in range(args.messages)]
+        started = time.perf_counter()
+        for start in range(0, args.messages, APPEND_BATCH):
+            vectors = rng.standard_normal((min(APPEND_BATCH, args.messages - start), args.dim), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            chat_memory.append(session_id, ids[start:start + len(vectors)], vectors)
+        append_s = time.perf_counter() - started
+
+        exclude = set(ids[-args.window:])
+        settings.CHAT_MEMORY_MIN_SCORE = -1.0  # Случайные векторы почти ортогональны: берём любые
+        queries = rng.standard_normal((args.runs + 1, args.dim), dtype=np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        chat_memory.search(session_id, queries[0], args.top_k, exclude)  # Прогрев page cache
+        timings = []
+        for query in queries[1:]:
+            started = time.perf_counter()
+            hits = chat_memory.search(session_id, query, args.top_k, exclude)
+            timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    print(json.dumps({
+        "messages": args.messages,
+        "dim": args.dim,
+        "index_mb": round(args.messages * args.dim * 4 / 2 ** 20, 1),
+        "append_s": round(append_s, 2),
+        "hits": len(hits),
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+        "max_ms": round(timings[-1], 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
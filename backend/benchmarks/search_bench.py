@@ -0,0 +1,153 @@
+# Бенчмарк поиска (app/crud/search_crud.py) на большой синтетической истории.
+#
+# Засевает отдельного пользователя с персонажами, сессиями и миллионами сообщений
+# (генерация на стороне Postgres через generate_series — минуты, а не часы),
+# затем гоняет типовые запросы и печатает JSON с латентностями по страницам.
+#   alembic upgrade head
+#   python -m benchmarks.search_bench --messages 2000000
+#   python -m benchmarks.search_bench --skip-seed --runs 20
+# Фоновый шум от других пользователей: --other-users, их сообщения не должны
+# влиять на время поиска благодаря фильтру по user_id.
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from sqlalchemy import select, text
+
+from app.crud import search_crud
+from app.db.session import AsyncSessionLocal, engine
+from app.models import User
+
+BENCH_EMAIL = "search-bench@example.com"
+BATCH = 200_000
+
+# Словарь для синтетических сообщений: частые, средние и редкие слова
+VOCABULARY = (
+    "привет как дела сегодня погода хорошо спасибо расскажи историю про дракона замок "
+    "рыцарь принцесса магия лес река город ночь утро кофе музыка фильм книга работа "
+    "отпуск море горы путешествие поезд самолёт кошка собака друг семья праздник "
+    "hello world story dragon castle coffee music quantum кристалл астролябия"
+).split()
+
+QUERIES = {
+    "fts_common": "привет",
+    "fts_two_words": "дракон замок",
+    "fts_rare": "астролябия",
+    "fts_prefix": "путеш",
+    "trigram_typo": "астролябя",
+    "no_hits": "zzzzqqq",
+}
+
+
+async def _seed(messages: int, sessions: int, characters: int, owner_email: str) -> uuid.UUID:
+    async with AsyncSessionLocal() as db:
+        user_id = (await db.execute(select(User.id).where(User.email == owner_email))).scalar()
+        if user_id is None:
+            user_id = uuid.uuid4()
+            await db.execute(text("INSERT INTO users (id, email, hashed_password) VALUES (:id, :email, 'x')"),
+                             {"id": user_id, "email": owner_email})
+        await db.execute(text("""
+            INSERT INTO characters (id, name, description, owner_id)
+            SELECT gen_random_uuid(), 'Персонаж ' || i, 'Хранитель замка и знаток музыки №' || i, :uid
+            FROM generate_series(1, :n) AS i
+        """), {"uid": user_id, "n": characters})
+        await db.execute(text("""
+            INSERT INTO chat_sessions (id, title, user_id, character_id)
+            SELECT gen_random_uuid(), 'Bench ' || i, :uid,
+                   (SELECT id FROM characters WHERE owner_id = :uid ORDER BY random() + i LIMIT 1)
+            FROM generate_series(1, :n) AS i
+        """), {"uid": user_id, "n": sessions})
+        await db.commit()
+
+        session_ids = [row[0] for row in await db.execute(
+            text("SELECT id FROM chat_sessions WHERE user_id = :uid"), {"uid": user_id})]
+        inserted = 0
+        while inserted < messages:
+            batch = min(BATCH, messages - inserted)
+            # 8–24 случайных слова из словаря; сессия и время — случайные
+            await db.execute(text("""
+                INSERT INTO messages (id, session_id, role, content, created_at)
+                SELECT gen_random_uuid(),
+                       (CAST(:sessions AS uuid[]))[1 + (random() * (cardinality(CAST(:sessions AS uuid[])) - 1))::int],
+                       CASE WHEN random() < 0.5 THEN 'user' ELSE 'ai' END,
+                       (SELECT string_agg((CAST(:vocab AS text[]))[1 + (random() * (cardinality(CAST(:vocab AS text[])) - 1))::int], ' ')
+                        FROM generate_series(1, 8 + (random() * 16)::int + i * 0)),
+                       now() - random() * interval '365 days'
+                FROM generate_series(1, :n) AS i
+            """), {"sessions": session_ids, "vocab": list(VOCABULARY), "n": batch})
+            await db.commit()
+            inserted += batch
+            print(json.dumps({"seeded_messages": inserted}), flush=True)
+    async with engine.connect() as conn:
+        await conn.execute(text("ANALYZE messages"))
+        await conn.execute(text("ANALYZE characters"))
+        await conn.execute(text("ANALYZE chat_sessions"))
+        await conn.commit()
+    return user_id
+
+
+async def _bench(user_id: uuid.UUID, runs: int, pages: int, limit: int) -> dict:
+    results = {}
+    async with AsyncSessionLocal() as db:
+        for name, q in QUERIES.items():
+            per_page = [[] for _ in range(pages)]
+            hits, mode = 0, None
+            for _ in range(runs):
+                cursor = None
+                for page_no in range(pages):
+                    started = time.perf_counter()
+                    result = await search_crud.search(db, user_id, q, cursor, limit)
+                    per_page[page_no].append((time.perf_counter() - started) * 1000)
+                    if page_no == 0:
+                        hits = len(result["items"])
+                        mode = result["items"][0]["mode"] if result["items"] else None
+                    cursor = result["next_cursor"]
+                    if cursor is None:
+                        break
+            results[name] = {
+                "q": q,
+                "mode": mode,
+                "first_page_hits": hits,
+                "pages": [
+                    {"page": i + 1, "p50_ms": round(statistics.median(t), 1), "max_ms": round(max(t), 1)}
+                    for i, t in enumerate(per_page) if t
+                ],
+            }
+    return results
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="search benchmark")
+    parser.add_argument("--messages", type=int, default=2_000_000)
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--characters", type=int, default=50)
+    parser.add_argument("--other-users", type=int, default=0, help="столько же сообщений у N других пользователей")
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.skip_seed:
+        async with AsyncSessionLocal() as db:
+            user_id = (await db.execute(select(User.id).where(User.email == BENCH_EMAIL))).scalar()
+        if user_id is None:
+            raise SystemExit("No seeded data, run without --skip-seed first")
+    else:
+        for i in range(args.other_users):
+            await _seed(args.messages, args.sessions, args.characters, f"search-bench-other-{i}@example.com")
+        user_id = await _seed(args.messages, args.sessions, args.characters, BENCH_EMAIL)
+
+    async with AsyncSessionLocal() as db:
+        total = (await db.execute(text("SELECT count(*) FROM messages"))).scalar()
+    results = await _bench(user_id, args.runs, args.pages, args.limit)
+    await engine.dispose()
+    print(json.dumps({"messages_total": total, "runs": args.runs, "limit": args.limit, "queries": results},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,30 +1,91 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+import asyncio
 import os
 import httpx
 import json
+from contextlib import asynccontextmanager
+from functools import partial
 
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
-from app.db.session import get_db  # Если get_db использует engine, адаптируй
-from app.models import Base  # Импорт Base для metadata
+from app.db.session import check_schema_version, dispose_engines, get_redis_pool, AsyncSessionLocal
 from app.core.config import settings  # Если DATABASE_URL в config
+from app.core.http_clients import UpstreamClients
+from app.core import tracing
+from app.core.tracing import TracingMiddleware
+from app.core.metrics import MetricsMiddleware, metrics_endpoint
+from app.core.ws_manager import ConnectionManager
+from app.crud.pagination import InvalidCursorError
+from app.services import chat_generation, chat_memory, chat_summary
+from app.services.message_writer import MessageWriter
 
-from app.api.routers import auth, users, chat, image_gen
+from app.api.routers import auth, users, chat, image_gen, search, system
 
 # --- ИЗМЕНЕНИЕ ЗДЕСЬ: Используем host.docker.internal для обращения к A1111 на хосте ---
 SD_API_URL = os.getenv("SD_API_URL", "http://host.docker.internal:7860")
 # ------------------------------------------------------------------------------------
 
-# Async engine для создания таблиц (используй твою DB URL, например из settings)
-engine = create_async_engine(settings.DATABASE_URL, echo=True)  # Добавь echo для логов, если нужно
 
-app = FastAPI(title="AI Companion MVP (Local GPU)")
+# Всё, что живёт столько же, сколько процесс: создаётся до первого запроса и закрывается при остановке
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await check_schema_version()  # Схему накатывает `alembic upgrade head` до запуска (см. Dockerfile)
+    app.state.redis = await get_redis_pool()  # Используется очередью генерации изображений
+    app.state.http_clients = UpstreamClients()  # Общие пулы соединений к A1111 и polza.ai
+    app.state.http_clients.start(app.state.redis)
+    # Пакетная запись сообщений чата; записанные уходят на индексацию в долгую память
+    app.state.message_writer = MessageWriter(
+        AsyncSessionLocal,
+        on_flushed=partial(chat_memory.enqueue, app.state.redis) if settings.CHAT_MEMORY_ENABLED else None,
+    )
+    app.state.message_writer.start()
+    if settings.CHAT_MEMORY_ENABLED:
+        await chat_memory.load_model()  # Модель запросов долгой памяти: первый ход чата её не ждёт
+    app.state.ws_manager = ConnectionManager(app.state.redis)  # Лимиты и heartbeat WebSocket
+    app.state.ws_manager.start()
+    # Генерация ответов чата для сокетов любого воркера (см. chat_generation)
+    chat_generators = asyncio.create_task(chat_generation.run_generators(
+        app.state.redis, app.state.http_clients, app.state.message_writer))
+    # Сводки давних частей разговоров — в фоне, вне хода чата
+    chat_summarizers = asyncio.create_task(chat_summary.run_summarizers(
+        app.state.redis, app.state.http_clients)) if settings.CHAT_SUMMARY_ENABLED else None
+    trace_exporter = asyncio.create_task(tracing.run_exporter()) if settings.TRACING_ENABLED else None
+    try:
+        yield
+    finally:
+        await app.state.ws_manager.drain()  # Сначала отпускаем клиентов: им есть куда переподключиться
+        chat_generators.cancel()
+        await asyncio.gather(chat_generators, return_exceptions=True)  # Недописанные ответы закрываются
+        if chat_summarizers is not None:
+            chat_summarizers.cancel()
+            await asyncio.gather(chat_summarizers, return_exceptions=True)
+        if trace_exporter is not None:
+            trace_exporter.cancel()
+            await asyncio.gather(trace_exporter, return_exceptions=True)
+        await app.state.message_writer.stop()  # Дописываем всё, что осталось в буфере
+        await app.state.http_clients.aclose()
+        await app.state.redis.aclose()
+        await dispose_engines()
+
+
+app = FastAPI(title="AI Companion MVP (Local GPU)", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+if settings.TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware)  # Внешний слой: в трассу попадает и MetricsMiddleware
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+
+@app.exception_handler(InvalidCursorError)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursorError):
+    return JSONResponse(status_code=400, content={"detail": "Invalid pagination cursor"})
+
 
 app.include_router(auth.router, prefix="/api/v1/auth")
 app.include_router(users.router, prefix="/api/v1/users")
 app.include_router(chat.router, prefix="/api/v1/chat")
 app.include_router(image_gen.router, prefix="/api/v1/image")
+app.include_router(search.router, prefix="/api/v1/search")
+app.include_router(system.router, prefix="/api/v1/system")
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,12 +95,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Хук для создания таблиц при старте
-@app.on_event("startup")
-async def startup_event():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)  # Создаёт все таблицы из models
-
 @app.get("/")
 async def root():
     return {"status": "ok"}
@@ -0,0 +1,20 @@
+# Воркер долгой памяти чата: считает эмбеддинги сообщений и дописывает индексы сессий.
+# Запускается отдельным процессом: `python memory_worker.py` (сервис memory_worker в docker-compose).
+import asyncio
+import logging
+
+from app.db.session import get_redis_pool
+from app.services import chat_memory
+
+
+async def main():
+    r = await get_redis_pool()
+    try:
+        await chat_memory.run_embedders(r)
+    finally:
+        await r.aclose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,33 @@
+"""query indexes
+
+Индексы под горячие запросы: история сессии, список сессий пользователя,
+персонажи владельца. CONCURRENTLY — чтобы не блокировать запись в живую БД.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index("ix_messages_session_id_created_at", "messages", ["session_id", "created_at"],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index("ix_chat_sessions_user_id_created_at", "chat_sessions", ["user_id", "created_at"],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index("ix_characters_owner_id", "characters", ["owner_id"],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_characters_owner_id", table_name="characters", postgresql_concurrently=True)
+        op.drop_index("ix_chat_sessions_user_id_created_at", table_name="chat_sessions",
+                      postgresql_concurrently=True)
+        op.drop_index("ix_messages_session_id_created_at", table_name="messages", postgresql_concurrently=True)
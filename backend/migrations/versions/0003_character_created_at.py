@@ -0,0 +1,36 @@
+"""character created_at
+
+Персонажам нужна дата создания для keyset-пагинации (created_at, id).
+Существующим строкам достаётся время миграции. Индекс по owner_id
+заменяется составным (owner_id, created_at): он покрывает и фильтр, и сортировку.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("characters", sa.Column("created_at", sa.DateTime(timezone=True),
+                                          server_default=sa.func.now(), nullable=False))
+    with op.get_context().autocommit_block():
+        op.create_index("ix_characters_owner_id_created_at", "characters", ["owner_id", "created_at"],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index("ix_characters_owner_id", table_name="characters", postgresql_concurrently=True,
+                      if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index("ix_characters_owner_id", "characters", ["owner_id"],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index("ix_characters_owner_id_created_at", table_name="characters",
+                      postgresql_concurrently=True, if_exists=True)
+    op.drop_column("characters", "created_at")
@@ -0,0 +1,48 @@
+"""full-text search
+
+tsvector-колонки (GENERATED ... STORED — Postgres сам пересчитывает их при
+INSERT/UPDATE) с GIN-индексами и trigram-индексы для неточного поиска.
+Добавление generated-колонки переписывает таблицу messages под эксклюзивной
+блокировкой: на большой базе миграцию стоит катить в окно обслуживания.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.add_column("messages", sa.Column("search_vector", postgresql.TSVECTOR(), sa.Computed(
+        "to_tsvector('russian', content)", persisted=True)))
+    op.add_column("characters", sa.Column("search_vector", postgresql.TSVECTOR(), sa.Computed(
+        "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(description, '')), 'B')", persisted=True)))
+    with op.get_context().autocommit_block():
+        op.create_index("ix_messages_search_vector", "messages", ["search_vector"], postgresql_using="gin",
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index("ix_messages_content_trgm", "messages", ["content"], postgresql_using="gin",
+                        postgresql_ops={"content": "gin_trgm_ops"},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index("ix_characters_search_vector", "characters", ["search_vector"], postgresql_using="gin",
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index("ix_characters_name_trgm", "characters", ["name"], postgresql_using="gin",
+                        postgresql_ops={"name": "gin_trgm_ops"},
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for index, table in (("ix_characters_name_trgm", "characters"), ("ix_characters_search_vector", "characters"),
+                             ("ix_messages_content_trgm", "messages"), ("ix_messages_search_vector", "messages")):
+            op.drop_index(index, table_name=table, postgresql_concurrently=True, if_exists=True)
+    op.drop_column("characters", "search_vector")
+    op.drop_column("messages", "search_vector")
@@ -0,0 +1,34 @@
+"""chat summaries
+
+Сводка давней части чат-сессии, по строке на сессию. Новая таблица,
+существующие не трогаются — миграция мгновенная.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "chat_summaries",
+        sa.Column("session_id", postgresql.UUID(as_uuid=True),
+                  sa.ForeignKey("chat_sessions.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("content", sa.Text(), nullable=False),
+        sa.Column("tokens", sa.Integer(), nullable=False),
+        sa.Column("covered_until", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("messages_covered", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("chat_summaries")
@@ -0,0 +1,29 @@
+"""character description trigram index
+
+Trigram-индекс по characters.description: неточный поиск по персонажам
+ищет и по описанию, а не только по имени. Индекс строится CONCURRENTLY —
+таблица не блокируется.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index("ix_characters_description_trgm", "characters", ["description"], postgresql_using="gin",
+                        postgresql_ops={"description": "gin_trgm_ops"},
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_characters_description_trgm", table_name="characters",
+                      postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,92 @@
+# Локальная заглушка polza.ai (OpenAI-совместимый /chat/completions со stream=true).
+#
+# Воспроизводит записанные SSE-потоки из stubs/recordings/*.sse с настраиваемой задержкой:
+#   LLM_STUB_FIRST_TOKEN_MS=300 LLM_STUB_TOKEN_MS=20 uvicorn stubs.llm_stub:app --port 9100
+# и POLZA_API_URL=http://localhost:9100/v1 у бэкенда.
+#
+# Записать новый поток с настоящего API:
+#   python -m stubs.llm_stub record stubs/recordings/my.sse "Привет!"
+#
+# GET /stats показывает, сколько потоков начато, дочитано и оборвано клиентом —
+# так проверяется, что отключение чата действительно рвёт запрос к модели.
+import asyncio
+import itertools
+import os
+import sys
+from pathlib import Path
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+RECORDINGS_DIR = Path(os.getenv("LLM_STUB_RECORDINGS", Path(__file__).parent / "recordings"))
+FIRST_TOKEN_MS = float(os.getenv("LLM_STUB_FIRST_TOKEN_MS", "300"))
+TOKEN_MS = float(os.getenv("LLM_STUB_TOKEN_MS", "20"))
+RECORDING = os.getenv("LLM_STUB_RECORDING")  # Имя файла без .sse; по умолчанию — все по кругу
+
+app = FastAPI(title="polza.ai stub")
+stats = {"started": 0, "completed": 0, "aborted": 0}
+
+
+def _load_recordings() -> dict[str, list[str]]:
+    """Файл записи — сырой SSE-поток; события разделены пустой строкой."""
+    recordings = {}
+    for path in sorted(RECORDINGS_DIR.glob("*.sse")):
+        events = [e.strip() for e in path.read_text(encoding="utf-8").split("\n\n") if e.strip()]
+        recordings[path.stem] = events
+    return recordings
+
+
+_recordings = _load_recordings()
+_rotation = itertools.cycle(sorted(_recordings))
+
+
+async def _replay(events: list[str]):
+    stats["started"] += 1
+    completed = False
+    try:
+        await asyncio.sleep(FIRST_TOKEN_MS / 1000)
+        for i, event in enumerate(events):
+            if i:
+                await asyncio.sleep(TOKEN_MS / 1000)
+            yield f"{event}\n\n"
+        completed = True
+    finally:
+        # Сюда же попадаем по CancelledError/GeneratorExit при обрыве соединения клиентом
+        stats["completed" if completed else "aborted"] += 1
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    await request.json()
+    events = _recordings[RECORDING or next(_rotation)]
+    return StreamingResponse(_replay(events), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+async def _record(path: str, prompt: str) -> None:
+    import httpx
+
+    url = os.environ.get("POLZA_API_URL", "https://api.polza.ai/api/v1")
+    body = {
+        "model": os.environ.get("POLZA_MODEL", "openai/gpt-4o-mini"),
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+    headers = {"Authorization": f"Bearer {os.environ['POLZA_API_KEY']}"}
+    async with httpx.AsyncClient(timeout=60) as client:
+        async with client.stream("POST", f"{url}/chat/completions", json=body, headers=headers) as r:
+            r.raise_for_status()
+            with open(path, "w", encoding="utf-8") as f:
+                async for line in r.aiter_lines():
+                    f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "record":
+        sys.exit("usage: python -m stubs.llm_stub record <out.sse> <prompt>")
+    asyncio.run(_record(sys.argv[2], sys.argv[3]))
@@ -0,0 +1,118 @@
+# Локальная заглушка Automatic1111 (/sdapi/v1/txt2img, /options, /progress и /interrupt).
+#
+# Отвечает настоящим PNG запрошенного размера после настраиваемой задержки:
+#   SD_STUB_LATENCY_MS=2000 SD_STUB_STEP_MS=0 uvicorn stubs.sd_stub:app --port 9200
+# и COMFYUI_URL=http://localhost:9200 у бэкенда и воркера.
+#
+# Размер ответа задаётся SD_STUB_NOISE: 0 — однотонная картинка (PNG в пару КБ),
+# 1 — шум (PNG почти без сжатия, ~3 байта на пиксель), промежуточные значения —
+# доля шумных строк. Число одновременно обрабатываемых запросов ограничено
+# SD_STUB_CONCURRENCY — как у одной видеокарты. /progress, как и в A1111, описывает
+# последнюю начатую генерацию, /interrupt прерывает текущие.
+import asyncio
+import base64
+import io
+import os
+import random
+import time
+
+from fastapi import FastAPI, Request
+from PIL import Image
+
+LATENCY_MS = float(os.getenv("SD_STUB_LATENCY_MS", "2000"))
+STEP_MS = float(os.getenv("SD_STUB_STEP_MS", "0"))  # Добавка за каждый шаг семплера
+NOISE = float(os.getenv("SD_STUB_NOISE", "0.2"))
+CONCURRENCY = int(os.getenv("SD_STUB_CONCURRENCY", "1"))
+CHECKPOINT = os.getenv("SD_STUB_CHECKPOINT", "stub.safetensors")
+
+app = FastAPI(title="Automatic1111 stub")
+stats = {"requests": 0, "images": 0, "bytes": 0, "max_queue": 0}
+_gpu = asyncio.Semaphore(CONCURRENCY)
+_waiting = 0
+_current = {"started": 0.0, "duration": 0.0, "steps": 0, "color": (0, 0, 0)}
+_interrupted = asyncio.Event()
+
+
+def _render(width: int, height: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    noisy_rows = int(height * NOISE)
+    if noisy_rows:
+        image.paste(Image.frombytes("RGB", (width, noisy_rows), rng.randbytes(width * noisy_rows * 3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+@app.post("/sdapi/v1/txt2img")
+async def txt2img(request: Request):
+    global _waiting
+    payload = await request.json()
+    stats["requests"] += 1
+    _waiting += 1
+    stats["max_queue"] = max(stats["max_queue"], _waiting)
+    try:
+        await _gpu.acquire()
+    finally:
+        _waiting -= 1
+    try:
+        seed = payload.get("seed", -1)
+        seed = random.randrange(2 ** 32) if seed == -1 else seed
+        duration = (LATENCY_MS + STEP_MS * payload.get("steps", 20)) / 1000
+        rng = random.Random(seed)
+        _current.update(started=time.monotonic(), duration=duration, steps=payload.get("steps", 20),
+                        color=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        _interrupted.clear()
+        try:
+            await asyncio.wait_for(_interrupted.wait(), duration)
+            stats["interrupted"] = stats.get("interrupted", 0) + 1
+            return {"images": [], "parameters": payload, "info": "{}"}
+        except asyncio.TimeoutError:
+            pass
+        images = [
+            await asyncio.to_thread(_render, payload.get("width", 512), payload.get("height", 512), seed + i)
+            for i in range(payload.get("batch_size", 1))
+        ]
+    finally:
+        _gpu.release()
+    encoded = [base64.b64encode(image).decode() for image in images]
+    stats["images"] += len(images)
+    stats["bytes"] += sum(len(image) for image in images)
+    return {"images": encoded, "parameters": payload, "info": f'{{"seed": {seed}}}'}
+
+
+@app.get("/sdapi/v1/options")
+async def options():
+    return {"sd_model_checkpoint": CHECKPOINT}
+
+
+@app.get("/sdapi/v1/progress")
+async def progress(skip_current_image: bool = False):
+    elapsed = time.monotonic() - _current["started"]
+    if not _current["duration"] or elapsed >= _current["duration"]:
+        return {"progress": 0.0, "eta_relative": 0.0, "state": {"sampling_step": 0, "sampling_steps": 0},
+                "current_image": None}
+    fraction = elapsed / _current["duration"]
+    current_image = None
+    if not skip_current_image:
+        buffer = io.BytesIO()
+        shade = tuple(int(c * fraction) for c in _current["color"])
+        Image.new("RGB", (512, 512), shade).save(buffer, format="PNG")
+        current_image = base64.b64encode(buffer.getvalue()).decode()
+    return {
+        "progress": fraction,
+        "eta_relative": _current["duration"] - elapsed,
+        "state": {"sampling_step": int(fraction * _current["steps"]), "sampling_steps": _current["steps"]},
+        "current_image": current_image,
+    }
+
+
+@app.post("/sdapi/v1/interrupt")
+async def interrupt():
+    _interrupted.set()
+    return {}
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
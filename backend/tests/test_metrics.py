@@ -0,0 +1,34 @@
+"""Метки маршрутов в метриках: полный шаблон пути вместе с prefix из include_router."""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core import metrics
+
+
+@pytest.fixture(scope="module")
+def client():
+    from main import app
+
+    # Без `with`: lifespan (Redis, БД) не запускается, маршруты сматчиваются и так
+    return TestClient(app, raise_server_exceptions=False)
+
+
+def _requests(route: str) -> float:
+    total = 0.0
+    for metric in metrics.HTTP_REQUESTS.collect():
+        for sample in metric.samples:
+            if sample.name == "http_requests_total" and sample.labels["route"] == route:
+                total += sample.value
+    return total
+
+
+@pytest.mark.parametrize("path, route", [
+    ("/api/v1/image/jobs/abc", "/api/v1/image/jobs/{job_id}"),
+    ("/api/v1/search", "/api/v1/search"),  # Маршрут "" роутера — сам prefix
+    ("/api/v1/no-such-route", "unmatched"),
+])
+def test_route_label_includes_prefix(client, path, route):
+    before = _requests(route)
+    client.get(path)
+    assert _requests(route) == before + 1
@@ -0,0 +1,63 @@
+# Пул воркеров генерации изображений.
+# Запускается отдельным процессом: `python worker.py` (сервис image_worker в docker-compose).
+import asyncio
+import base64
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from app.core.config import settings
+from app.core.http_clients import UpstreamClients
+from app.db.session import get_redis_pool
+from app.services import image_cache, image_queue, sd_api
+from app.services.image_batcher import Txt2ImgBatcher
+from app.services.image_store import ImageStore
+
+
+async def main():
+    r = await get_redis_pool()
+    clients = UpstreamClients()
+    clients.start(r)  # Пробы здоровья SD-бэкендов
+    executor = ProcessPoolExecutor(settings.IMAGE_VARIANT_PROCESSES) if settings.IMAGE_VARIANTS_ENABLED else None
+    store = ImageStore(settings.IMAGE_STORE_DIR, executor)
+    batcher = Txt2ImgBatcher(clients.sd, r) if settings.IMAGE_BATCHING_ENABLED else None
+
+    async def handle(job: dict) -> dict:
+        async def on_progress(progress: dict) -> None:
+            await image_queue.report_progress(r, job["id"], progress)
+
+        if batcher is not None:
+            data = await batcher.txt2img(job["payload"], on_progress)
+        else:
+            data = await sd_api.txt2img(clients.sd, job["payload"], on_progress)
+        # A1111 возвращает base64-изображения в списке 'images': декодируем один раз
+        # и дальше отдаём клиенту только ссылки на файлы
+        images = []
+        for encoded in data.get("images", []):
+            digest = await store.save(base64.b64decode(encoded))
+            images.append({"id": digest, "variants": store.available_variants(digest)})
+        result = {"images": images}
+        if job.get("cache_key"):
+            await image_cache.put(r, job["cache_key"], result)
+        return result
+
+    # С батчингом из очереди разбирается больше задач, чем слотов GPU: ожидающие
+    # слота задачи копятся в батчере и уходят в A1111 общим батчем
+    concurrency = clients.sd.capacity
+    if batcher is not None:
+        concurrency *= settings.IMAGE_BATCH_MAX_SIZE
+    sweeper = asyncio.create_task(store.run_sweeper())  # Держит хранилище в пределах IMAGE_STORE_MAX_BYTES
+    try:
+        await image_queue.run_workers(r, handle, concurrency)
+    finally:
+        sweeper.cancel()
+        if batcher is not None:
+            await batcher.aclose()
+        await clients.aclose()
+        if executor is not None:
+            executor.shutdown()
+        await r.aclose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -1,27 +1,48 @@
 'use client';
 import { useState, useRef, useEffect, FormEvent } from 'react';
+import { useSearchParams } from 'next/navigation';
+import { useAuthStore } from '@/lib/store/auth';
 
-// Хук для WebSocket
+type ChatMessage = {
+  id: string;
+  role: 'user' | 'ai' | 'system';
+  text: string;
+};
+
+// Хук для WebSocket: сервер шлёт JSON-кадры, а ответ AI приходит дельтами
 function useChatSocket(url: string) {
-  const [messages, setMessages] = useState<string[]>([]);
+  const [messages, setMessages] = useState<ChatMessage[]>([]);
   const ws = useRef<WebSocket | null>(null);
 
   useEffect(() => {
-    // TODO: Добавить Bearer токен в query-параметр
-    // const { accessToken } = useAuthStore.getState();
-    // const socketUrl = `${url}?token=${accessToken}`;
-    const socketUrl = url; // Пока без auth
-
-    ws.current = new WebSocket(socketUrl);
+    ws.current = new WebSocket(url);
 
     ws.current.onopen = () => console.log('WebSocket connected');
     ws.current.onclose = () => console.log('WebSocket disconnected');
 
     ws.current.onmessage = (event) => {
-      // Это очень упрощенная логика
-      // Нам нужно парсить "AI: ..." и "User: ..."
-      // и обновлять последнее сообщение AI, а не добавлять новое
-      setMessages((prev) => [...prev, event.data]);
+      const frame = JSON.parse(event.data);
+      switch (frame.type) {
+        case 'ping':
+          // Heartbeat: без ответа сервер сочтёт соединение мёртвым и закроет его
+          ws.current?.send(JSON.stringify({ type: 'pong' }));
+          break;
+        case 'user_message':
+          setMessages((prev) => [...prev, { id: frame.message_id, role: 'user', text: frame.text }]);
+          break;
+        case 'message_start':
+          setMessages((prev) => [...prev, { id: frame.message_id, role: 'ai', text: '' }]);
+          break;
+        case 'delta':
+          // Дописываем фрагмент только в своё сообщение
+          setMessages((prev) =>
+            prev.map((m) => (m.id === frame.message_id ? { ...m, text: m.text + frame.text } : m)),
+          );
+          break;
+        case 'error':
+          setMessages((prev) => [...prev, { id: `err-${prev.length}`, role: 'system', text: frame.detail }]);
+          break;
+      }
     };
 
     return () => {
@@ -30,17 +51,29 @@ function useChatSocket(url: string) {
   }, [url]);
 
   const sendMessage = (message: string) => {
-    ws.current?.send(message);
+    ws.current?.send(JSON.stringify({ type: 'user_message', text: message }));
+  };
+
+  const cancelReply = () => {
+    ws.current?.send(JSON.stringify({ type: 'cancel' }));
   };
 
-  return { messages, sendMessage };
+  return { messages, sendMessage, cancelReply };
 }
 
 export default function ChatPage() {
+  // WebSocket не умеет Bearer-заголовки: токен и сессия передаются в query-параметрах
+  const searchParams = useSearchParams();
+  const token = useAuthStore((state) => state.token);
+  const params = new URLSearchParams({ token: token ?? '' });
+  const sessionId = searchParams.get('session_id');
+  const characterId = searchParams.get('character_id');
+  if (sessionId) params.set('session_id', sessionId);
+  else if (characterId) params.set('character_id', characterId);
   const wsUrl = (process.env.NEXT_PUBLIC_API_URL || 'ws://localhost:8000')
-    .replace('http', 'ws') + '/api/v1/chat/stream';
+    .replace('http', 'ws') + `/api/v1/chat/stream?${params}`;
 
-  const { messages, sendMessage } = useChatSocket(wsUrl);
+  const { messages, sendMessage, cancelReply } = useChatSocket(wsUrl);
   const [input, setInput] = useState('');
 
   const handleSubmit = (e: FormEvent) => {
@@ -57,9 +90,13 @@ export default function ChatPage() {
 
       {/* Окно чата */}
       <div className="flex-1 space-y-4 overflow-y-auto rounded-lg border border-neutral-800 bg-neutral-950 p-4">
-        {messages.map((msg, idx) => (
-          <div key={idx} className={`p-2 rounded ${msg.startsWith('AI:') ? 'text-blue-300' : 'text-green-300'}`}>
-            {msg}
+        {messages.map((msg) => (
+          <div
+            key={msg.id}
+            className={`p-2 rounded ${msg.role === 'ai' ? 'text-blue-300' : msg.role === 'user' ? 'text-green-300' : 'text-red-300'}`}
+          >
+            {msg.role === 'ai' ? 'AI: ' : msg.role === 'user' ? 'User: ' : ''}
+            {msg.text}
           </div>
         ))}
       </div>
@@ -79,6 +116,13 @@ export default function ChatPage() {
         >
           Send
         </button>
+        <button
+          type="button"
+          onClick={cancelReply}
+          className="rounded-lg border border-neutral-700 px-5 py-2.5 text-center font-medium hover:bg-neutral-800"
+        >
+          Stop
+        </button>
       </form>
     </div>
   );
@@ -1,16 +1,46 @@
 'use client';
-import { useState } from 'react';
+import { useRef, useState } from 'react';
 import { useForm } from 'react-hook-form';
 import apiFetch from '@/lib/api';
+import { useAuthStore } from '@/lib/store/auth';
 import NextImage from 'next/image'; // Используем Next.js Image
 
 type FormValues = {
   prompt: string;
 };
 
+type GeneratedImage = {
+  id: string;
+  url: string;
+  variants: Record<string, string>;
+};
+
 export default function ImageGenPage() {
-  const [images, setImages] = useState<string[]>([]);
+  const [images, setImages] = useState<GeneratedImage[]>([]);
   const [error, setError] = useState<string | null>(null);
+  const [progress, setProgress] = useState<number | null>(null);
+  const [preview, setPreview] = useState<string | null>(null);
+  const jobId = useRef<string | null>(null);
+  const token = useAuthStore((state) => state.token);
+
+  // Превью отдаётся за авторизацией, поэтому <img src> напрямую не подойдёт
+  const loadPreview = async (id: string) => {
+    const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/v1/image/jobs/${id}/preview`, {
+      headers: { Authorization: `Bearer ${token}` },
+    });
+    if (!res.ok) return;
+    const url = URL.createObjectURL(await res.blob());
+    setPreview((old) => {
+      if (old) URL.revokeObjectURL(old);
+      return url;
+    });
+  };
+
+  const onCancel = async () => {
+    if (jobId.current) {
+      await apiFetch(`/image/jobs/${jobId.current}/cancel`, { method: 'POST' });
+    }
+  };
 
   const {
     register,
@@ -21,16 +51,38 @@ export default function ImageGenPage() {
     const onSubmit = async (data: FormValues) => {
         setError(null);
         setImages([]);
+        setProgress(null);
+        setPreview(null);
         try {
           const payload = {
             prompt: data.prompt,
             steps: 25,
           };
-          const response = await apiFetch('/image/generate', {  // Убрал /api
+          const job = await apiFetch('/image/generate', {  // Убрал /api
             method: 'POST',
             body: JSON.stringify(payload),
           });
-          setImages(response.images); // Ожидаем base64 строки
+          jobId.current = job.id;
+          // Генерация идёт в очереди: опрашиваем статус (и прогресс) задачи до завершения
+          let status = job.status;
+          let previewSeq = 0;
+          while (status === 'queued' || status === 'running') {
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+            const current = await apiFetch(`/image/jobs/${job.id}`);
+            status = current.status;
+            setProgress(current.progress ?? null);
+            if (current.preview_seq && current.preview_seq !== previewSeq) {
+              previewSeq = current.preview_seq;
+              await loadPreview(job.id);
+            }
+          }
+          jobId.current = null;
+          if (status === 'cancelled') {
+            setError('Generation cancelled');
+            return;
+          }
+          const result = await apiFetch(`/image/jobs/${job.id}/result`);
+          setImages(result.images); // Ссылки на файлы в хранилище бэкенда
         } catch (err: any) {
           setError(err.message);
         }
@@ -68,14 +120,34 @@ export default function ImageGenPage() {
         </p>
       )}
 
-      {isSubmitting && <p>Generating image, this may take a minute...</p>}
+      {isSubmitting && (
+        <div className="space-y-3">
+          <p>
+            {progress === null
+              ? 'Generating image, this may take a minute...'
+              : `Generating... ${Math.round(progress * 100)}%`}
+          </p>
+          {preview && (
+            // eslint-disable-next-line @next/next/no-img-element
+            <img src={preview} alt="Preview" className="w-64 rounded-lg border border-neutral-800" />
+          )}
+          <button
+            type="button"
+            onClick={onCancel}
+            className="rounded-lg border border-neutral-700 px-4 py-2 text-sm hover:bg-neutral-800"
+          >
+            Cancel
+          </button>
+        </div>
+      )}
 
       {images.length > 0 && (
         <div className="grid grid-cols-1 gap-4 md:grid-cols-2">
-          {images.map((imgBase64, idx) => (
-            <div key={idx} className="overflow-hidden rounded-lg border border-neutral-800">
+          {images.map((img, idx) => (
+            <div key={img.id} className="overflow-hidden rounded-lg border border-neutral-800">
               <NextImage
-                src={`data:image/png;base64,${imgBase64}`}
+                src={`${process.env.NEXT_PUBLIC_API_URL}${img.variants.webp ?? img.url}`}
+                unoptimized
                 alt={`Generated image ${idx + 1}`}
                 width={1024}
                 height={1024}